@@ -0,0 +1,366 @@
+"""
+Benchmark the statement, KPI, ingestion and FX paths on synthetic ledgers
+
+    cd backend
+    python -m benchmarks.run --rows 10k,1m --save benchmarks/baselines/local.json
+    python -m benchmarks.run --rows 10k --compare benchmarks/baselines/local.json
+
+Every case runs ``--repeat`` times on a ledger with an empty memo cache
+(what a request posting its transactions pays; stored datasets pay it
+once) and reports the best and median wall time, throughput in rows per
+second and, from one extra run under tracemalloc, the peak memory
+allocated by the call. ``--compare`` exits with status 1 when a case's
+median time, or its peak memory, exceeds the baseline by more than
+``--tolerance``. Timings are only compared against a baseline recorded on
+the same host (see ``host_id``); on another machine only memory is checked.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import pandas as pd
+import numpy as np
+from benchmarks.synthetic import synthetic_frame, write_csv
+from services.consolidation import ConsolidationEngine
+from services.csv_ingestion import CSVIngestor
+from services.financial_statements import FinancialStatementGenerator
+from services.fx_rate_service import FXRateService
+from services.fx_rate_store import FXRateStore
+from services.kpi_calculator import KPICalculator
+from services.ledger import Ledger
+from services.transaction_screen import DETECTORS
+
+
+REPORTING_CURRENCY = 'USD'
+FX_RATES = {'USD': 1.0, 'AUD': 1.5, 'EUR': 0.92, 'GBP': 0.79}
+
+
+@dataclass
+class Workload:
+    """A synthetic ledger and what the cases share for one row count"""
+
+    rows: int
+    frame: pd.DataFrame
+    ledger: Ledger
+    csv_path: str
+    as_of_date: str
+    generator: FinancialStatementGenerator = field(default_factory=FinancialStatementGenerator)
+    kpi: KPICalculator = field(default_factory=KPICalculator)
+    _records: Optional[List[Dict]] = None
+    _fx_store: Optional[FXRateStore] = None
+
+    def fresh_ledger(self) -> Ledger:
+        """The same rows with an empty memo cache (no re-parse or re-sort)"""
+        return Ledger(self.ledger.frame, self.ledger.entity, self.ledger.is_debit, self.ledger.is_credit)
+
+    def records(self) -> List[Dict]:
+        """The rows as a JSON request body would deliver them"""
+        if self._records is None:
+            frame = self.frame.assign(date=self.frame['date'].dt.strftime('%Y-%m-%d'))
+            self._records = frame.astype(object).to_dict('records')
+        return self._records
+
+    def fx_store(self) -> FXRateStore:
+        """In-memory rate store with a table for every day of the ledger"""
+        if self._fx_store is None:
+            self._fx_store = FXRateStore(':memory:')
+            for day in np.unique(self.ledger.date.astype('datetime64[D]')):
+                self._fx_store.put('api', REPORTING_CURRENCY, str(day), rate_table(str(day)))
+        return self._fx_store
+
+
+def rate_table(date: str) -> Dict[str, float]:
+    """Synthetic rates for a day, the same on every run"""
+    rng = np.random.default_rng(int(np.datetime64(date, 'D').astype(np.int64)))
+    rates = {currency: rate * (1 + rng.normal(0, 0.01)) for currency, rate in FX_RATES.items()}
+    rates[REPORTING_CURRENCY] = 1.0
+    return rates
+
+
+class StubRateService(FXRateService):
+    """
+    FXRateService whose rate API serves ``rate_table``, so a run never waits
+    on the network (or falls back) for a date missing from the store
+    """
+
+    async def _fetch_json(self, url: str) -> Dict:
+        # {base_url}/latest/{base} or {base_url}/history/{base}/{date}
+        if '/latest/' in url:
+            date = datetime.now().strftime('%Y-%m-%d')
+            return {"base": url.rsplit('/', 1)[-1], "date": date, "rates": rate_table(date)}
+        _, _, base, date = url.rsplit('/', 3)
+        return {"base": base, "rates": {date: rate_table(date)}}
+
+
+@dataclass(frozen=True)
+class Case:
+    """
+    A timed call: ``prepare(ledger, workload)`` does the untimed setup and returns it
+    """
+
+    name: str
+    prepare: Callable[[Ledger, Workload], Callable[[], object]]
+    max_rows: Optional[int] = None
+
+
+def _ingest_csv(ledger: Ledger, w: Workload):
+    def run():
+        with open(w.csv_path, 'rb') as source:
+            return CSVIngestor().ingest(source)
+    return run
+
+
+def _screen_csv(ledger: Ledger, w: Workload):
+    ingestor = CSVIngestor()
+
+    def chunks():
+        with open(w.csv_path, 'rb') as source:
+            for chunk in ingestor.chunks(source):
+                yield Ledger.from_frame(chunk)
+    return lambda: w.kpi.screen_chunks(chunks)
+
+
+def _from_transactions(ledger: Ledger, w: Workload):
+    records = w.records()
+    return lambda: Ledger.from_transactions(records)
+
+
+def _statements_from_aggregates(ledger: Ledger, w: Workload):
+    aggregates = w.kpi.aggregate(ledger)
+    return lambda: w.generator.generate_from_aggregates(aggregates)
+
+
+def _kpis_from_aggregates(ledger: Ledger, w: Workload):
+    aggregates = w.kpi.aggregate(ledger)
+    return lambda: w.kpi.compute_from_aggregates(aggregates, as_of_date=w.as_of_date)
+
+
+def _fx_convert(ledger: Ledger, w: Workload):
+    # A new service per run so its in-process cache starts cold; tables come from the store
+    service = StubRateService(base_url='http://rates.invalid', store=w.fx_store())
+    return lambda: asyncio.run(service.convert_ledger(ledger, REPORTING_CURRENCY))
+
+
+def _consolidate(ledger: Ledger, w: Workload):
+    engine = ConsolidationEngine(w.generator)
+
+    def run():
+        try:
+            return engine.consolidate(ledger, eliminate_intercompany=True)
+        finally:
+            engine.shutdown()
+    return run
+
+
+CASES = (
+    Case('ingest.csv', _ingest_csv),
+    Case('ingest.screen_csv', _screen_csv),
+    Case('ledger.from_frame', lambda ledger, w: lambda: Ledger.from_frame(w.frame)),
+    # Beyond a million rows a JSON list of dicts is not a realistic request body
+    Case('ledger.from_transactions', _from_transactions, max_rows=1000000),
+    Case('statements.balance_sheet', lambda ledger, w: lambda: w.generator.generate_balance_sheet(ledger)),
+    Case('statements.profit_loss', lambda ledger, w: lambda: w.generator.generate_profit_loss(ledger)),
+    Case('statements.cash_flow', lambda ledger, w: lambda: w.generator.generate_cash_flow(ledger)),
+    Case('statements.comparative_month', lambda ledger, w: lambda: w.generator.generate_comparative(ledger)),
+    Case('statements.from_aggregates', _statements_from_aggregates),
+    Case('kpi.aggregate', lambda ledger, w: lambda: w.kpi.aggregate(ledger)),
+    Case('kpi.from_aggregates', _kpis_from_aggregates),
+    Case('kpi.ar_aging', lambda ledger, w: lambda: w.kpi.calculate_ar_aging(ledger, as_of_date=w.as_of_date)),
+    Case('kpi.dso', lambda ledger, w: lambda: w.kpi.calculate_dso(ledger)),
+    Case('kpi.dso_series', lambda ledger, w: lambda: w.kpi.calculate_dso_series(ledger)),
+    Case('kpi.revenue_ytd',
+         lambda ledger, w: lambda: w.kpi.calculate_revenue_ytd(ledger, as_of_date=w.as_of_date)),
+    Case('kpi.revenue_variance',
+         lambda ledger, w: lambda: w.kpi.calculate_revenue_variance(ledger, as_of_date=w.as_of_date)),
+    Case('kpi.trailing_3m',
+         lambda ledger, w: lambda: w.kpi.calculate_trailing_3m_revenue(ledger, as_of_date=w.as_of_date)),
+    Case('kpi.revenue_range',
+         lambda ledger, w: lambda: w.kpi.calculate_revenue_range(ledger, end_date=w.as_of_date)),
+    Case('kpi.top_n', lambda ledger, w: lambda: w.kpi.find_top_n_revenue(ledger, n=10, per_entity=True)),
+    Case('kpi.unusual_transactions',
+         lambda ledger, w: lambda: w.kpi.find_unusual_transactions(ledger, detectors=list(DETECTORS), limit=100)),
+    Case('kpi.batch', lambda ledger, w: lambda: w.kpi.compute_many(ledger, as_of_date=w.as_of_date)),
+    Case('fx.convert_ledger', _fx_convert),
+    Case('consolidation.consolidate', _consolidate),
+)
+
+
+def build_workload(rows: int, args, directory: str) -> Workload:
+    frame = synthetic_frame(
+        rows, entities=args.entities, accounts=args.accounts, start_date=args.start_date,
+        days=args.days, currencies=list(FX_RATES), seed=args.seed
+    )
+    csv_path = os.path.join(directory, f"ledger_{rows}.csv")
+    write_csv(frame, csv_path)
+    ledger = Ledger.from_frame(frame)
+    _, last = ledger.date_span()
+    return Workload(rows, frame, ledger, csv_path, last.strftime('%Y-%m-%d'))
+
+
+def measure(case: Case, workload: Workload, repeat: int, memory: bool) -> Dict:
+    """
+    Best and median seconds over ``repeat`` cold runs, and the traced peak of one more
+    """
+    timings = []
+    for _ in range(repeat):
+        call = case.prepare(workload.fresh_ledger(), workload)
+        gc.collect()
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    result = {
+        "seconds": round(best, 6),
+        "median_seconds": round(statistics.median(timings), 6),
+        "rows_per_sec": round(workload.rows / best, 1) if best > 0 else None,
+    }
+    if memory:
+        call = case.prepare(workload.fresh_ledger(), workload)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result["peak_mb"] = round(peak / 2 ** 20, 2)
+    return result
+
+
+def host_id() -> str:
+    """The machine a run was recorded on; timings only compare between runs on the same one"""
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}cpu"
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float, min_seconds: float, timings: bool = True) -> List[str]:
+    """
+    Cases whose median time, or peak memory, exceeds the baseline by more than ``tolerance``
+    Timings below ``min_seconds`` are too noisy to gate on; ``timings=False`` checks memory only
+    """
+    regressions = []
+    for rows, cases in current["results"].items():
+        for name, result in cases.items():
+            base = baseline.get("results", {}).get(rows, {}).get(name)
+            if not base:
+                continue
+            # Baselines from before median_seconds was recorded only have the best time
+            base_seconds = base.get("median_seconds", base["seconds"])
+            limit = base_seconds * (1 + tolerance)
+            if timings and result["median_seconds"] > max(limit, min_seconds):
+                regressions.append(
+                    f"{name} @ {rows} rows: median {result['median_seconds']:.4f}s vs baseline {base_seconds:.4f}s"
+                )
+            if "peak_mb" in result and "peak_mb" in base:
+                # Ignore allocator noise of under a megabyte
+                if result["peak_mb"] > max(base["peak_mb"] * (1 + tolerance), base["peak_mb"] + 1):
+                    regressions.append(
+                        f"{name} @ {rows} rows: peak {result['peak_mb']:.1f} MB vs baseline {base['peak_mb']:.1f} MB"
+                    )
+    return regressions
+
+
+def parse_rows(value: str) -> List[int]:
+    """'10k,1m,10m' -> [10000, 1000000, 10000000]"""
+    sizes = []
+    for part in value.split(','):
+        part = part.strip().lower()
+        if not part:
+            continue
+        scale = {'k': 1000, 'm': 1000000}.get(part[-1], 1)
+        sizes.append(int(float(part.rstrip('km')) * scale))
+    return sizes
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="FinTool backend benchmarks")
+    parser.add_argument('--rows', default='10k,1m', help="comma-separated row counts, e.g. 10k,1m,10m")
+    parser.add_argument('--entities', type=int, default=20)
+    parser.add_argument('--accounts', type=int, default=40)
+    parser.add_argument('--start-date', default='2023-01-01')
+    parser.add_argument('--days', type=int, default=730, help="date span of the ledger in days")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cases', default='', help="comma-separated name prefixes to run (default: all)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc run")
+    parser.add_argument('--save', help="write the results as a JSON baseline")
+    parser.add_argument('--compare', help="baseline JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=float(os.getenv("BENCH_TOLERANCE", "0.5")),
+                        help="allowed slowdown or memory growth, 0.5 = 50%% (default BENCH_TOLERANCE or 0.5)")
+    parser.add_argument('--min-seconds', type=float, default=0.01, help="median times below this are not gated")
+    parser.add_argument('--any-host', action='store_true',
+                        help="compare timings even against a baseline recorded on another host")
+    args = parser.parse_args(argv)
+
+    prefixes = [prefix.strip() for prefix in args.cases.split(',') if prefix.strip()]
+    cases = [case for case in CASES if not prefixes or any(case.name.startswith(p) for p in prefixes)]
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "host": host_id(),
+            "cpu_count": os.cpu_count(),
+            "entities": args.entities,
+            "accounts": args.accounts,
+            "days": args.days,
+            "repeat": args.repeat,
+        },
+        "results": {}
+    }
+
+    with tempfile.TemporaryDirectory(prefix='fintool-bench-') as directory:
+        for rows in parse_rows(args.rows):
+            started = time.perf_counter()
+            workload = build_workload(rows, args, directory)
+            print(f"\n{rows:,} rows (generated in {time.perf_counter() - started:.1f}s, "
+                  f"CSV {os.path.getsize(workload.csv_path) / 2 ** 20:.1f} MB)")
+            print(f"{'case':<32}{'best s':>10}{'median s':>10}{'rows/s':>14}{'peak MB':>10}")
+            results = report["results"].setdefault(str(rows), {})
+            for case in cases:
+                if case.max_rows is not None and rows > case.max_rows:
+                    continue
+                result = measure(case, workload, args.repeat, not args.no_memory)
+                results[case.name] = result
+                print(f"{case.name:<32}{result['seconds']:>10.4f}{result['median_seconds']:>10.4f}"
+                      f"{result['rows_per_sec'] or 0:>14,.0f}{result.get('peak_mb', float('nan')):>10.1f}")
+            del workload
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        same_host = baseline.get("meta", {}).get("host") == report["meta"]["host"]
+        timings = same_host or args.any_host
+        if not timings:
+            print(f"\n{args.compare} was recorded on another host: checking peak memory only "
+                  f"(record a baseline on this machine, or pass --any-host)")
+        regressions = compare(report, baseline, args.tolerance, args.min_seconds, timings)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+from typing import Optional, Sequence
+import pandas as pd
+import numpy as np
+
+
+# (debit account, credit account, relative frequency, typical amount)
+POSTINGS = (
+    ('Accounts Receivable', 'Sales Revenue', 30, 2500.0),
+    ('Cash', 'Accounts Receivable', 22, 2500.0),
+    ('Cash', 'Service Income', 8, 1200.0),
+    ('Salaries Expense', 'Cash', 12, 4000.0),
+    ('Rent Expense', 'Cash', 3, 6000.0),
+    ('Utilities Expense', 'Cash', 3, 450.0),
+    ('Inventory', 'Accounts Payable', 8, 3000.0),
+    ('Accounts Payable', 'Cash', 7, 3000.0),
+    ('Cost of Goods Sold', 'Inventory', 4, 1800.0),
+    ('Equipment', 'Cash', 1, 15000.0),
+    ('Cash', 'Loans Payable', 1, 50000.0),
+    ('Cash', 'Common Stock', 1, 100000.0),
+)
+
+
+def synthetic_frame(
+    rows: int,
+    entities: int = 20,
+    accounts: int = 40,
+    start_date: str = '2023-01-01',
+    days: int = 730,
+    currencies: Optional[Sequence[str]] = None,
+    seed: int = 0
+) -> pd.DataFrame:
+    """
+    Balanced double-entry ledger of ``rows`` rows (date, account, amount, type, entity[, currency])
+
+    Every transaction is a debit and a credit row of the same amount on the
+    same day, drawn from a fixed mix of sales, collections, payroll,
+    purchases and financing. ``accounts`` splits each base account into
+    numbered sub-accounts ("Sales Revenue 02") so the chart has that many
+    names while keeping its classification; transactions come in random
+    date order, as uploads do. Text columns are categoricals so tens of
+    millions of rows stay affordable.
+    """
+    rng = np.random.default_rng(seed)
+    transactions = (rows + 1) // 2
+
+    bases = list(dict.fromkeys(name for posting in POSTINGS for name in posting[:2]))
+    names, leaves = _chart(bases, max(accounts, len(bases)))
+
+    weights = np.array([posting[2] for posting in POSTINGS], dtype=float)
+    kinds = rng.choice(len(POSTINGS), size=transactions, p=weights / weights.sum())
+    scales = np.array([posting[3] for posting in POSTINGS])[kinds]
+    amounts = np.round(scales * rng.lognormal(0.0, 0.6, transactions), 2)
+    # A few round figures for the anomaly detectors to find
+    rounded = rng.random(transactions) < 0.02
+    amounts[rounded] = np.maximum(np.round(amounts[rounded], -3), 1000.0)
+
+    debit_accounts = _pick_leaves(rng, leaves, [bases.index(posting[0]) for posting in POSTINGS], kinds)
+    credit_accounts = _pick_leaves(rng, leaves, [bases.index(posting[1]) for posting in POSTINGS], kinds)
+    dates = np.datetime64(start_date, 'D') + rng.integers(0, days, transactions)
+    entity_codes = rng.integers(0, entities, transactions)
+
+    # Debit then credit row of each transaction
+    def pair(values: np.ndarray) -> np.ndarray:
+        return np.repeat(values, 2)[:rows]
+
+    types = np.tile([0, 1], transactions)[:rows]
+    frame = pd.DataFrame({
+        'date': pd.to_datetime(pair(dates)),
+        'account': pd.Categorical.from_codes(
+            np.column_stack([debit_accounts, credit_accounts]).ravel()[:rows], categories=names
+        ),
+        'amount': pair(amounts),
+        'type': pd.Categorical.from_codes(types, categories=['debit', 'credit']),
+        'entity': pd.Categorical.from_codes(
+            pair(entity_codes), categories=[f"Entity {code + 1:02d}" for code in range(entities)]
+        ),
+    })
+    if currencies:
+        currency_codes = rng.integers(0, len(currencies), transactions)
+        frame['currency'] = pd.Categorical.from_codes(pair(currency_codes), categories=list(currencies))
+    return frame
+
+
+def write_csv(frame: pd.DataFrame, path: str):
+    """
+    Write a synthetic frame in the upload CSV layout
+    """
+    frame.to_csv(path, index=False, date_format='%Y-%m-%d', float_format='%.2f', chunksize=500000)
+
+
+def _chart(bases: Sequence[str], accounts: int):
+    """Account names and, per base account, the codes of its sub-accounts"""
+    per_base = np.full(len(bases), accounts // len(bases))
+    per_base[:accounts % len(bases)] += 1
+    names, leaves = [], []
+    for base, count in zip(bases, per_base):
+        codes = list(range(len(names), len(names) + count))
+        names.extend([base] if count == 1 else [f"{base} {index + 1:02d}" for index in range(count)])
+        leaves.append(np.array(codes))
+    return names, leaves
+
+
+def _pick_leaves(rng, leaves, base_of_kind, kinds: np.ndarray) -> np.ndarray:
+    """A random sub-account of each transaction's base account"""
+    bases = np.array(base_of_kind)[kinds]
+    counts = np.array([len(codes) for codes in leaves])
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    flat = np.concatenate(leaves)
+    return flat[offsets[bases] + (rng.random(len(kinds)) * counts[bases]).astype(np.int64)]
@@ -1,16 +1,23 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import pandas as pd
-import io
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
 import os
+import json
 from dotenv import load_dotenv
 from services.financial_statements import FinancialStatementGenerator
 from services.ai_agent import AIAgent
 from services.kpi_calculator import KPICalculator
 from services.fx_rate_service import FXRateService
+from services.ledger import Ledger
+from services.dataset_store import DatasetStore
+from services.csv_ingestion import CSVIngestor, CSVValidationError
+from services.columnar_response import negotiate_format, frame_response
+from services.consolidation import ConsolidationEngine
+from services.metrics import REGISTRY as metrics_registry, MetricsMiddleware
+from services.compute_pool import ComputePool, ComputePoolSaturated, ComputeTimeout
 from services.kpi_calculator import KPICalculator
 from services.fx_rate_service import FXRateService
 
@@ -25,25 +32,84 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Request latency per route and per-stage timings (GET /api/metrics, Server-Timing headers)
+app.add_middleware(MetricsMiddleware)
+
 # Initialize services
 statement_generator = FinancialStatementGenerator()
-ai_agent = AIAgent()
+# Chat parsing and context building go through the compute pool too
+ai_agent = AIAgent(offload=lambda fn, *args: compute(fn, *args, process_safe=False))
 kpi_calculator = KPICalculator()
 fx_service = FXRateService()
 kpi_calculator = KPICalculator()
 fx_service = FXRateService()
+dataset_store = DatasetStore()
+csv_ingestor = CSVIngestor()
+consolidation_engine = ConsolidationEngine(statement_generator)
+# CPU-bound statement/KPI work runs here instead of on the event loop
+compute_pool = ComputePool()
+
+
+@app.on_event("startup")
+async def start_services():
+    fx_service.start()
+
+
+@app.on_event("shutdown")
+async def stop_services():
+    await fx_service.aclose()
+    consolidation_engine.shutdown()
+    compute_pool.shutdown()
+
+
+class ColumnarTransactions(BaseModel):
+    """
+    Transactions as parallel arrays, one entry per row. A column named in
+    ``dictionaries`` holds integer codes into that list (-1 for missing),
+    e.g. {"account": [0, 1, 0], "dictionaries": {"account": ["Cash", "Sales"]}}
+    """
+    date: List[Any]
+    account: List[Any]
+    amount: List[Any]
+    type: List[Any]
+    entity: Optional[List[Any]] = None
+    currency: Optional[List[Any]] = None
+    dictionaries: Dict[str, List[str]] = {}
 
 
 class FinancialData(BaseModel):
-    data: Dict
+    data: Dict = {}
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    entity: Optional[str] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    reporting_currency: Optional[str] = None
 
 
 class VarianceAnalysisRequest(BaseModel):
-    current_period: Dict
-    previous_period: Dict
-    period_name: str
+    current_period: Optional[Dict] = None
+    previous_period: Optional[Dict] = None
+    period_name: Optional[str] = None
+    # Alternatively let the server build both periods from a ledger
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    entity: Optional[str] = None
+    frequency: str = 'month'
+    periods: Optional[List[str]] = None
+
+
+class ComparativeStatementsRequest(BaseModel):
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    entity: Optional[str] = None
+    frequency: str = 'month'
+    periods: Optional[List[str]] = None
 
 
 class KPIAnalysisRequest(BaseModel):
@@ -55,20 +121,102 @@ class ChatRequest(BaseModel):
     message: str
     financial_data: Optional[Dict] = None
     transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
     conversation_history: Optional[List[Dict]] = None
     entity: Optional[str] = None
+    stream: bool = False
 
 
 class EntityRequest(BaseModel):
-    transactions: List[Dict]
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    entity: Optional[str] = None
+
+
+class RevenueRequest(BaseModel):
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
     entity: Optional[str] = None
+    as_of_date: Optional[str] = None
+
+
+class RevenueRangeRequest(BaseModel):
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    entity: Optional[str] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    category: Optional[str] = None
+
+
+class TopNRequest(BaseModel):
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    entity: Optional[str] = None
+    n: Optional[int] = 10
+    per_entity: bool = False
+
+
+class UnusualTransactionsRequest(BaseModel):
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    entity: Optional[str] = None
+    detectors: Optional[List[str]] = None
+    offset: int = 0
+    limit: Optional[int] = None
+
+
+class ConsolidationRequest(BaseModel):
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    eliminate_intercompany: bool = False
+    include_entities: bool = True
 
 
 class KPICalculationRequest(BaseModel):
-    transactions: List[Dict]
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
     entity: Optional[str] = None
     as_of_date: Optional[str] = None
     period_days: Optional[int] = 30
+    bucket_edges: Optional[List[int]] = None
+
+
+class DSOSeriesRequest(BaseModel):
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    entity: Optional[str] = None
+    period_days: Optional[int] = 30
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    lookback_days: Optional[int] = 730
+    by_entity: bool = True
+
+
+class KPIBatchRequest(BaseModel):
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
+    dataset_id: Optional[str] = None
+    kpis: Optional[List[str]] = None
+    entity: Optional[str] = None
+    as_of_date: Optional[str] = None
+    period_days: Optional[int] = 30
+    n: Optional[int] = 10
+    bucket_edges: Optional[List[int]] = None
+
+
+class AppendRequest(BaseModel):
+    transactions: Optional[List[Dict]] = None
+    columns: Optional[ColumnarTransactions] = None
 
 
 class FXRateRequest(BaseModel):
@@ -83,42 +231,110 @@ class FXConvertRequest(BaseModel):
     date: Optional[str] = None
 
 
+async def compute(fn, *args, **kwargs):
+    """
+    Run CPU-bound work on the compute pool
+    A saturated pool answers 429 with Retry-After, a computation over its timeout 503
+    """
+    try:
+        return await compute_pool.run(fn, *args, **kwargs)
+    except ComputePoolSaturated as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Server busy, please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except ComputeTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+def stored_ledger(dataset_id: str) -> Ledger:
+    ledger = dataset_store.get(dataset_id)
+    if ledger is None:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+    return ledger
+
+
+async def resolve_ledger(
+    dataset_id: Optional[str],
+    transactions: Optional[List[Dict]],
+    columns: Optional[ColumnarTransactions] = None,
+    entity: Optional[str] = None
+) -> Ledger:
+    """
+    Ledger for a request: the stored dataset when an ID is given, else the posted
+    columnar arrays or transaction list (parsed on the compute pool), restricted
+    to ``entity`` when given
+    """
+    if dataset_id:
+        ledger = stored_ledger(dataset_id)
+    else:
+        try:
+            if columns is not None:
+                arrays = {
+                    name: getattr(columns, name) for name in ('date', 'account', 'amount', 'type', 'entity', 'currency')
+                    if getattr(columns, name) is not None
+                }
+                ledger = await compute(Ledger.from_columns, arrays, columns.dictionaries)
+            elif not transactions:
+                raise HTTPException(status_code=400, detail="No transactions provided")
+            else:
+                ledger = await compute(Ledger.from_transactions, transactions)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if entity:
+        # Gathering the entity's rows is O(rows) on first use (memoized on the ledger)
+        ledger = await compute(ledger.for_entity, entity, process_safe=False)
+    return ledger
+
+
 @app.get("/")
 async def root():
     return {"message": "Financial Statement Generator API"}
 
 
 @app.post("/api/upload-csv")
-async def upload_csv(file: UploadFile = File(...)):
+async def upload_csv(
+    file: UploadFile = File(...),
+    include_rows: bool = True,
+    accept: Optional[str] = Header(None)
+):
     """
     Upload and parse CSV file containing financial transactions
+    The parsed ledger is kept server-side; pass the returned dataset_id to other endpoints
+    Send an Arrow or Parquet Accept header to receive the rows as a columnar body
     """
     try:
         if not file.filename.endswith('.csv'):
             raise HTTPException(status_code=400, detail="File must be a CSV")
         
-        contents = await file.read()
-        df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        
-        # Validate required columns
-        required_columns = ['date', 'account', 'amount', 'type']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Missing required columns: {', '.join(missing_columns)}"
-            )
+        # Stream the spooled upload through the chunked parser off the event loop;
+        # required columns are validated on the first chunk
+        try:
+            ledger, ingestion = await compute(csv_ingestor.ingest, file.file, process_safe=False)
+        except CSVValidationError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Process and return parsed data
-        transactions = df.to_dict('records')
+        # Sizing the ledger scans its text columns
+        dataset_id = await compute(dataset_store.put, ledger, process_safe=False)
         
-        return JSONResponse({
+        response = {
             "success": True,
             "message": "CSV uploaded successfully",
-            "transactions": transactions,
-            "row_count": len(transactions)
-        })
+            "dataset_id": dataset_id,
+            "row_count": len(ledger),
+            "ingestion": ingestion
+        }
+        fmt = negotiate_format(accept)
+        if fmt and include_rows:
+            return await compute(frame_response, ledger.frame, fmt, metadata=response, process_safe=False)
+        if include_rows:
+            response["transactions"] = await compute(ledger.to_records, process_safe=False)
+        
+        return JSONResponse(response)
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -129,23 +345,66 @@ async def generate_statements(data: FinancialData):
     Generate Balance Sheet, Profit & Loss, and Cash Flow statements
     """
     try:
-        transactions = data.data.get('transactions', [])
+        # Unfiltered stored datasets are served from their running aggregates
+        if data.dataset_id and not (data.entity or data.start_date or data.end_date or data.reporting_currency):
+            aggregates = await compute(
+                dataset_store.aggregates, data.dataset_id, kpi_calculator.aggregate, process_safe=False
+            )
+            if aggregates is None:
+                raise HTTPException(status_code=404, detail=f"Dataset not found: {data.dataset_id}")
+            statements = await compute(statement_generator.generate_from_aggregates, aggregates)
+            return JSONResponse({"success": True, **statements})
         
-        if not transactions:
-            raise HTTPException(status_code=400, detail="No transactions provided")
+        # Parse once and share the ledger across all financial statements
+        ledger = await resolve_ledger(data.dataset_id, data.data.get('transactions'), data.columns, data.entity)
+        if data.start_date or data.end_date:
+            ledger = await compute(ledger.between, data.start_date, data.end_date, process_safe=False)
+        if len(ledger) == 0:
+            raise HTTPException(status_code=400, detail="No transactions match the selected filters")
         
-        # Generate all financial statements
-        balance_sheet = statement_generator.generate_balance_sheet(transactions)
-        profit_loss = statement_generator.generate_profit_loss(transactions)
-        cash_flow = statement_generator.generate_cash_flow(transactions)
+        # Consolidate multi-currency ledgers into one reporting currency
+        fx = None
+        if data.reporting_currency:
+            try:
+                ledger, fx = await fx_service.convert_ledger(ledger, data.reporting_currency)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
         
-        return JSONResponse({
+        response = {
             "success": True,
-            "balance_sheet": balance_sheet,
-            "profit_loss": profit_loss,
-            "cash_flow": cash_flow
-        })
+            **await compute(statement_generator.generate_statements, ledger)
+        }
+        if fx is not None:
+            response["fx"] = fx
+        return JSONResponse(response)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/generate-comparative-statements")
+async def generate_comparative_statements(request: ComparativeStatementsRequest):
+    """
+    Balance Sheet, Profit & Loss and Cash Flow side by side for several months, quarters or years
+    """
+    try:
+        ledger = await resolve_ledger(request.dataset_id, request.transactions, request.columns, request.entity)
+        try:
+            result = await compute(
+                statement_generator.generate_comparative,
+                ledger,
+                frequency=request.frequency,
+                periods=request.periods
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        return JSONResponse({"success": True, **result})
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -154,19 +413,56 @@ async def generate_statements(data: FinancialData):
 async def variance_analysis(request: VarianceAnalysisRequest):
     """
     AI-powered variance analysis comparing current vs previous period
+    Instead of posting both periods, pass a dataset_id (or transactions) and
+    optionally the periods: the last two of them are compared, by default the
+    last two months (or quarters/years with frequency) of the ledger
     """
     try:
+        current_period = request.current_period
+        previous_period = request.previous_period
+        period_name = request.period_name
+        comparative = None
+        
+        if request.dataset_id or request.transactions or request.columns:
+            ledger = await resolve_ledger(request.dataset_id, request.transactions, request.columns, request.entity)
+            try:
+                comparative = await compute(
+                    statement_generator.generate_comparative,
+                    ledger,
+                    frequency=request.frequency,
+                    periods=request.periods
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if len(comparative["periods"]) < 2:
+                raise HTTPException(status_code=400, detail="At least two periods are needed for a variance analysis")
+            previous_label, current_label = comparative["periods"][-2:]
+            current_period = comparative["figures"][current_label]
+            previous_period = comparative["figures"][previous_label]
+            period_name = period_name or f"{current_label} vs {previous_label}"
+        elif current_period is None or previous_period is None:
+            raise HTTPException(
+                status_code=400,
+                detail="Provide current_period and previous_period, or a dataset_id, transactions or columns"
+            )
+        
         analysis = await ai_agent.analyze_variance(
-            current_period=request.current_period,
-            previous_period=request.previous_period,
-            period_name=request.period_name
+            current_period=current_period,
+            previous_period=previous_period,
+            period_name=period_name or "Current Period"
         )
         
-        return JSONResponse({
+        response = {
             "success": True,
             "analysis": analysis
-        })
+        }
+        if comparative is not None:
+            response["periods"] = comparative["periods"]
+            response["figures"] = comparative["figures"]
+        return JSONResponse(response)
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -187,6 +483,8 @@ async def kpi_analysis(request: KPIAnalysisRequest):
             "analysis": analysis
         })
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -197,10 +495,30 @@ async def ai_chat(request: ChatRequest):
     Conversational AI agent for financial analysis - handles any financial-related questions
     """
     try:
+        # Parsed on the compute pool; a stored ledger is handed over itself so its
+        # entity aggregates are reused across turns
+        transactions = None
+        if request.dataset_id:
+            transactions = await resolve_ledger(request.dataset_id, None, None, request.entity)
+        elif request.columns is not None or request.transactions:
+            try:
+                transactions = await resolve_ledger(None, request.transactions, request.columns)
+            except HTTPException as e:
+                # Unparsable transactions leave the chat without a data context
+                if e.status_code != 400:
+                    raise
+        
+        if request.stream:
+            return StreamingResponse(
+                chat_events(request, transactions),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
         response = await ai_agent.chat(
             message=request.message,
             financial_data=request.financial_data,
-            transactions=request.transactions,
+            transactions=transactions,
             conversation_history=request.conversation_history,
             entity=request.entity
         )
@@ -211,45 +529,146 @@ async def ai_chat(request: ChatRequest):
             "data": response
         })
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def chat_events(request: ChatRequest, transactions):
+    """
+    Server-sent events for a streamed chat reply: {"delta": ...} per piece, then {"done": true}
+    """
+    try:
+        async for delta in ai_agent.chat_stream(
+            message=request.message,
+            financial_data=request.financial_data,
+            transactions=transactions,
+            conversation_history=request.conversation_history,
+            entity=request.entity
+        ):
+            yield f"data: {json.dumps({'delta': delta})}\n\n"
+        yield f"data: {json.dumps({'done': True})}\n\n"
+    except Exception as e:
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+
+@app.post("/api/consolidate")
+async def consolidate(request: ConsolidationRequest):
+    """
+    Stand-alone statements for every entity plus consolidated group statements,
+    optionally eliminating intercompany postings
+    """
+    try:
+        ledger = await resolve_ledger(request.dataset_id, request.transactions, request.columns)
+        result = await compute(
+            consolidation_engine.consolidate,
+            ledger,
+            eliminate_intercompany=request.eliminate_intercompany,
+            include_entities=request.include_entities
+        )
+        return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def entity_names(transactions: List[Dict]):
+    return Ledger.resolve_entity(pd.DataFrame(transactions)).dropna().unique()
+
+
 @app.post("/api/entities")
 async def get_entities(data: FinancialData):
     """
     Extract unique entities/subsidiaries from transactions
     """
     try:
+        if data.dataset_id or data.columns is not None:
+            ledger = await resolve_ledger(data.dataset_id, None, data.columns)
+            entities = pd.Series(ledger.entity).dropna().unique()
+            return JSONResponse({
+                "success": True,
+                "entities": sorted(str(entity) for entity in entities)
+            })
+        
         transactions = data.data.get('transactions', [])
         if not transactions:
             return JSONResponse({"entities": []})
         
-        entities = set()
-        for transaction in transactions:
-            entity = transaction.get('entity') or transaction.get('subsidiary') or transaction.get('company')
-            if entity:
-                entities.add(entity)
-        
+        entities = await compute(entity_names, transactions, process_safe=False)
         return JSONResponse({
             "success": True,
-            "entities": sorted(list(entities))
+            "entities": sorted(str(entity) for entity in entities)
         })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/kpi/batch")
+async def calculate_kpi_batch(request: KPIBatchRequest):
+    """
+    Calculate several KPIs in one call, sharing the parsed ledger and its masks
+    """
+    try:
+        unknown = [kpi for kpi in request.kpis or [] if kpi not in kpi_calculator.BATCH_KPIS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown KPIs: {', '.join(unknown)}")
+        
+        result = await compute(
+            kpi_calculator.compute_many,
+            await resolve_ledger(request.dataset_id, request.transactions, request.columns),
+            kpis=request.kpis,
+            entity=request.entity,
+            as_of_date=request.as_of_date,
+            period_days=request.period_days or 30,
+            n=request.n or 10,
+            bucket_edges=request.bucket_edges
+        )
+        return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/kpi/ar-aging")
-async def calculate_ar_aging(request: KPICalculationRequest):
+async def calculate_ar_aging(request: KPICalculationRequest, accept: Optional[str] = Header(None)):
     """
     Calculate Accounts Receivable Aging Report
+    Send an Arrow or Parquet Accept header to receive the detail lines as a columnar body
     """
     try:
-        result = kpi_calculator.calculate_ar_aging(
-            transactions=request.transactions,
-            as_of_date=request.as_of_date
+        ledger = await resolve_ledger(request.dataset_id, request.transactions, request.columns, request.entity)
+        fmt = negotiate_format(accept)
+        if fmt:
+            report, details = await compute(
+                kpi_calculator.calculate_ar_aging_frame, ledger,
+                as_of_date=request.as_of_date, bucket_edges=request.bucket_edges
+            )
+            if details is None:
+                details = ledger.frame.head(0).assign(
+                    open_amount=pd.Series(dtype='float64'),
+                    age_days=pd.Series(dtype='int64'),
+                    aging_bucket=pd.Series(dtype=object)
+                )
+            return await compute(frame_response, details, fmt, metadata=report, process_safe=False)
+        
+        result = await compute(
+            kpi_calculator.calculate_ar_aging,
+            transactions=ledger,
+            as_of_date=request.as_of_date,
+            bucket_edges=request.bucket_edges
         )
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -260,90 +679,200 @@ async def calculate_dso(request: KPICalculationRequest):
     Calculate Days Sales Outstanding (DSO)
     """
     try:
-        result = kpi_calculator.calculate_dso(
-            transactions=request.transactions,
+        result = await compute(
+            kpi_calculator.calculate_dso,
+            transactions=await resolve_ledger(request.dataset_id, request.transactions, request.columns, request.entity),
             period_days=request.period_days or 30
         )
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/kpi/dso-series")
+async def calculate_dso_series(request: DSOSeriesRequest):
+    """
+    Daily DSO over a date range (default the two years up to the last posting), overall and per entity
+    """
+    try:
+        result = await compute(
+            kpi_calculator.calculate_dso_series,
+            transactions=await resolve_ledger(request.dataset_id, request.transactions, request.columns, request.entity),
+            period_days=request.period_days or 30,
+            start_date=request.start_date,
+            end_date=request.end_date,
+            lookback_days=request.lookback_days or 730,
+            by_entity=request.by_entity
+        )
+        return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/kpi/revenue-ytd")
-async def calculate_revenue_ytd(request: EntityRequest):
+async def calculate_revenue_ytd(request: RevenueRequest):
     """
     Calculate Year-to-Date Revenue
     """
     try:
-        result = kpi_calculator.calculate_revenue_ytd(
-            transactions=request.transactions,
-            entity=request.entity
+        result = await compute(
+            kpi_calculator.calculate_revenue_ytd,
+            transactions=await resolve_ledger(request.dataset_id, request.transactions, request.columns),
+            entity=request.entity,
+            as_of_date=request.as_of_date
         )
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/kpi/revenue-variance")
-async def calculate_revenue_variance(request: EntityRequest):
+async def calculate_revenue_variance(request: RevenueRequest):
     """
     Calculate revenue variance vs previous month
     """
     try:
-        result = kpi_calculator.calculate_revenue_variance(
-            transactions=request.transactions,
-            entity=request.entity
+        result = await compute(
+            kpi_calculator.calculate_revenue_variance,
+            transactions=await resolve_ledger(request.dataset_id, request.transactions, request.columns),
+            entity=request.entity,
+            as_of_date=request.as_of_date
         )
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/kpi/trailing-3m")
-async def calculate_trailing_3m(request: EntityRequest):
+async def calculate_trailing_3m(request: RevenueRequest):
     """
     Calculate trailing 3 months rolling revenue
     """
     try:
-        result = kpi_calculator.calculate_trailing_3m_revenue(
-            transactions=request.transactions,
-            entity=request.entity
+        result = await compute(
+            kpi_calculator.calculate_trailing_3m_revenue,
+            transactions=await resolve_ledger(request.dataset_id, request.transactions, request.columns),
+            entity=request.entity,
+            as_of_date=request.as_of_date
         )
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/kpi/revenue-range")
+async def calculate_revenue_range(request: RevenueRangeRequest):
+    """
+    Revenue between two dates, in total and per revenue category
+    """
+    try:
+        result = await compute(
+            kpi_calculator.calculate_revenue_range,
+            transactions=await resolve_ledger(request.dataset_id, request.transactions, request.columns),
+            start_date=request.start_date,
+            end_date=request.end_date,
+            entity=request.entity,
+            category=request.category
+        )
+        return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/kpi/top-n")
-async def get_top_n_revenue(request: EntityRequest):
+async def get_top_n_revenue(request: TopNRequest):
     """
-    Get TOP N revenue transactions
+    Get TOP N revenue transactions (optionally per entity)
     """
     try:
-        n = 10  # Default
         entity = request.entity if isinstance(request.entity, str) else None
         
-        result = kpi_calculator.find_top_n_revenue(
-            transactions=request.transactions,
-            n=n,
-            entity=entity
+        result = await compute(
+            kpi_calculator.find_top_n_revenue,
+            transactions=await resolve_ledger(request.dataset_id, request.transactions, request.columns),
+            n=request.n or 10,
+            entity=entity,
+            per_entity=request.per_entity
         )
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/kpi/unusual-transactions")
-async def find_unusual_transactions(request: EntityRequest):
+async def find_unusual_transactions(request: UnusualTransactionsRequest):
     """
-    Find unusual transactions (e.g., weekend postings)
+    Find unusual transactions (weekend postings by default; see KPICalculator.find_unusual_transactions)
     """
     try:
-        result = kpi_calculator.find_unusual_transactions(
-            transactions=request.transactions,
-            entity=request.entity
+        if request.offset < 0 or (request.limit is not None and request.limit < 0):
+            raise HTTPException(status_code=400, detail="offset and limit must be non-negative")
+        result = await compute(
+            kpi_calculator.find_unusual_transactions,
+            transactions=await resolve_ledger(request.dataset_id, request.transactions, request.columns),
+            entity=request.entity,
+            detectors=request.detectors,
+            offset=request.offset,
+            limit=request.limit
         )
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/kpi/screen-csv")
+async def screen_csv(
+    file: UploadFile = File(...),
+    n: int = 10,
+    per_entity: bool = False,
+    detectors: Optional[str] = None,
+    limit: int = 100
+):
+    """
+    Stream a CSV through the TOP N revenue and anomaly screen without loading it whole
+    detectors is a comma-separated subset of the anomaly detectors (all by default)
+    """
+    try:
+        if not file.filename.endswith('.csv'):
+            raise HTTPException(status_code=400, detail="File must be a CSV")
+        
+        def chunks():
+            file.file.seek(0)
+            return (Ledger.from_frame(chunk) for chunk in csv_ingestor.chunks(file.file))
+        
+        names = [name.strip() for name in detectors.split(',') if name.strip()] if detectors else None
+        try:
+            result = await compute(
+                kpi_calculator.screen_chunks, chunks,
+                detectors=names, n=n, per_entity=per_entity, limit=limit, process_safe=False
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -355,10 +884,12 @@ async def get_fx_rates(base_currency: str = "USD", date: Optional[str] = None):
     """
     try:
         if date:
-            result = fx_service.get_historical_rates(date, base_currency)
+            result = await fx_service.get_historical_rates(date, base_currency)
         else:
-            result = fx_service.get_current_rates(base_currency)
+            result = await fx_service.get_current_rates(base_currency)
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -369,8 +900,56 @@ async def get_ato_fx_rates(year: str, month: str):
     Get FX rates from Australian Tax Office (ATO) website
     """
     try:
-        result = fx_service.get_ato_rates(year, month)
+        result = await fx_service.get_ato_rates(year, month)
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/fx/rates/as-of")
+async def get_fx_rate_as_of(currency: str, date: str, base_currency: str = "USD", source: str = "api"):
+    """
+    Rate for one currency on a date (previous business day when the date has none)
+    """
+    try:
+        result = await fx_service.rate_as_of(currency, date, base_currency, source)
+        if result is None:
+            raise HTTPException(status_code=404, detail=f"No {currency} rate on or before {date}")
+        return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/fx/rates/history")
+async def get_fx_rate_history(
+    currency: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    financial_year: Optional[int] = None,
+    base_currency: str = "USD",
+    source: str = "api"
+):
+    """
+    Locally stored rates for one currency over a date range or Australian financial year
+    """
+    try:
+        if financial_year:
+            start_date, end_date = fx_service.store.financial_year_range(financial_year)
+        if not start_date or not end_date:
+            raise HTTPException(status_code=400, detail="Provide start_date and end_date, or financial_year")
+        rates = fx_service.stored_rates(currency, start_date, end_date, base_currency, source)
+        return JSONResponse({
+            "success": True,
+            "data": {"currency": currency, "start_date": start_date, "end_date": end_date, "rates": rates}
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -381,20 +960,91 @@ async def convert_currency(request: FXConvertRequest):
     Convert currency amount
     """
     try:
-        result = fx_service.convert_currency(
+        result = await fx_service.convert_currency(
             amount=request.amount,
             from_currency=request.from_currency,
             to_currency=request.to_currency,
             date=request.date
         )
         return JSONResponse({"success": True, "data": result})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/datasets/{dataset_id}")
+async def get_dataset(dataset_id: str):
+    """
+    Describe a stored dataset
+    """
+    ledger = stored_ledger(dataset_id)
+    return JSONResponse({
+        "success": True,
+        "dataset_id": dataset_id,
+        "row_count": len(ledger),
+        "columns": list(ledger.frame.columns),
+        "size_bytes": await compute(dataset_store.sizeof, ledger, process_safe=False)
+    })
+
+
+@app.post("/api/datasets/{dataset_id}/append")
+async def append_to_dataset(dataset_id: str, request: AppendRequest):
+    """
+    Append transactions to a stored dataset and return the refreshed statements and KPIs
+    Only the new batch is aggregated; the dataset's running totals absorb it
+    """
+    try:
+        batch = await resolve_ledger(None, request.transactions, request.columns)
+        
+        appended = await compute(dataset_store.append, dataset_id, batch, kpi_calculator.aggregate, process_safe=False)
+        if appended is None:
+            raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+        ledger, aggregates = appended
+        
+        return JSONResponse({
+            "success": True,
+            "dataset_id": dataset_id,
+            "row_count": len(ledger),
+            **await compute(statement_generator.generate_from_aggregates, aggregates),
+            "kpis": await compute(kpi_calculator.compute_from_aggregates, aggregates)
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.delete("/api/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str):
+    """
+    Release a stored dataset
+    """
+    if not dataset_store.delete(dataset_id):
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+    return JSONResponse({"success": True})
+
+
+@app.get("/api/ai/cache")
+async def ai_cache_stats():
+    """
+    Hit/miss counters of the AI response cache
+    """
+    return JSONResponse({"success": True, "data": ai_agent.cache.stats()})
+
+
+@app.get("/api/metrics")
+async def metrics():
+    """
+    Request and stage latency histograms, rows processed and errors in the Prometheus text format
+    """
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy"}
+    # Answered on the event loop; heavy work is on the compute pool
+    return {"status": "healthy", "compute_pool": compute_pool.stats()}
 
 
 if __name__ == "__main__":
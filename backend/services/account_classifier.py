@@ -0,0 +1,86 @@
+import re
+from typing import Dict, List
+import pandas as pd
+import numpy as np
+from services.ledger import Ledger
+
+
+class AccountClassifier:
+    """
+    Maps account names to statement line items
+
+    Rules are grouped by category (e.g. "assets") and line item (e.g. "Cash").
+    An account belongs to a line item when every pattern of the item matches
+    it (case-insensitive, same semantics as ``str.contains``). Each distinct
+    account string is classified once and cached, so the ledger itself is
+    never scanned per line item.
+    """
+
+    SIDES = ('debit', 'credit')
+
+    def __init__(self, rules: Dict[str, Dict[str, List[str]]]):
+        self.rules = rules
+        self.items = [(category, item) for category, items in rules.items() for item in items]
+        self._patterns = [
+            [re.compile(pattern, re.IGNORECASE) for pattern in rules[category][item]]
+            for category, item in self.items
+        ]
+        self._cache: Dict[str, np.ndarray] = {}
+
+    def classify(self, accounts) -> np.ndarray:
+        """
+        Boolean membership matrix of shape (len(accounts), len(items))
+        """
+        rows = []
+        for account in accounts:
+            row = self._cache.get(account)
+            if row is None:
+                row = np.array([
+                    isinstance(account, str) and all(p.search(account) for p in patterns)
+                    for patterns in self._patterns
+                ], dtype=bool)
+                self._cache[account] = row
+            rows.append(row)
+
+        if not rows:
+            return np.zeros((0, len(self.items)), dtype=bool)
+        return np.vstack(rows)
+
+    def summarize(self, ledger: Ledger) -> pd.DataFrame:
+        """
+        Debit and credit totals per (category, item) from a single grouped pass
+
+        Rows are bucketed by (account, side) with one ``np.bincount``; the
+        per-account totals are then folded into line items through the
+        membership matrix of the distinct accounts.
+        """
+        return self.fold(self.account_totals(ledger))
+
+    def account_totals(self, ledger: Ledger) -> pd.DataFrame:
+        """
+        Debit and credit totals per distinct account
+        """
+        accounts = ledger.account
+        side_codes = np.where(ledger.is_debit, 0, np.where(ledger.is_credit, 1, -1))
+        amounts = np.nan_to_num(ledger.amount)
+
+        valid = (accounts.codes >= 0) & (side_codes >= 0)
+        keys = accounts.codes[valid].astype(np.int64) * 2 + side_codes[valid]
+        per_account = np.bincount(
+            keys, weights=amounts[valid], minlength=2 * len(accounts.categories)
+        ).reshape(-1, 2)
+
+        return pd.DataFrame(per_account, index=pd.Index(accounts.categories, name='account'), columns=list(self.SIDES))
+
+    def fold(self, account_totals: pd.DataFrame) -> pd.DataFrame:
+        """
+        Fold per-account debit/credit totals into (category, item) totals
+        """
+        membership = self.classify(account_totals.index)
+        totals = membership.T.astype(float) @ account_totals[list(self.SIDES)].to_numpy(dtype=float)
+
+        return pd.DataFrame(
+            totals,
+            index=pd.MultiIndex.from_tuples(self.items, names=['category', 'item']),
+            columns=list(self.SIDES)
+        )
@@ -1,18 +1,47 @@
 import os
-from typing import Dict, Optional, List
-from openai import OpenAI
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, List, Tuple, Union
+from openai import AsyncOpenAI
 import json
+from services.response_cache import ResponseCache
+from services.chat_context import ChatContextBuilder
+from services.entity_aggregates import entity_aggregates
+from services.ledger import Ledger
+from services.metrics import REGISTRY, stage
 
 
 class AIAgent:
     """
     AI Agent for financial analysis including variance analysis and KPI achievement
+
+    Completions go through ``AsyncOpenAI`` so a slow model round trip never
+    blocks the event loop; ``chat_stream`` yields the reply token by token.
+    ``OPENAI_BASE_URL`` can point the client at any compatible server.
+
+    Completions and fallback analyses are memoized in a ResponseCache keyed
+    by the model, the exact messages sent (system prompt, normalized
+    question, the data context derived from the ledger and the recent
+    history) and the sampling parameters. The size of each chat prompt
+    sent (as counted by the context builder) goes into a per-request
+    histogram in the metrics registry, for streamed replies too; the
+    token usage the API reports is added to running totals.
+
+    The pandas work of a chat turn (parsing, entity aggregates, the data
+    context, the fallback answer) goes through ``offload``, an async
+    ``(fn, *args)`` runner such as the server's compute pool; without one
+    it runs inline.
     """
     
-    def __init__(self):
+    CHAT_PARAMS = {"temperature": 0.7, "max_tokens": 1000}
+    
+    def __init__(self, offload: Optional[Callable[..., Awaitable]] = None):
+        self.offload = offload
         api_key = os.getenv("OPENAI_API_KEY")
+        self.model = os.getenv("OPENAI_MODEL", "gpt-4")
+        self.cache = ResponseCache()
+        self.context_builder = ChatContextBuilder()
         if api_key:
-            self.client = OpenAI(api_key=api_key)
+            self.client = AsyncOpenAI(api_key=api_key)
         else:
             self.client = None
             print("Warning: OPENAI_API_KEY not set. AI features will use fallback analysis.")
@@ -64,16 +93,13 @@ class AIAgent:
             }}
             """
             
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
+            analysis_text = await self._complete(
+                [
                     {"role": "system", "content": "You are a financial analyst expert. Provide detailed variance analysis in JSON format."},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3
             )
-            
-            analysis_text = response.choices[0].message.content
             # Try to extract JSON from the response
             try:
                 analysis = json.loads(analysis_text)
@@ -139,16 +165,13 @@ class AIAgent:
             }}
             """
             
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
+            analysis_text = await self._complete(
+                [
                     {"role": "system", "content": "You are a financial analyst expert. Provide detailed KPI analysis in JSON format."},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3
             )
-            
-            analysis_text = response.choices[0].message.content
             try:
                 analysis = json.loads(analysis_text)
             except:
@@ -165,8 +188,28 @@ class AIAgent:
             print(f"Error in AI KPI analysis: {e}")
             return self._fallback_kpi_analysis(financial_data, kpi_targets)
     
+    async def _complete(self, messages: List[Dict], prompt_tokens: Optional[int] = None, **params) -> str:
+        """
+        Completion text for a message list, served from the response cache when possible
+        ``prompt_tokens`` is recorded when the request is actually sent
+        """
+        async def compute():
+            if prompt_tokens is not None:
+                REGISTRY.observe_prompt(self.model, prompt_tokens)
+            with stage('openai.chat_completion'):
+                response = await self.client.chat.completions.create(model=self.model, messages=messages, **params)
+            if response.usage is not None:
+                REGISTRY.observe_tokens(self.model, response.usage.prompt_tokens, response.usage.completion_tokens)
+            return response.choices[0].message.content
+        return await self.cache.get_or_compute(self.cache.key(self.model, messages, params), compute)
+    
     def _fallback_variance_analysis(self, current: Dict, previous: Dict, period: str) -> Dict:
         """Fallback variance analysis without AI"""
+        cache_key = self.cache.key('fallback-variance', current, previous, period)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         key_variances = []
         
         # Simple comparison logic
@@ -188,7 +231,7 @@ class AIAgent:
                         "analysis": f"{'Increase' if variance > 0 else 'Decrease'} of {abs(pct_change):.2f}%"
                     })
         
-        return {
+        result = {
             "summary": f"Variance analysis for {period} - Calculated {len(key_variances)} variances",
             "key_variances": key_variances[:10],  # Limit to top 10
             "recommendations": [
@@ -197,9 +240,16 @@ class AIAgent:
             ],
             "risk_factors": ["Large variances may indicate data quality issues"]
         }
+        self.cache.set(cache_key, result)
+        return result
     
     def _fallback_kpi_analysis(self, financial_data: Dict, kpi_targets: Dict) -> Dict:
         """Fallback KPI analysis without AI"""
+        cache_key = self.cache.key('fallback-kpi', financial_data, kpi_targets)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         kpi_results = []
         
         for kpi_name, target in kpi_targets.items():
@@ -219,7 +269,7 @@ class AIAgent:
                     "analysis": f"{'Achieved' if status == 'achieved' else 'Not achieved'} - {achievement_pct:.2f}% of target"
                 })
         
-        return {
+        result = {
             "overall_performance": f"Analyzed {len(kpi_results)} KPIs",
             "kpi_results": kpi_results,
             "action_items": [
@@ -228,24 +278,128 @@ class AIAgent:
             ],
             "trends": "Historical trend analysis requires multiple periods of data"
         }
+        self.cache.set(cache_key, result)
+        return result
     
     async def chat(
         self,
         message: str,
         financial_data: Optional[Dict] = None,
-        transactions: Optional[List[Dict]] = None,
+        transactions: Optional[Union[Ledger, List[Dict]]] = None,
         conversation_history: Optional[List[Dict]] = None,
         entity: Optional[str] = None
     ) -> Dict:
         """
         General-purpose financial AI chat agent that can answer any financial-related questions
         """
+        transactions = await self._run(self._as_ledger, transactions)
         if not self.client:
-            return self._fallback_chat(message, financial_data, transactions, entity)
+            return await self._run(self._fallback_chat, message, financial_data, transactions, entity)
         
         try:
-            # Build system prompt with financial context
-            system_prompt = """You are an expert financial analyst AI assistant. Your role is to help users understand and analyze their financial data.
+            messages, tokens = await self._run(
+                self._build_chat_messages, message, financial_data, transactions, conversation_history
+            )
+            
+            ai_response = await self._complete(messages, prompt_tokens=tokens, **self.CHAT_PARAMS)
+            
+            return {
+                "response": ai_response,
+                "success": True
+            }
+        
+        except Exception as e:
+            print(f"Error in AI chat: {e}")
+            return await self._run(self._fallback_chat, message, financial_data, transactions, entity)
+    
+    async def chat_stream(
+        self,
+        message: str,
+        financial_data: Optional[Dict] = None,
+        transactions: Optional[Union[Ledger, List[Dict]]] = None,
+        conversation_history: Optional[List[Dict]] = None,
+        entity: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Same as ``chat`` but yields the reply in pieces as the model produces them
+
+        The fallback answer is yielded in one piece when there is no client or
+        the request fails before the first token.
+        """
+        transactions = await self._run(self._as_ledger, transactions)
+        if not self.client:
+            yield (await self._run(self._fallback_chat, message, financial_data, transactions, entity))["response"]
+            return
+        
+        started = False
+        try:
+            messages, tokens = await self._run(
+                self._build_chat_messages, message, financial_data, transactions, conversation_history
+            )
+            key = self.cache.key(self.model, messages, self.CHAT_PARAMS)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+            
+            REGISTRY.observe_prompt(self.model, tokens)
+            requested = time.perf_counter()
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                **self.CHAT_PARAMS
+            )
+            pieces = []
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    started = True
+                    pieces.append(delta)
+                    yield delta
+            REGISTRY.observe_stage('openai.chat_stream', time.perf_counter() - requested)
+            # Only complete replies are cached
+            self.cache.set(key, ''.join(pieces))
+        except Exception as e:
+            print(f"Error in AI chat stream: {e}")
+            if started:
+                raise
+            yield (await self._run(self._fallback_chat, message, financial_data, transactions, entity))["response"]
+    
+    async def _run(self, fn: Callable, *args):
+        """``fn(*args)`` through the offload runner, or inline without one"""
+        if self.offload is None:
+            return fn(*args)
+        return await self.offload(fn, *args)
+    
+    @staticmethod
+    def _as_ledger(transactions: Optional[Union[Ledger, List[Dict]]]) -> Optional[Ledger]:
+        """Parsed ledger for the chat data context (None when there is no usable data)"""
+        if transactions is None or len(transactions) == 0:
+            return None
+        try:
+            return Ledger.coerce(transactions)
+        except ValueError:
+            return None
+    
+    def _build_chat_messages(
+        self,
+        message: str,
+        financial_data: Optional[Dict],
+        transactions: Optional[Ledger],
+        conversation_history: Optional[List[Dict]]
+    ) -> Tuple[List[Dict], int]:
+        """
+        System prompt, recent history and the data-enriched user message, and
+        their size in tokens
+        """
+        # Whitespace-only differences in the question should not miss the cache
+        message = ' '.join(message.split())
+        
+        # Build system prompt with financial context
+        system_prompt = """You are an expert financial analyst AI assistant. Your role is to help users understand and analyze their financial data.
 
 CRITICAL INSTRUCTIONS:
 1. When transaction data is provided with revenue by entity calculations, USE THAT DATA to answer questions directly
@@ -280,126 +434,31 @@ IMPORTANT: When transaction data is provided:
 
 Always provide clear, actionable insights with specific numbers from the data. If transaction data is provided, analyze it directly to answer questions about subsidiaries, revenue, and entity performance. If financial data is provided, use it to give specific, data-driven answers. If no data is provided, give general financial advice."""
 
-            # Build user message with financial context
-            user_message = message
-            
-            # Add transaction data if available - this is crucial for subsidiary analysis
-            if transactions:
-                # Calculate revenue by entity for quick reference
-                # Revenue transactions are identified by account name (Revenue, Sales, Income) and type='credit'
-                entity_revenue = {}
-                entity_expenses = {}
-                entity_summary = {}
-                
-                for txn in transactions:
-                    account = str(txn.get('account', '')).lower()
-                    txn_type = str(txn.get('type', '')).lower()
-                    amount = float(txn.get('amount', 0) or 0)
-                    entity = txn.get('entity') or txn.get('subsidiary') or txn.get('company') or 'Unknown'
-                    
-                    # Identify revenue transactions (credit entries with revenue/sales/income accounts)
-                    if txn_type == 'credit' and amount > 0:
-                        if any(keyword in account for keyword in ['revenue', 'sales', 'income', 'revenue']):
-                            entity_revenue[entity] = entity_revenue.get(entity, 0) + amount
-                    
-                    # Also track expenses for comparison
-                    if txn_type == 'debit' and amount > 0:
-                        if any(keyword in account for keyword in ['expense', 'cost', 'salary', 'rent', 'utilities']):
-                            entity_expenses[entity] = entity_expenses.get(entity, 0) + amount
-                    
-                    # Track total transactions per entity
-                    if entity not in entity_summary:
-                        entity_summary[entity] = {'total_transactions': 0, 'total_amount': 0}
-                    entity_summary[entity]['total_transactions'] += 1
-                    entity_summary[entity]['total_amount'] += abs(amount)
-                
-                # Add comprehensive summary
-                user_message += f"\n\n=== TRANSACTION DATA ANALYSIS ===\n"
-                user_message += f"Total transactions: {len(transactions)}\n"
-                user_message += f"Unique entities: {len(entity_summary)}\n\n"
-                
-                if entity_revenue:
-                    user_message += f"REVENUE BY ENTITY:\n{json.dumps(entity_revenue, indent=2)}\n\n"
-                    # Identify highest revenue entity
-                    if entity_revenue:
-                        highest_entity = max(entity_revenue.items(), key=lambda x: x[1])
-                        user_message += f"HIGHEST REVENUE ENTITY: {highest_entity[0]} with ${highest_entity[1]:,.2f}\n\n"
-                
-                if entity_expenses:
-                    user_message += f"EXPENSES BY ENTITY:\n{json.dumps(entity_expenses, indent=2)}\n\n"
-                
-                user_message += f"ENTITY SUMMARY:\n{json.dumps(entity_summary, indent=2, default=str)}\n\n"
-                
-                # Include sample transactions for context (first 30 to show entity diversity)
-                user_message += f"SAMPLE TRANSACTIONS (first 30):\n{json.dumps(transactions[:30], indent=2, default=str)}\n"
-            
-            if financial_data:
-                user_message += f"\n\nCurrent Financial Data:\n{json.dumps(financial_data, indent=2)}"
-            
-            # Build conversation history
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            # Add conversation history if provided
-            if conversation_history:
-                for msg in conversation_history[-10:]:  # Keep last 10 messages for context
-                    messages.append({
-                        "role": msg.get("role", "user"),
-                        "content": msg.get("content", "")
-                    })
-            
-            # Add current message
-            messages.append({"role": "user", "content": user_message})
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            ai_response = response.choices[0].message.content
-            
-            return {
-                "response": ai_response,
-                "success": True
-            }
+        # Entity totals are memoized on the ledger and reused across turns
+        aggregates = entity_aggregates(transactions) if transactions is not None else None
         
-        except Exception as e:
-            print(f"Error in AI chat: {e}")
-            return self._fallback_chat(message, financial_data, transactions, entity)
+        # Fit the data context to the token budget, most relevant sections first
+        messages, tokens = self.context_builder.build(
+            system_prompt,
+            message,
+            aggregates,
+            transactions=transactions.frame if transactions is not None else None,
+            financial_data=financial_data,
+            conversation_history=conversation_history
+        )
+        
+        return messages, tokens
     
-    def _fallback_chat(self, message: str, financial_data: Optional[Dict] = None, transactions: Optional[List[Dict]] = None, entity: Optional[str] = None) -> Dict:
+    def _fallback_chat(self, message: str, financial_data: Optional[Dict] = None, transactions: Optional[Union[Ledger, List[Dict]]] = None, entity: Optional[str] = None) -> Dict:
         """Fallback chat without AI - with transaction analysis"""
         message_lower = message.lower()
+        transactions = self._as_ledger(transactions)
         
         # Handle subsidiary/revenue questions if transactions are available
-        if transactions and len(transactions) > 0:
-            # Calculate revenue by entity - identify revenue by account name and credit type
-            entity_revenue = {}
-            entity_expenses = {}
-            entity_summary = {}
-            
-            for txn in transactions:
-                account = str(txn.get('account', '')).lower()
-                txn_type = str(txn.get('type', '')).lower()
-                amount = float(txn.get('amount', 0) or 0)
-                txn_entity = txn.get('entity') or txn.get('subsidiary') or txn.get('company') or 'Unknown'
-                
-                # Identify revenue transactions (credit entries with revenue/sales/income accounts)
-                if txn_type == 'credit' and amount > 0:
-                    if any(keyword in account for keyword in ['revenue', 'sales', 'income']):
-                        entity_revenue[txn_entity] = entity_revenue.get(txn_entity, 0) + amount
-                
-                # Track expenses for comparison
-                if txn_type == 'debit' and amount > 0:
-                    if any(keyword in account for keyword in ['expense', 'cost', 'salary', 'rent', 'utilities']):
-                        entity_expenses[txn_entity] = entity_expenses.get(txn_entity, 0) + amount
-                
-                # Track total transactions per entity
-                if txn_entity not in entity_summary:
-                    entity_summary[txn_entity] = {'total_transactions': 0, 'total_amount': 0}
-                entity_summary[txn_entity]['total_transactions'] += 1
-                entity_summary[txn_entity]['total_amount'] += abs(amount)
+        if transactions is not None and len(transactions) > 0:
+            aggregates = entity_aggregates(transactions)
+            entity_revenue = aggregates.revenue
+            entity_expenses = aggregates.expenses
             
             # Answer subsidiary/revenue questions
             if ("subsidiary" in message_lower or "entity" in message_lower or "highest revenue" in message_lower or 
@@ -473,22 +532,11 @@ Always provide clear, actionable insights with specific numbers from the data. I
         if "revenue" in message_lower or "expense" in message_lower:
             # This is handled above in the transaction analysis section
             # But if we get here and have transactions, analyze them
-            if transactions and len(transactions) > 0:
-                entity_revenue = {}
-                total_revenue = 0
-                total_expenses = 0
-                
-                for txn in transactions:
-                    account = str(txn.get('account', '')).lower()
-                    txn_type = str(txn.get('type', '')).lower()
-                    amount = float(txn.get('amount', 0) or 0)
-                    
-                    if txn_type == 'credit' and any(k in account for k in ['revenue', 'sales', 'income']):
-                        total_revenue += amount
-                        entity = txn.get('entity') or txn.get('subsidiary') or 'Unknown'
-                        entity_revenue[entity] = entity_revenue.get(entity, 0) + amount
-                    elif txn_type == 'debit' and any(k in account for k in ['expense', 'cost', 'salary', 'rent']):
-                        total_expenses += amount
+            if transactions is not None and len(transactions) > 0:
+                aggregates = entity_aggregates(transactions)
+                entity_revenue = aggregates.revenue
+                total_revenue = aggregates.total_revenue
+                total_expenses = aggregates.total_expenses
                 
                 response_text = f"📊 **Revenue & Expense Analysis**\n\n"
                 response_text += f"**Total Revenue:** ${total_revenue:,.2f}\n"
@@ -517,7 +565,7 @@ Always provide clear, actionable insights with specific numbers from the data. I
             }
         
         # Default response - if we have transactions, offer to analyze them
-        if transactions and len(transactions) > 0:
+        if transactions is not None and len(transactions) > 0:
             return {
                 "response": f"I'm your financial AI assistant. I have access to {len(transactions)} transactions.\n\nI can help you with:\n- Which subsidiary has the highest revenue\n- Compare revenue across entities\n- Total revenue calculations\n- Profit & Loss analysis\n- Multi-entity/subsidiary analysis\n\nTry asking:\n- 'Which subsidiary has the highest revenue?'\n- 'Compare revenue across all entities'\n- 'What's the total revenue?'\n\nFor advanced AI-powered analysis, please set up an OpenAI API key in backend/.env file.",
                 "success": True
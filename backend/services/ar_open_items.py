@@ -0,0 +1,306 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+import pandas as pd
+import numpy as np
+from services.ledger import Ledger
+
+
+AGING_EDGES = (0, 30, 60, 90)
+REFERENCE_COLUMNS = ('invoice', 'invoice_id', 'invoice_number', 'reference', 'ref')
+CUSTOMER_COLUMNS = ('customer', 'customer_id', 'customer_name', 'counterparty')
+# Open balances below half a cent are float noise from the running sums
+OPEN_TOLERANCE = 0.005
+
+
+def aging_edges(edges: Optional[Sequence[int]] = None) -> Tuple[int, ...]:
+    """
+    Validated bucket edges in days (strictly increasing, non-negative)
+    """
+    if edges is None:
+        return AGING_EDGES
+    try:
+        edges = tuple(int(edge) for edge in edges)
+    except (TypeError, ValueError):
+        raise ValueError("Aging bucket edges must be whole numbers of days")
+    if not edges:
+        raise ValueError("At least one aging bucket edge is required")
+    if edges[0] < 0 or any(high <= low for low, high in zip(edges, edges[1:])):
+        raise ValueError("Aging bucket edges must be non-negative and strictly increasing")
+    return edges
+
+
+def bucket_labels(edges: Sequence[int]) -> List[str]:
+    """
+    Bucket names for a set of edges: (0, 30, 60, 90) gives current, 1-30_days,
+    31-60_days, 61-90_days and over_90_days
+    """
+    first = "current" if edges[0] == 0 else f"0-{edges[0]}_days"
+    middle = [f"{low + 1}-{high}_days" for low, high in zip(edges, edges[1:])]
+    return [first] + middle + [f"over_{edges[-1]}_days"]
+
+
+def _codes(values: pd.Series) -> Tuple[np.ndarray, pd.Index]:
+    """Integer codes (-1 for missing or blank) and the distinct values of a column"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values.to_numpy())
+    codes = codes.astype(np.int64)
+    # Code -1 picks the trailing False
+    blank = np.append(np.asarray(uniques, dtype=object) == '', False)
+    codes[blank[codes]] = -1
+    return codes, pd.Index(uniques)
+
+
+def _stable_order(key: np.ndarray) -> np.ndarray:
+    """Stable argsort of non-negative integer keys, as 16-bit radix passes"""
+    order = np.argsort((key & 0xFFFF).astype(np.uint16), kind='stable')
+    shift, top = 16, int(key.max()) if len(key) else 0
+    while top >> shift:
+        digits = ((key >> shift) & 0xFFFF).astype(np.uint16)[order]
+        order = order[np.argsort(digits, kind='stable')]
+        shift += 16
+    return order
+
+
+class _Groups:
+    """Dense group ids of code tuples (-1 counts as a value of its own), with the rows sorted by group"""
+
+    def __init__(self, *codes: np.ndarray):
+        key = np.zeros(len(codes[0]), dtype=np.int64)
+        for column in codes:
+            key = key * (int(column.max()) + 2) + (column + 1)
+        self.order = _stable_order(key)
+        ordered = key[self.order]
+        first = np.empty(len(key), dtype=bool)
+        first[:1] = True
+        first[1:] = ordered[1:] != ordered[:-1]
+        dense = np.cumsum(first) - 1
+        self.ids = np.empty(len(key), dtype=np.int64)
+        self.ids[self.order] = dense
+        self.count = int(dense[-1]) + 1 if len(key) else 0
+        self.sizes = np.bincount(dense, minlength=self.count)
+
+    def sum(self, values: np.ndarray) -> np.ndarray:
+        return np.bincount(self.ids, weights=values, minlength=self.count)
+
+    def fifo_open(self, amounts: np.ndarray, credits: np.ndarray) -> np.ndarray:
+        """
+        Balance left on each invoice once its group's credits are applied oldest first
+
+        Rows are in date order within each group (the sort is stable), so an
+        invoice is settled by whatever credit the invoices before it in its
+        group did not absorb: one running sum over the sorted rows.
+        """
+        ordered = amounts[self.order]
+        running = np.cumsum(ordered) - ordered
+        starts = np.cumsum(self.sizes) - self.sizes
+        before = np.empty_like(amounts)
+        before[self.order] = running - np.repeat(running[starts], self.sizes)
+        return amounts - np.clip(credits[self.ids] - before, 0.0, amounts)
+
+
+@dataclass(frozen=True)
+class AROpenItems:
+    """
+    Open receivable items: AR debits less the credits matched against them
+
+    Credits that carry an invoice reference settle the debits with the same
+    reference in the same entity first. Everything left over (unreferenced
+    credits, overpayments of a referenced invoice) settles the oldest open
+    debits of the same customer, or of the same entity when there is no
+    customer column. Both passes are a grouped running sum over the
+    date-ordered lines, so matching is O(n) whatever the number of
+    invoices; credits exceeding every open debit are reported as
+    unapplied. Only postings up to the as-of date take part.
+    """
+
+    as_of: pd.Timestamp
+    rows: np.ndarray
+    age_days: np.ndarray
+    open_amounts: np.ndarray
+    entity_codes: np.ndarray
+    entity_names: pd.Index
+    customer_codes: Optional[np.ndarray]
+    customer_names: Optional[pd.Index]
+    matching: Dict
+
+    @classmethod
+    def from_ledger(
+        cls,
+        ledger: Ledger,
+        ar_mask: np.ndarray,
+        as_of,
+        reference_column: Optional[str] = None,
+        customer_column: Optional[str] = None
+    ) -> 'AROpenItems':
+        """
+        Open items of a ledger's AR lines (``ar_mask``) as of a date
+
+        The reference and customer columns default to the first of
+        REFERENCE_COLUMNS / CUSTOMER_COLUMNS present in the ledger.
+        """
+        as_of = pd.Timestamp(as_of)
+        columns = ledger.frame.columns
+        reference_column = reference_column or next((name for name in REFERENCE_COLUMNS if name in columns), None)
+        customer_column = customer_column or next((name for name in CUSTOMER_COLUMNS if name in columns), None)
+        for name in (reference_column, customer_column):
+            if name and name not in columns:
+                raise ValueError(f"Column '{name}' not found in transactions")
+
+        window = ledger.date_slice(end_date=as_of)
+        rows = np.flatnonzero(ar_mask[window]) + window.start
+        amounts = np.nan_to_num(ledger.amount[rows])
+        signed = np.where(ledger.is_debit[rows], amounts, np.where(ledger.is_credit[rows], -amounts, 0.0))
+
+        entity = ledger.entity
+        references = customers = customer_names = None
+        if reference_column:
+            references, _ = _codes(ledger.frame[reference_column].iloc[rows])
+        if customer_column:
+            customers, customer_names = _codes(ledger.frame[customer_column].iloc[rows])
+        return cls._match(
+            as_of, rows, ledger.date[rows], signed,
+            entity.codes[rows].astype(np.int64), entity.categories,
+            customers, customer_names, references,
+            reference_column, customer_column
+        )
+
+    @classmethod
+    def from_cohorts(cls, ar_daily: pd.DataFrame, as_of, entity: Optional[str] = None) -> 'AROpenItems':
+        """
+        Open items of daily AR cohorts (debit/credit totals indexed by entity and date)
+
+        Each day's debits form one invoice, settled FIFO by the entity's credits.
+        """
+        as_of = pd.Timestamp(as_of)
+        entities = ar_daily.index.get_level_values('entity')
+        dates = pd.DatetimeIndex(ar_daily.index.get_level_values('date'))
+        keep = dates <= as_of
+        if entity:
+            keep &= entities == entity
+        cohorts = ar_daily[keep].sort_index(level=['entity', 'date'])
+
+        entity_codes, entity_names = pd.factorize(cohorts.index.get_level_values('entity'))
+        entity_codes = entity_codes.astype(np.int64)
+        dates = pd.DatetimeIndex(cohorts.index.get_level_values('date')).to_numpy()
+        signed = np.concatenate([cohorts['debit'].to_numpy(), -cohorts['credit'].to_numpy()])
+        return cls._match(
+            as_of, np.full(len(signed), -1, dtype=np.int64), np.concatenate([dates, dates]), signed,
+            np.concatenate([entity_codes, entity_codes]), pd.Index(entity_names),
+            None, None, None, None, None
+        )
+
+    @classmethod
+    def _match(
+        cls, as_of, rows, dates, signed, entity_codes, entity_names,
+        customers, customer_names, references, reference_column, customer_column
+    ) -> 'AROpenItems':
+        invoiced = np.maximum(signed, 0.0)
+        paid = np.maximum(-signed, 0.0)
+        open_amounts = invoiced.copy()
+        by_reference = by_fifo = unapplied = 0.0
+
+        if len(signed):
+            pools = _Groups(entity_codes) if customers is None else _Groups(entity_codes, customers)
+            pool = pools.sum(paid)
+
+            referenced = np.flatnonzero(references >= 0) if references is not None else np.array([], dtype=np.int64)
+            if len(referenced):
+                keys = _Groups(entity_codes[referenced], references[referenced])
+                key_paid = keys.sum(paid[referenced])
+                open_amounts[referenced] = keys.fifo_open(invoiced[referenced], key_paid)
+                overpaid = np.maximum(key_paid - keys.sum(invoiced[referenced]), 0.0)
+                by_reference = float(key_paid.sum() - overpaid.sum())
+
+                # Referenced credits reach the FIFO pool only for what their invoices left over
+                key_pool = np.empty(keys.count, dtype=np.int64)
+                key_pool[keys.ids] = pools.ids[referenced]
+                pool = (
+                    pool
+                    - np.bincount(pools.ids[referenced], weights=paid[referenced], minlength=pools.count)
+                    + np.bincount(key_pool, weights=overpaid, minlength=pools.count)
+                )
+
+            outstanding = pools.sum(open_amounts)
+            open_amounts = pools.fifo_open(open_amounts, pool)
+            unapplied = float(np.maximum(pool - outstanding, 0.0).sum())
+            by_fifo = float(pool.sum() - unapplied)
+
+        items = open_amounts >= OPEN_TOLERANCE
+        as_of_day = as_of.to_datetime64().astype('datetime64[D]')
+        age_days = (as_of_day - dates[items].astype('datetime64[D]')).astype(np.int64)
+        return cls(
+            as_of=as_of,
+            rows=rows[items],
+            age_days=age_days,
+            open_amounts=open_amounts[items],
+            entity_codes=entity_codes[items],
+            entity_names=entity_names,
+            customer_codes=customers[items] if customers is not None else None,
+            customer_names=customer_names,
+            matching={
+                "reference_column": reference_column,
+                "customer_column": customer_column,
+                "invoiced": round(float(invoiced.sum()), 2),
+                "matched_by_reference": round(by_reference, 2),
+                "matched_fifo": round(by_fifo, 2),
+                "unapplied_credits": round(unapplied, 2)
+            }
+        )
+
+    def __len__(self) -> int:
+        return len(self.open_amounts)
+
+    def buckets(self, edges: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Bucket index of each open item: 0 for age <= edges[0], i for edges[i-1] < age <= edges[i]
+        """
+        return np.digitize(self.age_days, aging_edges(edges), right=True)
+
+    def aging(self, edges: Optional[Sequence[int]] = None) -> Dict:
+        """
+        Open balance per age bucket, overall and per entity (and per customer when known)
+        """
+        edges = aging_edges(edges)
+        labels = bucket_labels(edges)
+        buckets = self.buckets(edges)
+        totals = np.bincount(buckets, weights=self.open_amounts, minlength=len(labels))
+
+        report = {
+            "aging_buckets": dict(zip(labels, totals.tolist())),
+            "total_ar": float(totals.sum()),
+            "bucket_edges": list(edges),
+            "open_items": len(self),
+            "unapplied_credits": self.matching["unapplied_credits"],
+            "matching": self.matching,
+            "by_entity": self._breakdown(self.entity_codes, self.entity_names, buckets, labels)
+        }
+        if self.customer_codes is not None:
+            report["by_customer"] = self._breakdown(self.customer_codes, self.customer_names, buckets, labels)
+        return report
+
+    def details(self, ledger: Ledger, edges: Optional[Sequence[int]] = None) -> pd.DataFrame:
+        """
+        The ledger lines still open, with their open amount, age and bucket
+        """
+        labels = np.array(bucket_labels(aging_edges(edges)), dtype=object)
+        return ledger.frame.iloc[self.rows].reset_index(drop=True).assign(
+            open_amount=self.open_amounts,
+            age_days=self.age_days,
+            aging_bucket=labels[self.buckets(edges)]
+        )
+
+    def _breakdown(self, codes: np.ndarray, names: pd.Index, buckets: np.ndarray, labels: List[str]) -> Dict:
+        """Bucket totals per name, for names with an open balance (missing names are left out)"""
+        named = codes >= 0
+        cells = np.bincount(
+            codes[named] * len(labels) + buckets[named],
+            weights=self.open_amounts[named],
+            minlength=len(names) * len(labels)
+        ).reshape(len(names), len(labels))
+        totals = cells.sum(axis=1)
+        return {
+            str(names[code]): {**dict(zip(labels, cells[code].tolist())), "total": float(totals[code])}
+            for code in np.flatnonzero(totals > 0)
+        }
@@ -0,0 +1,225 @@
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+import pandas as pd
+import numpy as np
+from services.entity_aggregates import EntityAggregates
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+_ENCODING = _encoding()
+
+
+def count_tokens(text: str) -> int:
+    """
+    Prompt tokens in a string (exact with tiktoken, otherwise ~4 characters per token)
+    """
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return len(text) // 4 + 1
+
+
+class ChatContextBuilder:
+    """
+    Builds the chat prompt within a token budget
+
+    The system prompt and the question always go in; recent history is
+    added newest-first up to a quarter of the budget; the remaining tokens
+    are filled with data sections (entity revenue/expense rankings, entity
+    summary, representative transactions, financial statements) in order
+    of their relevance to the question, each table taking at most half of
+    what is left. Sections are serialized compactly
+    as pipe-separated tables or minified JSON, and ranked tables are cut
+    row by row when they do not fit.
+    """
+
+    SECTION_KEYWORDS = {
+        'revenue': {'revenue', 'sales', 'income', 'highest', 'subsidiary', 'subsidiaries', 'entity', 'entities',
+                    'compare', 'top', 'best', 'ranking', 'rank'},
+        'expenses': {'expense', 'expenses', 'cost', 'costs', 'spend', 'spending', 'profit', 'net', 'margin',
+                     'salary', 'salaries', 'rent', 'utilities'},
+        'summary': {'entity', 'entities', 'subsidiary', 'subsidiaries', 'transactions', 'count', 'volume',
+                    'activity', 'many'},
+        'transactions': {'transaction', 'transactions', 'largest', 'biggest', 'unusual', 'weekend', 'date',
+                         'sample', 'show', 'list', 'posting', 'postings'},
+        'financial_data': {'balance', 'sheet', 'assets', 'liabilities', 'equity', 'cash', 'flow', 'statement',
+                           'statements', 'profit', 'loss', 'ratio', 'ratios'},
+    }
+    STOPWORDS = {'the', 'and', 'what', 'which', 'who', 'how', 'for', 'with', 'are', 'was', 'has', 'have',
+                 'this', 'that', 'from', 'our', 'all', 'per', 'any', 'can', 'you', 'did', 'does', 'give', 'tell'}
+    BASE_PRIORITY = {'revenue': 3, 'expenses': 2, 'financial_data': 2, 'summary': 1, 'transactions': 1}
+    TRANSACTION_COLUMNS = ('date', 'account', 'amount', 'type', 'entity')
+
+    def __init__(self, token_budget: Optional[int] = None, history_turns: int = 10):
+        self.token_budget = token_budget or int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "6000"))
+        self.history_turns = history_turns
+
+    def build(
+        self,
+        system_prompt: str,
+        message: str,
+        aggregates: Optional[EntityAggregates] = None,
+        transactions: Optional[pd.DataFrame] = None,
+        financial_data: Optional[Dict] = None,
+        conversation_history: Optional[List[Dict]] = None
+    ) -> Tuple[List[Dict], int]:
+        """
+        Chat messages for the model and the number of prompt tokens they use
+        """
+        words = set(re.findall(r'[a-z]{3,}', message.lower())) - self.STOPWORDS
+        # Reserve a little for per-message framing and section separators
+        remaining = self.token_budget - count_tokens(system_prompt) - count_tokens(message) - 32
+
+        history = []
+        history_budget = remaining // 4
+        for turn in reversed((conversation_history or [])[-self.history_turns:]):
+            entry = {"role": turn.get("role", "user"), "content": turn.get("content", "")}
+            cost = count_tokens(entry["content"]) + 4
+            if cost > history_budget:
+                break
+            history.insert(0, entry)
+            history_budget -= cost
+            remaining -= cost
+
+        sections = []
+        if aggregates is not None:
+            sections.append(('overview', self._overview(aggregates), None))
+            if aggregates.revenue:
+                sections.append(('revenue', *self._revenue(aggregates.revenue)))
+            if aggregates.expenses:
+                sections.append(('expenses', *self._ranking("EXPENSES BY ENTITY", "expenses", aggregates.expenses)))
+            sections.append(('summary', *self._summary(aggregates.summary)))
+        if transactions is not None and len(transactions) > 0:
+            sections.append(('transactions', *self._transactions(transactions, words)))
+        if financial_data:
+            sections.append(('financial_data', "Current Financial Data:\n" +
+                             json.dumps(financial_data, separators=(',', ':'), default=str), None))
+
+        def relevance(name: str) -> int:
+            if name == 'overview':
+                return 100
+            return self.BASE_PRIORITY[name] + 2 * len(words & self.SECTION_KEYWORDS[name])
+
+        # Truncatable tables may take at most half of what is left, so one long
+        # ranking cannot crowd out every less relevant section
+        chosen = {}
+        ranked = sorted(sections, key=lambda section: -relevance(section[0]))
+        for position, (name, text, rows) in enumerate(ranked):
+            last = position == len(ranked) - 1
+            text = self._fit(text, rows, remaining if rows is None or last else remaining // 2)
+            if text:
+                chosen[name] = text
+                remaining -= count_tokens(text)
+
+        # Keep a stable reading order regardless of the selection order
+        order = ['overview', 'revenue', 'expenses', 'summary', 'transactions', 'financial_data']
+        parts = [chosen[name] for name in order if name in chosen]
+        user_message = message
+        if parts:
+            header = "\n\n=== TRANSACTION DATA ANALYSIS ===\n" if aggregates is not None else "\n\n"
+            user_message += header + "\n\n".join(parts)
+
+        messages = [{"role": "system", "content": system_prompt}, *history, {"role": "user", "content": user_message}]
+        tokens = sum(count_tokens(entry["content"]) + 4 for entry in messages)
+        return messages, tokens
+
+    @staticmethod
+    def _fit(text: str, rows: Optional[List[str]], budget: int) -> str:
+        """The section if it fits, else as many leading table rows as fit, else nothing"""
+        if count_tokens(text) <= budget:
+            return text
+        if not rows or budget <= 0:
+            return ""
+        head = text[:len(text) - len("\n".join(rows))]
+        kept = []
+        used = count_tokens(head) + 8
+        for row in rows:
+            cost = count_tokens(row) + 1
+            if used + cost > budget:
+                break
+            kept.append(row)
+            used += cost
+        if not kept:
+            return ""
+        return head + "\n".join(kept) + f"\n... {len(rows) - len(kept)} more rows omitted"
+
+    @staticmethod
+    def _overview(aggregates: EntityAggregates) -> str:
+        return f"Total transactions: {aggregates.transactions}\nUnique entities: {len(aggregates.summary)}"
+
+    def _revenue(self, entity_revenue: Dict[str, float]):
+        text, rows = self._ranking("REVENUE BY ENTITY", "revenue", entity_revenue)
+        highest = max(entity_revenue.items(), key=lambda item: item[1])
+        # The highest entity goes first so it survives truncation
+        text = f"HIGHEST REVENUE ENTITY: {highest[0]} with ${highest[1]:,.2f}\n" + text
+        return text, rows
+
+    @staticmethod
+    def _ranking(title: str, column: str, values: Dict[str, float]):
+        ranked = sorted(values.items(), key=lambda item: item[1], reverse=True)
+        rows = [f"{name}|{value:.2f}" for name, value in ranked]
+        return f"{title} (entity|{column}, highest first):\n" + "\n".join(rows), rows
+
+    @staticmethod
+    def _summary(entity_summary: Dict[str, Dict]):
+        ranked = sorted(entity_summary.items(), key=lambda item: item[1]['total_amount'], reverse=True)
+        rows = [f"{name}|{stats['total_transactions']}|{stats['total_amount']:.2f}" for name, stats in ranked]
+        return "ENTITY SUMMARY (entity|transactions|total_amount):\n" + "\n".join(rows), rows
+
+    def _transactions(self, df: pd.DataFrame, words: set):
+        """
+        Representative rows: those mentioning the question's words first,
+        then the largest row per entity, then the largest rows overall
+        """
+        columns = [column for column in self.TRANSACTION_COLUMNS if column in df.columns]
+        if not columns:
+            return "", []
+        if 'amount' in df.columns:
+            magnitude = pd.to_numeric(df['amount'], errors='coerce').abs().fillna(0)
+        else:
+            magnitude = pd.Series(0.0, index=df.index)
+
+        picks = []
+        if words:
+            pattern = '|'.join(re.escape(word) for word in sorted(words))
+            matched = pd.Series(False, index=df.index)
+            for column in ('account', 'entity', 'subsidiary', 'company', 'description'):
+                if column in df.columns:
+                    matched |= self._contains(df[column], pattern)
+            picks.append(magnitude[matched].nlargest(50).index)
+        if 'entity' in df.columns:
+            entity_codes = pd.factorize(df['entity'])[0]
+            picks.append(pd.Index(magnitude.groupby(entity_codes).idxmax().to_numpy()))
+        picks.append(magnitude.nlargest(50).index)
+        order = pd.unique(np.concatenate([np.asarray(index) for index in picks]))
+
+        selected = df.loc[order, columns].copy()
+        for column in columns:
+            if pd.api.types.is_datetime64_any_dtype(selected[column]):
+                selected[column] = selected[column].dt.strftime('%Y-%m-%d')
+        rows = ["|".join('' if pd.isna(value) else str(value) for value in record)
+                for record in selected.itertuples(index=False)]
+        return "REPRESENTATIVE TRANSACTIONS (" + "|".join(columns) + "):\n" + "\n".join(rows), rows
+
+    @staticmethod
+    def _contains(values: pd.Series, pattern: str) -> pd.Series:
+        """Case-insensitive regex match, evaluated once per distinct value"""
+        codes, uniques = pd.factorize(values)
+        matches = pd.Series(np.asarray(uniques).astype(str)).str.contains(pattern, case=False, regex=True)
+        # Code -1 (missing) picks the trailing False
+        lookup = np.append(matches.to_numpy(dtype=bool), False)
+        return pd.Series(lookup[codes], index=values.index)
@@ -0,0 +1,79 @@
+import json
+from typing import Dict, Optional
+import pandas as pd
+from fastapi.responses import Response
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+MEDIA_TYPES = {
+    ARROW_MEDIA_TYPE: "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+    PARQUET_MEDIA_TYPE: "parquet",
+    "application/x-parquet": "parquet",
+    "application/json": None,
+    "*/*": None,
+}
+
+
+def negotiate_format(accept: Optional[str]) -> Optional[str]:
+    """
+    Pick "arrow" or "parquet" from an Accept header, or None for the default JSON
+
+    A columnar format is only chosen when the client lists it explicitly and
+    ranks it above JSON; without pyarrow installed JSON is always used.
+    """
+    if not accept or pa is None:
+        return None
+
+    candidates = []
+    for position, part in enumerate(accept.split(',')):
+        media_type, *params = [piece.strip() for piece in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0 and media_type.lower() in MEDIA_TYPES:
+            candidates.append((-quality, position, MEDIA_TYPES[media_type.lower()]))
+
+    if not candidates:
+        return None
+    return min(candidates)[2]
+
+
+def frame_response(df: pd.DataFrame, fmt: str, metadata: Optional[Dict] = None) -> Response:
+    """
+    Serialize a DataFrame as an Arrow IPC stream or Parquet file
+
+    Numeric and datetime columns are handed to Arrow from the DataFrame
+    buffers and categoricals become dictionary arrays; ``metadata`` (e.g. the
+    JSON summary that accompanies the rows) travels in the schema metadata
+    under the "fintool" key.
+    """
+    table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    if metadata is not None:
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[b"fintool"] = json.dumps(metadata, default=str).encode()
+        table = table.replace_schema_metadata(schema_metadata)
+
+    sink = pa.BufferOutputStream()
+    if fmt == "parquet":
+        pq.write_table(table, sink)
+        media_type = PARQUET_MEDIA_TYPE
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        media_type = ARROW_MEDIA_TYPE
+
+    return Response(content=sink.getvalue().to_pybytes(), media_type=media_type)
@@ -0,0 +1,158 @@
+import asyncio
+import contextvars
+import functools
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+class ComputePoolSaturated(Exception):
+    """Raised when every worker is busy and the queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Compute pool saturated, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ComputeTimeout(TimeoutError):
+    """Raised when a computation does not finish within its timeout"""
+
+
+class ComputePool:
+    """
+    Bounded execution layer for the CPU-bound pandas work of request handlers
+
+    Calls run on a thread pool (default) or a process pool
+    (``COMPUTE_POOL_MODE=process``) of ``COMPUTE_WORKERS`` workers, so the
+    event loop keeps serving other requests, health checks included.
+    At most ``COMPUTE_MAX_QUEUE`` calls wait behind the running ones;
+    beyond that ``run`` fails fast with ComputePoolSaturated, carrying a
+    Retry-After estimate from recent call durations. Each call is awaited
+    for at most ``COMPUTE_TIMEOUT`` seconds (0 disables). A call still
+    queued at its timeout is dropped. One already running cannot be
+    interrupted: it keeps its slot until it returns, so admission
+    reflects the real load.
+
+    Thread workers share memory with the server (stored ledgers and their
+    memoized masks are used in place) and see the request's context
+    variables, so stage timings reach its Server-Timing header. Process
+    workers sidestep the GIL but pickle the function, arguments and
+    result on every call. Calls that close over local state or must
+    update in-process stores pass ``process_safe=False`` and always run
+    on threads.
+    """
+
+    MODES = ('thread', 'process')
+
+    def __init__(
+        self,
+        mode: Optional[str] = None,
+        workers: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        timeout: Optional[float] = None
+    ):
+        self.mode = (mode or os.getenv("COMPUTE_POOL_MODE", "thread")).lower()
+        if self.mode not in self.MODES:
+            raise ValueError(f"Unknown compute pool mode: {self.mode} (use {' or '.join(self.MODES)})")
+        self.workers = workers or int(os.getenv("COMPUTE_WORKERS", "0")) or max(2, os.cpu_count() or 1)
+        self.max_queue = max_queue if max_queue is not None else int(
+            os.getenv("COMPUTE_MAX_QUEUE", str(4 * self.workers))
+        )
+        self.timeout = timeout if timeout is not None else float(os.getenv("COMPUTE_TIMEOUT", "120"))
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._average_seconds = None
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, process_safe: bool = True, **kwargs):
+        """
+        ``fn(*args, **kwargs)`` on a worker; raises ComputePoolSaturated or ComputeTimeout
+        """
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise ComputePoolSaturated(self._retry_after())
+            self._in_flight += 1
+
+        submitted = time.perf_counter()
+        try:
+            if self.mode == 'process' and process_safe:
+                future = self._executor('process').submit(fn, *args, **kwargs)
+            else:
+                context = contextvars.copy_context()
+                future = self._executor('thread').submit(context.run, functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        future.add_done_callback(lambda done: self._finished(done, submitted))
+
+        limit = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), limit or None)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise ComputeTimeout(f"Computation did not finish within {limit:g}s")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            in_flight = self._in_flight
+            average = self._average_seconds
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "timeout_seconds": self.timeout,
+            "running": min(in_flight, self.workers),
+            "queued": max(in_flight - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "average_seconds": round(average, 4) if average is not None else None
+        }
+
+    def shutdown(self):
+        for executor in (self._threads, self._processes):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._threads = None
+        self._processes = None
+
+    def _finished(self, future, submitted: float):
+        elapsed = time.perf_counter() - submitted
+        with self._lock:
+            self._in_flight -= 1
+            if not future.cancelled():
+                self.completed += 1
+                # Moving average of the submit-to-finish time, queueing included
+                self._average_seconds = elapsed if self._average_seconds is None else (
+                    0.8 * self._average_seconds + 0.2 * elapsed
+                )
+
+    def _retry_after(self) -> int:
+        """Seconds until a slot is likely to free up (called with the lock held)"""
+        if self._average_seconds is None:
+            return 1
+        return int(min(max(math.ceil(self._average_seconds), 1), 60))
+
+    def _executor(self, kind: str) -> Executor:
+        with self._lock:
+            if kind == 'process':
+                if self._processes is None:
+                    # Spawned workers are safe to start from a threaded server
+                    self._processes = ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+                return self._processes
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(self.workers, thread_name_prefix='compute')
+            return self._threads
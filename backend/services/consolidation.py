@@ -0,0 +1,261 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+import pandas as pd
+import numpy as np
+from services.ledger import Ledger
+from services.metrics import timed
+
+
+UNASSIGNED_ENTITY = 'Unassigned'
+# Sides of the per-entity totals: stand-alone debit/credit, then the intercompany part
+DEBIT, CREDIT, IC_DEBIT, IC_CREDIT = range(4)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        # The parent owns and unlinks the block; keep this process's tracker out of it
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(block._name, 'shared_memory')
+    except Exception:
+        pass
+    return block
+
+
+def _partial_totals(names: Dict[str, str], rows: int, start: int, stop: int, cells: int) -> np.ndarray:
+    """
+    Pool worker: bincount of one row range of the shared key/amount columns
+    """
+    keys_block, amounts_block = _attach(names['keys']), _attach(names['amounts'])
+    try:
+        keys = np.ndarray((rows,), dtype=np.int64, buffer=keys_block.buf)[start:stop]
+        amounts = np.ndarray((rows,), dtype=np.float64, buffer=amounts_block.buf)[start:stop]
+        valid = keys >= 0
+        result = np.bincount(keys[valid], weights=amounts[valid], minlength=cells)
+        del keys, amounts, valid
+        return result
+    finally:
+        keys_block.close()
+        amounts_block.close()
+
+
+def _statements(generator, accounts: pd.Index, account_totals: np.ndarray, period: str) -> Dict:
+    frame = pd.DataFrame(account_totals, index=accounts, columns=['debit', 'credit'])
+    return generator.generate_from_account_totals(frame, period)
+
+
+def _render_statements(generator, accounts: pd.Index, batch: List[Tuple[str, np.ndarray, str]]) -> Dict:
+    """
+    Pool worker: stand-alone statements for a batch of (entity, account totals, period)
+    """
+    return {name: _statements(generator, accounts, account_totals, period) for name, account_totals, period in batch}
+
+
+class ConsolidationEngine:
+    """
+    Group consolidation: stand-alone statements per entity plus consolidated statements
+
+    Every row is bucketed once into (entity, account, side) debit/credit
+    totals, intercompany rows in their own sides. On large ledgers the
+    bucketing is split across a process pool: the key and amount columns
+    are copied once into shared memory, each worker bincounts a contiguous
+    row range in place and only the small (entities × accounts × 4) partial
+    totals travel back. The statements are then folded from the totals
+    (O(entities × accounts)), so per-entity statements never rescan rows;
+    with many entities that rendering is itself spread over the pool in
+    one batch of entities per worker.
+
+    Intercompany rows are those posted to an account matching
+    ``INTERCOMPANY_PATTERN`` or whose counterparty column names another
+    entity of the group; with elimination on they are left out of the
+    consolidated statements and reported separately.
+    """
+
+    INTERCOMPANY_PATTERN = 'Intercompany|Inter-company|Due from|Due to'
+    COUNTERPARTY_COLUMNS = ('counterparty', 'intercompany_entity')
+
+    def __init__(self, statement_generator, workers: Optional[int] = None, parallel_min_rows: Optional[int] = None):
+        self.statement_generator = statement_generator
+        self.workers = workers or int(os.getenv("CONSOLIDATION_WORKERS", "0")) or os.cpu_count() or 1
+        self.parallel_min_rows = parallel_min_rows or int(os.getenv("CONSOLIDATION_PARALLEL_MIN_ROWS", "1000000"))
+        self._pool = None
+
+    @timed('consolidation.consolidate')
+    def consolidate(
+        self,
+        ledger: Ledger,
+        eliminate_intercompany: bool = False,
+        include_entities: bool = True
+    ) -> Dict:
+        """
+        Consolidated statements, each entity's stand-alone statements and the eliminations
+        """
+        totals, entities, accounts = self.entity_account_totals(ledger)
+
+        # Stand-alone figures include the entity's intercompany postings
+        standalone = totals[:, :, [DEBIT, CREDIT]] + totals[:, :, [IC_DEBIT, IC_CREDIT]]
+        group = totals.sum(axis=0)
+        consolidated_totals = group[:, [DEBIT, CREDIT]] if eliminate_intercompany else standalone.sum(axis=0)
+
+        spans = self._entity_spans(ledger)
+        present = [code for code, span in enumerate(spans) if span[2] > 0]
+        result = {
+            "entity_count": len(present),
+            "workers": self._workers_for(len(ledger)),
+            "intercompany_eliminated": eliminate_intercompany,
+            "consolidated": _statements(
+                self.statement_generator, accounts, consolidated_totals, self._period(*ledger.date_span())
+            )
+        }
+
+        if eliminate_intercompany:
+            eliminated = group[:, [IC_DEBIT, IC_CREDIT]]
+            used = np.abs(eliminated).sum(axis=1) > 0
+            debit, credit = eliminated.sum(axis=0)
+            result["eliminations"] = {
+                "debit": float(debit),
+                "credit": float(credit),
+                # Non-zero when the two sides of the intercompany postings do not match
+                "unmatched": float(debit - credit),
+                "accounts": {
+                    str(account): {"debit": float(row[0]), "credit": float(row[1])}
+                    for account, row in zip(np.asarray(accounts)[used], eliminated[used])
+                }
+            }
+
+        if include_entities:
+            batch = [(entities[code], standalone[code], self._period(*spans[code][:2])) for code in present]
+            result["entities"] = self._render_entities(accounts, batch)
+            result["workers"] = max(result["workers"], self._render_workers(len(batch)))
+        return result
+
+    def entity_account_totals(self, ledger: Ledger) -> Tuple[np.ndarray, List[str], pd.Index]:
+        """
+        (entities × accounts × 4) debit/credit totals with the intercompany
+        part in sides 2 and 3, memoized on the ledger
+        """
+        return ledger.cached(
+            ('entity_account_totals', self.INTERCOMPANY_PATTERN),
+            lambda: self._entity_account_totals(ledger)
+        )
+
+    def _entity_account_totals(self, ledger: Ledger):
+        entity_codes = ledger.entity.codes.astype(np.int64)
+        entities = [str(name) for name in ledger.entity.categories] + [UNASSIGNED_ENTITY]
+        entity_codes[entity_codes < 0] = len(entities) - 1
+        accounts = ledger.account
+        account_count = len(accounts.categories)
+
+        sides = np.where(ledger.is_debit, DEBIT, np.where(ledger.is_credit, CREDIT, -1))
+        sides = np.where((sides >= 0) & self._intercompany_mask(ledger), sides + 2, sides)
+        account_codes = accounts.codes.astype(np.int64)
+        keys = (entity_codes * account_count + account_codes) * 4 + sides
+        keys[(account_codes < 0) | (sides < 0)] = -1
+        amounts = np.nan_to_num(ledger.amount)
+
+        cells = len(entities) * account_count * 4
+        totals = self._bincount(keys, amounts, cells)
+        return totals.reshape(len(entities), account_count, 4), entities, pd.Index(accounts.categories)
+
+    def _intercompany_mask(self, ledger: Ledger) -> np.ndarray:
+        mask = np.asarray(ledger.account_mask(self.INTERCOMPANY_PATTERN)).copy()
+        group = set(str(name) for name in ledger.entity.categories)
+        for column in self.COUNTERPARTY_COLUMNS:
+            if column in ledger.frame.columns:
+                counterparty = ledger.frame[column].astype(object)
+                own = np.asarray(ledger.entity, dtype=object)
+                mask |= (counterparty.isin(group) & (counterparty != own)).to_numpy()
+        return mask
+
+    def _bincount(self, keys: np.ndarray, amounts: np.ndarray, cells: int) -> np.ndarray:
+        workers = self._workers_for(len(keys))
+        if workers == 1:
+            valid = keys >= 0
+            return np.bincount(keys[valid], weights=amounts[valid], minlength=cells)
+
+        blocks = []
+        try:
+            names = {}
+            for label, column in (('keys', keys), ('amounts', amounts)):
+                block = shared_memory.SharedMemory(create=True, size=max(column.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(column.shape, dtype=column.dtype, buffer=block.buf)[:] = column
+                names[label] = block.name
+            bounds = np.linspace(0, len(keys), workers + 1).astype(int)
+            futures = [
+                self._executor().submit(_partial_totals, names, len(keys), start, stop, cells)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            return np.sum([future.result() for future in futures], axis=0)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def _render_entities(self, accounts: pd.Index, batch: List[Tuple[str, np.ndarray, str]]) -> Dict:
+        workers = self._render_workers(len(batch))
+        if workers == 1:
+            return _render_statements(self.statement_generator, accounts, batch)
+        futures = [
+            self._executor().submit(_render_statements, self.statement_generator, accounts, batch[index::workers])
+            for index in range(workers)
+        ]
+        rendered = {}
+        for future in futures:
+            rendered.update(future.result())
+        # Keep the entity order of the ledger
+        return {name: rendered[name] for name, _, _ in batch}
+
+    def _render_workers(self, entities: int) -> int:
+        # Below a few entities per worker the pickling outweighs the rendering
+        if self.workers <= 1 or entities < 4 * self.workers:
+            return 1
+        return self.workers
+
+    def _workers_for(self, rows: int) -> int:
+        if self.workers <= 1 or rows < self.parallel_min_rows:
+            return 1
+        return self.workers
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned workers only import numpy and this module, and are safe
+            # to start from a threaded server
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @staticmethod
+    def _entity_spans(ledger: Ledger) -> List[Tuple]:
+        """
+        (first, last posting date, rows) per entity code, Unassigned last,
+        read off the date-sorted entity partitions instead of grouping every row
+        """
+        dates = ledger.date
+        _, last_date = ledger.date_span()
+        dated_rows = ledger.date_slice(end_date=last_date).stop if last_date is not pd.NaT else 0
+        order, offsets = ledger.entity_index()
+        bounds = list(zip(offsets[:-1], offsets[1:])) + [(0, offsets[0])]
+        spans = []
+        for start, stop in bounds:
+            positions = order[start:stop]
+            # Undated rows sort after every dated row of the partition
+            last = int(np.searchsorted(positions, dated_rows)) - 1
+            if last < 0:
+                spans.append((pd.NaT, pd.NaT, len(positions)))
+            else:
+                spans.append((pd.Timestamp(dates[positions[0]]), pd.Timestamp(dates[positions[last]]), len(positions)))
+        return spans
+
+    @staticmethod
+    def _period(first, last) -> str:
+        if first is pd.NaT:
+            return "N/A"
+        return f"{first.strftime('%Y-%m-%d')} to {last.strftime('%Y-%m-%d')}"
@@ -0,0 +1,218 @@
+import os
+import sys
+import time
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+import pandas as pd
+import numpy as np
+from services.ledger import Ledger
+from services.metrics import REGISTRY, stage
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class CSVValidationError(ValueError):
+    """Raised when an uploaded CSV does not have the expected layout"""
+
+
+class CSVIngestor:
+    """
+    Streams a CSV file into a Ledger chunk by chunk
+
+    The file is read ``chunk_rows`` rows at a time with explicit dtypes:
+    repeated string columns (date, account, type, entity, currency) are parsed as
+    categoricals, dates are converted once per distinct value and amounts
+    are coerced to float64. Each typed chunk is copied straight into
+    column buffers sized from a line count of the file (grown by doubling
+    when the source cannot be rewound), so apart from one chunk in flight
+    memory stays close to the size of the columnar result rather than a
+    multiple of the raw file.
+    """
+
+    DTYPES = {
+        'date': 'category',
+        'account': 'category',
+        'type': 'category',
+        'entity': 'category',
+        'currency': 'category',
+    }
+
+    def __init__(self, chunk_rows: int = None):
+        self.chunk_rows = chunk_rows or int(os.getenv("CSV_CHUNK_ROWS", "100000"))
+
+    def ingest(self, source: BinaryIO) -> Tuple[Ledger, Dict]:
+        """
+        Parse a CSV file object into a Ledger, returning ingestion stats alongside
+        """
+        started = time.perf_counter()
+        peak_before = self.peak_rss_mb()
+        capacity = self._row_capacity(source)
+        columns: Dict[str, _ColumnBuffer] = {}
+        chunks = 0
+        for chunk in self.chunks(source):
+            chunks += 1
+            for name in chunk.columns:
+                if name not in columns:
+                    columns[name] = _ColumnBuffer(capacity)
+                columns[name].append(chunk[name])
+        if not chunks:
+            raise CSVValidationError("CSV file is empty")
+
+        frame = pd.DataFrame({name: column.result() for name, column in columns.items()}, copy=False)
+        ledger = Ledger.from_frame(frame)
+        elapsed = time.perf_counter() - started
+        REGISTRY.observe_stage('csv.ingest', elapsed, len(ledger))
+
+        peak_after = self.peak_rss_mb()
+        return ledger, {
+            "rows": len(ledger),
+            "chunks": chunks,
+            "seconds": round(elapsed, 4),
+            "rows_per_sec": round(len(ledger) / elapsed, 1) if elapsed > 0 else None,
+            "process_peak_rss_mb": peak_after,
+            "peak_rss_increase_mb": round(peak_after - peak_before, 1) if peak_after is not None else None
+        }
+
+    def chunks(self, source: BinaryIO) -> Iterator[pd.DataFrame]:
+        """
+        Parsed chunks of a CSV file object, one at a time (for streaming consumers)
+        """
+        try:
+            reader = pd.read_csv(source, chunksize=self.chunk_rows, dtype=self.DTYPES, encoding='utf-8')
+        except pd.errors.EmptyDataError:
+            raise CSVValidationError("CSV file is empty")
+
+        for index, chunk in enumerate(reader):
+            if index == 0:
+                self._validate(chunk)
+            yield self._parse_chunk(chunk)
+
+    @staticmethod
+    def _row_capacity(source: BinaryIO) -> int:
+        """
+        Upper bound on the data rows from a count of line breaks (0 when the
+        source cannot be rewound); quoted newlines only make it an overestimate
+        """
+        try:
+            start = source.tell()
+            source.seek(start)
+        except (AttributeError, OSError, ValueError):
+            return 0
+        lines, last = 0, b'\n'
+        for block in iter(lambda: source.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+        source.seek(start)
+        # A final line without a break still holds a row; the header does not
+        return max(lines + (last != b'\n') - 1, 0)
+
+    def _validate(self, chunk: pd.DataFrame):
+        """Check the header on the first chunk before reading the rest of the file"""
+        missing_columns = [col for col in Ledger.REQUIRED_COLUMNS if col not in chunk.columns]
+        if missing_columns:
+            raise CSVValidationError(f"Missing required columns: {', '.join(missing_columns)}")
+
+    def _parse_chunk(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """Convert one raw chunk to the Ledger column types"""
+        with stage('csv.parse_dates', len(chunk)):
+            dates = chunk['date'].cat
+            parsed = pd.to_datetime(pd.Series(dates.categories)).to_numpy(dtype='datetime64[ns]')
+            # Code -1 (missing) picks the trailing NaT
+            lookup = np.append(parsed, np.datetime64('NaT', 'ns'))
+            chunk['date'] = lookup[dates.codes.to_numpy()]
+        with stage('csv.parse_amounts', len(chunk)):
+            chunk['amount'] = pd.to_numeric(chunk['amount'], errors='coerce').astype('float64')
+        return chunk
+
+    @staticmethod
+    def peak_rss_mb() -> Optional[float]:
+        """
+        Peak resident set size of this process in MB since it started (None
+        where unsupported); compare readings to see whether a call raised it
+        """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+        divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        return round(peak / divisor, 1)
+
+
+class _ColumnBuffer:
+    """
+    One column of the ingested file, filled chunk by chunk
+
+    Categorical chunks are recoded into a dictionary that grows in order of
+    first appearance (as ``union_categoricals`` would build it), so only the
+    integer codes are buffered. Other columns go into a NumPy buffer whose
+    dtype is promoted if a later chunk needs it (e.g. ints, then floats).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.rows = 0
+        self.values: Optional[np.ndarray] = None
+        self.categories: Optional[Dict] = None
+
+    def append(self, part: pd.Series):
+        if isinstance(part.dtype, pd.CategoricalDtype) and (self.rows == 0 or self.categories is not None):
+            if self.categories is None:
+                self.categories = {}
+            cat = part.cat
+            codes = [self.categories.setdefault(value, len(self.categories)) for value in cat.categories]
+            mapping = np.array(codes + [-1], dtype=_code_dtype(len(self.categories)))
+            # Code -1 (missing) picks the trailing -1
+            values = mapping[cat.codes.to_numpy()]
+        else:
+            if self.categories is not None:
+                self._decategorize()
+            values = part.to_numpy()
+        self._write(values)
+
+    def result(self):
+        values = self.values[:self.rows]
+        # Drop a mostly empty tail left by doubling or an overestimated capacity
+        if len(self.values) - self.rows > len(self.values) // 8:
+            values = values.copy()
+        if self.categories is not None:
+            categories = pd.Index(list(self.categories), dtype=object)
+            return pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(categories))
+        return values
+
+    def _write(self, values: np.ndarray):
+        end = self.rows + len(values)
+        if self.values is None:
+            self.values = np.empty(max(self.capacity, end), dtype=values.dtype)
+        else:
+            try:
+                dtype = np.result_type(self.values.dtype, values.dtype)
+            except TypeError:
+                dtype = np.dtype(object)
+            length = len(self.values)
+            if end > length:
+                length = max(end, 2 * length)
+            if length != len(self.values) or dtype != self.values.dtype:
+                self._resize(length, dtype)
+        self.values[self.rows:end] = values
+        self.rows = end
+
+    def _resize(self, length: int, dtype: np.dtype):
+        grown = np.empty(length, dtype=dtype)
+        grown[:self.rows] = self.values[:self.rows]
+        self.values = grown
+
+    def _decategorize(self):
+        """Switch to plain values when a column stops arriving as categorical"""
+        categories: List = list(self.categories) + [np.nan]
+        self.values = np.array(categories, dtype=object)[self.values[:self.rows]]
+        self.categories = None
+
+
+def _code_dtype(categories: int) -> np.dtype:
+    """The integer type pandas uses for the codes of this many categories"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
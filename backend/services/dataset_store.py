@@ -0,0 +1,234 @@
+import dataclasses
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+import numpy as np
+import pandas as pd
+from services.ledger import Ledger
+from services.ledger_aggregates import LedgerAggregates
+
+
+class DatasetStore:
+    """
+    In-memory store of parsed ledgers keyed by dataset ID
+
+    Uploaded CSVs are kept server-side as columnar Ledgers so clients can
+    reference them by ID instead of re-posting every transaction. The least
+    recently used datasets are evicted once either the dataset count or the
+    total in-memory size exceeds its limit. The size counts what requests
+    memoize on a ledger (per-entity copies, masks, summaries) and the
+    running aggregates as well as the rows; it is re-measured when a
+    dataset is looked up after something new was memoized on it, so values
+    cached by earlier requests count.
+
+    The store-wide lock only guards dictionary reads and writes, so ``get``
+    never waits on a computation. Building aggregates and appending copy or
+    scan the dataset's history; they run outside it, serialized per dataset,
+    and publish their result in a short critical section.
+    """
+
+    def __init__(self, max_datasets: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_datasets = max_datasets or int(os.getenv("DATASET_STORE_MAX_DATASETS", "20"))
+        self.max_bytes = max_bytes or int(os.getenv("DATASET_STORE_MAX_MB", "1024")) * 1024 * 1024
+        self._datasets: "OrderedDict[str, Ledger]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._row_sizes: Dict[str, int] = {}
+        self._measured: Dict[str, Tuple[int, int]] = {}
+        self._aggregates: Dict[str, LedgerAggregates] = {}
+        self._dataset_locks: Dict[str, threading.RLock] = {}
+        self._lock = threading.Lock()
+
+    def put(self, ledger: Ledger) -> str:
+        """
+        Store a ledger and return its new dataset ID
+        """
+        dataset_id = uuid.uuid4().hex
+        size = self.sizeof(ledger)
+        with self._lock:
+            self._datasets[dataset_id] = ledger
+            self._row_sizes[dataset_id] = size
+            self._sizes[dataset_id] = size
+            self._evict()
+        return dataset_id
+
+    def get(self, dataset_id: str) -> Optional[Ledger]:
+        """
+        Look up a ledger, marking it as most recently used
+        """
+        with self._lock:
+            ledger = self._datasets.get(dataset_id)
+            if ledger is None:
+                return None
+            self._datasets.move_to_end(dataset_id)
+        self._remeasure(dataset_id, ledger)
+        return ledger
+
+    def aggregates(
+        self,
+        dataset_id: str,
+        build: Callable[[Ledger], LedgerAggregates]
+    ) -> Optional[LedgerAggregates]:
+        """
+        Running aggregates for a dataset, built on first use
+        """
+        with self._lock:
+            aggregates = self._aggregates.get(dataset_id)
+            if aggregates is not None or dataset_id not in self._datasets:
+                return aggregates
+            dataset_lock = self._dataset_lock(dataset_id)
+
+        # One build per dataset; other datasets and lookups are not held up
+        with dataset_lock:
+            with self._lock:
+                ledger = self._datasets.get(dataset_id)
+                aggregates = self._aggregates.get(dataset_id)
+            if ledger is None or aggregates is not None:
+                return aggregates
+            aggregates = build(ledger)
+            with self._lock:
+                # Published only if the dataset was not deleted meanwhile
+                if self._datasets.get(dataset_id) is ledger:
+                    self._aggregates[dataset_id] = aggregates
+            return aggregates
+
+    def append(
+        self,
+        dataset_id: str,
+        batch: Ledger,
+        build: Callable[[Ledger], LedgerAggregates]
+    ) -> Optional[Tuple[Ledger, LedgerAggregates]]:
+        """
+        Append a batch to a stored dataset
+
+        The aggregates are updated from the batch alone; the ledger itself
+        is rebuilt with the batch after its history, which costs O(history).
+        """
+        with self._lock:
+            if dataset_id not in self._datasets:
+                return None
+            dataset_lock = self._dataset_lock(dataset_id)
+
+        # Appends to one dataset are serialized so none is lost
+        with dataset_lock:
+            aggregates = self.aggregates(dataset_id, build)
+            with self._lock:
+                ledger = self._datasets.get(dataset_id)
+            if aggregates is None or ledger is None:
+                return None
+            ledger = ledger.append(batch)
+            aggregates = aggregates.append(batch)
+            size = self.sizeof(ledger)
+            with self._lock:
+                if dataset_id not in self._datasets:
+                    return None
+                self._datasets[dataset_id] = ledger
+                self._datasets.move_to_end(dataset_id)
+                self._aggregates[dataset_id] = aggregates
+                self._row_sizes[dataset_id] = size
+                self._sizes[dataset_id] = size + _nbytes(aggregates)
+                self._evict()
+            return ledger, aggregates
+
+    def delete(self, dataset_id: str) -> bool:
+        with self._lock:
+            if dataset_id not in self._datasets:
+                return False
+            self._drop(dataset_id)
+            return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            datasets = list(self._datasets.items())
+        for dataset_id, ledger in datasets:
+            self._remeasure(dataset_id, ledger)
+        with self._lock:
+            return {
+                "datasets": len(self._datasets),
+                "bytes": sum(self._sizes.values()),
+                "max_datasets": self.max_datasets,
+                "max_bytes": self.max_bytes
+            }
+
+    def _evict(self):
+        """Drop least recently used datasets until both limits hold (keeps the newest)"""
+        while len(self._datasets) > 1 and (
+            len(self._datasets) > self.max_datasets or sum(self._sizes.values()) > self.max_bytes
+        ):
+            self._drop(next(iter(self._datasets)))
+
+    def _drop(self, dataset_id: str):
+        del self._datasets[dataset_id]
+        del self._sizes[dataset_id]
+        del self._row_sizes[dataset_id]
+        self._measured.pop(dataset_id, None)
+        self._aggregates.pop(dataset_id, None)
+        self._dataset_locks.pop(dataset_id, None)
+
+    def _dataset_lock(self, dataset_id: str) -> threading.RLock:
+        """Lock serializing builds and appends of one dataset (called with the store lock held)"""
+        return self._dataset_locks.setdefault(dataset_id, threading.RLock())
+
+    def _remeasure(self, dataset_id: str, ledger: Ledger):
+        """Recount a dataset with what has been memoized on it since, evicting if over the limit"""
+        with self._lock:
+            aggregates = self._aggregates.get(dataset_id)
+        # Memoized values are never replaced, so unchanged entry counts mean an unchanged size
+        signature = (_cache_entries(ledger), id(aggregates))
+        if self._measured.get(dataset_id) == signature:
+            return
+        cached = _nbytes(ledger.cached_values()) + _nbytes(aggregates)
+        with self._lock:
+            if self._datasets.get(dataset_id) is ledger:
+                self._sizes[dataset_id] = self._row_sizes[dataset_id] + cached
+                self._measured[dataset_id] = signature
+                self._evict()
+
+    @staticmethod
+    def sizeof(ledger: Ledger) -> int:
+        """Approximate in-memory footprint of a ledger's rows in bytes"""
+        return int(
+            ledger.frame.memory_usage(deep=True).sum() +
+            ledger.entity.nbytes +
+            ledger.is_debit.nbytes +
+            ledger.is_credit.nbytes
+        )
+
+
+def _cache_entries(ledger: Ledger) -> int:
+    """Memoized values on a ledger and on the ledgers memoized on it"""
+    values = ledger.cached_values()
+    return len(values) + sum(_cache_entries(value) for value in values if isinstance(value, Ledger))
+
+
+def _nbytes(value: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    Approximate bytes held by a memoized value: arrays, frames, ledgers and
+    the containers and dataclasses holding them (anything else counts as 0)
+
+    Frames are measured shallowly: object cells of a derived ledger point
+    at the same strings as the ledger it was taken from.
+    """
+    if seen is None:
+        seen = set()
+    if value is None or id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, Ledger):
+        return (int(value.frame.memory_usage(deep=False).sum()) + value.entity.nbytes + value.is_debit.nbytes +
+                value.is_credit.nbytes + _nbytes(value.cached_values(), seen))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=False)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, (pd.Index, pd.Categorical)):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(_nbytes(item, seen) for item in tuple(value.values()))
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item, seen) for item in value)
+    if dataclasses.is_dataclass(value):
+        return sum(_nbytes(getattr(value, field.name), seen) for field in dataclasses.fields(value))
+    return 0
@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from typing import Dict
+import numpy as np
+from services.ledger import Ledger
+
+
+REVENUE_PATTERN = r'revenue|sales|income'
+EXPENSE_PATTERN = r'expense|cost|salary|rent|utilities'
+UNKNOWN_ENTITY = 'Unknown'
+
+
+@dataclass(frozen=True)
+class EntityAggregates:
+    """
+    Per-entity revenue, expense and activity totals used by the chat agent
+
+    Revenue is positive credits to revenue/sales/income accounts, expenses
+    are positive debits to expense/cost/salary/rent/utilities accounts, and
+    rows without an entity are grouped under "Unknown".
+    """
+
+    revenue: Dict[str, float]
+    expenses: Dict[str, float]
+    summary: Dict[str, Dict]
+    transactions: int
+
+    @property
+    def total_revenue(self) -> float:
+        return sum(self.revenue.values())
+
+    @property
+    def total_expenses(self) -> float:
+        return sum(self.expenses.values())
+
+
+def entity_aggregates(ledger: Ledger) -> EntityAggregates:
+    """
+    Entity aggregates for a ledger, computed once and memoized on it
+
+    Stored datasets hand the same Ledger to every turn of a conversation,
+    so follow-up questions reuse the totals instead of re-scanning rows.
+    """
+    return ledger.cached('entity_aggregates', lambda: _aggregate(ledger))
+
+
+def _aggregate(ledger: Ledger) -> EntityAggregates:
+    entity = ledger.entity
+    names = list(entity.categories) + [UNKNOWN_ENTITY]
+    # Code -1 (no entity) maps to the trailing "Unknown" slot
+    codes = np.where(entity.codes >= 0, entity.codes, len(names) - 1)
+    amounts = np.nan_to_num(ledger.amount)
+    positive = amounts > 0
+
+    revenue_rows = ledger.is_credit & positive & ledger.account_mask(REVENUE_PATTERN)
+    expense_rows = ledger.is_debit & positive & ledger.account_mask(EXPENSE_PATTERN)
+
+    size = len(names)
+    revenue = np.bincount(codes, weights=np.where(revenue_rows, amounts, 0.0), minlength=size)
+    expenses = np.bincount(codes, weights=np.where(expense_rows, amounts, 0.0), minlength=size)
+    has_revenue = np.bincount(codes, weights=revenue_rows, minlength=size) > 0
+    has_expenses = np.bincount(codes, weights=expense_rows, minlength=size) > 0
+    counts = np.bincount(codes, minlength=size)
+    totals = np.bincount(codes, weights=np.abs(amounts), minlength=size)
+
+    entity_revenue, entity_expenses, entity_summary = {}, {}, {}
+    # Entities in order of first appearance, as a row-by-row scan would list them
+    first_seen = np.unique(codes, return_index=True)
+    for code in first_seen[0][np.argsort(first_seen[1])]:
+        name = names[code]
+        if has_revenue[code]:
+            entity_revenue[name] = entity_revenue.get(name, 0.0) + float(revenue[code])
+        if has_expenses[code]:
+            entity_expenses[name] = entity_expenses.get(name, 0.0) + float(expenses[code])
+        stats = entity_summary.setdefault(name, {'total_transactions': 0, 'total_amount': 0.0})
+        stats['total_transactions'] += int(counts[code])
+        stats['total_amount'] += float(totals[code])
+
+    return EntityAggregates(entity_revenue, entity_expenses, entity_summary, len(ledger))
@@ -1,7 +1,11 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Union
 from datetime import datetime
 import pandas as pd
 import numpy as np
+from services.account_classifier import AccountClassifier
+from services.ledger import Ledger
+from services.ledger_aggregates import LedgerAggregates
+from services.metrics import timed
 
 
 class FinancialStatementGenerator:
@@ -9,70 +13,190 @@ class FinancialStatementGenerator:
     Generates financial statements from transaction data
     """
     
+    FREQUENCIES = {'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+    
     def __init__(self):
         self.asset_accounts = ['Cash', 'Accounts Receivable', 'Inventory', 'Property', 'Equipment', 'Investments']
         self.liability_accounts = ['Accounts Payable', 'Loans', 'Debt', 'Accrued Expenses']
         self.equity_accounts = ['Capital', 'Retained Earnings', 'Equity']
         self.revenue_accounts = ['Revenue', 'Sales', 'Income', 'Interest Income']
         self.expense_accounts = ['Cost of Goods Sold', 'Operating Expenses', 'Salaries', 'Rent', 'Utilities', 'Marketing', 'Depreciation']
+        self.classifier = self._build_classifier()
+        self._sections = None
+    
+    def generate_statements(self, transactions: Union[Ledger, List[Dict]]) -> Dict:
+        """
+        Balance Sheet, Profit & Loss and Cash Flow of one ledger
+        """
+        ledger = Ledger.coerce(transactions)
+        return {
+            "balance_sheet": self.generate_balance_sheet(ledger),
+            "profit_loss": self.generate_profit_loss(ledger),
+            "cash_flow": self.generate_cash_flow(ledger)
+        }
     
-    def generate_balance_sheet(self, transactions: List[Dict]) -> Dict:
+    @timed('statement.balance_sheet')
+    def generate_balance_sheet(self, transactions: Union[Ledger, List[Dict]]) -> Dict:
         """
         Generate Balance Sheet from transactions
         """
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        
-        # Calculate assets
-        assets = {}
-        total_assets = 0
-        for account in self.asset_accounts:
-            asset_transactions = df[df['account'].str.contains(account, case=False, na=False)]
-            if len(asset_transactions) > 0:
-                # Assets increase with debits, decrease with credits
-                asset_amount = float(asset_transactions[
-                    asset_transactions['type'].str.lower() == 'debit'
-                ]['amount'].sum() - asset_transactions[
-                    asset_transactions['type'].str.lower() == 'credit'
-                ]['amount'].sum())
-                if asset_amount > 0:
-                    assets[account] = asset_amount
-                    total_assets += asset_amount
-        
-        # Calculate liabilities
-        liabilities = {}
-        total_liabilities = 0
-        for account in self.liability_accounts:
-            liability_transactions = df[df['account'].str.contains(account, case=False, na=False)]
-            if len(liability_transactions) > 0:
-                # Liabilities increase with credits, decrease with debits
-                liability_amount = float(liability_transactions[
-                    liability_transactions['type'].str.lower() == 'credit'
-                ]['amount'].sum() - liability_transactions[
-                    liability_transactions['type'].str.lower() == 'debit'
-                ]['amount'].sum())
-                if liability_amount > 0:
-                    liabilities[account] = liability_amount
-                    total_liabilities += liability_amount
-        
-        # Calculate equity
-        equity = {}
-        total_equity = 0
-        for account in self.equity_accounts:
-            equity_transactions = df[df['account'].str.contains(account, case=False, na=False)]
-            if len(equity_transactions) > 0:
-                equity_amount = float(equity_transactions[
-                    equity_transactions['type'].str.lower() == 'credit'
-                ]['amount'].sum() - equity_transactions[
-                    equity_transactions['type'].str.lower() == 'debit'
-                ]['amount'].sum())
-                if equity_amount > 0:
-                    equity[account] = equity_amount
-                    total_equity += equity_amount
-        
-        # Get net income from P&L
-        net_income = self._calculate_net_income(df)
+        ledger = Ledger.coerce(transactions)
+        return self._balance_sheet(self._account_totals(ledger))
+    
+    @timed('statement.profit_loss')
+    def generate_profit_loss(self, transactions: Union[Ledger, List[Dict]]) -> Dict:
+        """
+        Generate Profit & Loss statement from transactions
+        """
+        ledger = Ledger.coerce(transactions)
+        return self._profit_loss(self._account_totals(ledger), self._get_period(ledger.frame))
+    
+    @timed('statement.cash_flow')
+    def generate_cash_flow(self, transactions: Union[Ledger, List[Dict]]) -> Dict:
+        """
+        Generate Cash Flow statement from transactions
+        """
+        ledger = Ledger.coerce(transactions)
+        return self._cash_flow(self._account_totals(ledger), self._get_period(ledger.frame))
+    
+    @timed('statement.from_aggregates', count_rows=False)
+    def generate_from_aggregates(self, aggregates: LedgerAggregates) -> Dict:
+        """
+        Generate all three statements from running aggregates
+        Costs O(distinct accounts) regardless of how many rows have been appended
+        """
+        return self.generate_from_account_totals(aggregates.account_totals, aggregates.period())
+    
+    def generate_from_account_totals(self, account_totals: pd.DataFrame, period: str) -> Dict:
+        """
+        Generate all three statements from debit/credit totals indexed by account
+        """
+        totals = self.classifier.fold(account_totals)
+        return {
+            "balance_sheet": self._balance_sheet(totals),
+            "profit_loss": self._profit_loss(totals, period),
+            "cash_flow": self._cash_flow(totals, period)
+        }
+    
+    @timed('statement.comparative')
+    def generate_comparative(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        frequency: str = 'month',
+        periods: Optional[List[str]] = None,
+        max_periods: int = 120
+    ) -> Dict:
+        """
+        Comparative statements with one column per month, quarter or year
+        
+        ``periods`` lists period labels (e.g. "2024-03", "2024Q1", "2024");
+        by default every period from the first to the last posting date.
+        Rows are bucketed into (period, account, side) totals by a single
+        bincount, the period boundaries being binary searches on the
+        date-sorted ledger. P&L and cash flow columns show the activity of
+        each period; balance sheet columns are the cumulative balances at
+        period end, opening balances included.
+        """
+        if frequency not in self.FREQUENCIES:
+            raise ValueError(f"Unknown frequency: {frequency} (use {', '.join(self.FREQUENCIES)})")
+        ledger = Ledger.coerce(transactions)
+        freq = self.FREQUENCIES[frequency]
+        
+        if periods:
+            columns = sorted(set(pd.Period(label, freq=freq) for label in periods))
+        else:
+            first, last = ledger.date_span()
+            if first is pd.NaT:
+                raise ValueError("No dated transactions")
+            columns = list(pd.period_range(first.to_period(freq), last.to_period(freq), freq=freq))
+        if len(columns) > max_periods:
+            raise ValueError(f"Too many periods: {len(columns)} (at most {max_periods})")
+        
+        # Cut the dated rows at every column start and end; segment k holds the
+        # rows between boundaries k-1 and k, so a column's activity is a range of
+        # segments and its closing balance everything before its end
+        starts = [period.start_time.normalize().to_datetime64() for period in columns]
+        ends = [(period.end_time.normalize() + pd.Timedelta(days=1)).to_datetime64() for period in columns]
+        boundaries = np.unique(np.array(starts + ends))
+        _, last_date = ledger.date_span()
+        dated = ledger.date_slice(end_date=last_date).stop if last_date is not pd.NaT else 0
+        cuts = np.searchsorted(ledger.date[:dated], boundaries)
+        segments = np.full(len(ledger), -1, dtype=np.int64)
+        segments[:dated] = np.repeat(np.arange(len(boundaries) + 1), np.diff(np.concatenate([[0], cuts, [dated]])))
+        
+        accounts = ledger.account
+        account_count = len(accounts.categories)
+        sides = np.where(ledger.is_debit, 0, np.where(ledger.is_credit, 1, -1))
+        valid = (segments >= 0) & (accounts.codes >= 0) & (sides >= 0)
+        keys = (segments[valid] * account_count + accounts.codes[valid].astype(np.int64)) * 2 + sides[valid]
+        cumulative = np.cumsum(np.bincount(
+            keys, weights=np.nan_to_num(ledger.amount)[valid],
+            minlength=(len(boundaries) + 1) * account_count * 2
+        ).reshape(len(boundaries) + 1, account_count, 2), axis=0)
+        first_segment = np.searchsorted(boundaries, starts)
+        last_segment = np.searchsorted(boundaries, ends)
+        
+        # Classify the accounts once and fold every column with a matrix product
+        membership = self.classifier.classify(accounts.categories).T.astype(float)
+        items = pd.MultiIndex.from_tuples(self.classifier.items, names=['category', 'item'])
+        
+        def folded(account_totals: np.ndarray) -> pd.DataFrame:
+            return pd.DataFrame(membership @ account_totals, index=items, columns=['debit', 'credit'])
+        
+        statements = {}
+        for period, first, last in zip(columns, first_segment, last_segment):
+            label = str(period)
+            span = f"{period.start_time.strftime('%Y-%m-%d')} to {period.end_time.strftime('%Y-%m-%d')}"
+            activity = folded(cumulative[last] - cumulative[first])
+            balance_sheet = self._balance_sheet(folded(cumulative[last]))
+            balance_sheet["as_of_date"] = period.end_time.strftime('%Y-%m-%d')
+            statements[label] = {
+                "period": span,
+                "balance_sheet": balance_sheet,
+                "profit_loss": self._profit_loss(activity, span),
+                "cash_flow": self._cash_flow(activity, span)
+            }
+        
+        return {
+            "frequency": frequency,
+            "periods": list(statements),
+            "statements": statements,
+            "figures": {label: self.key_figures(statement) for label, statement in statements.items()}
+        }
+    
+    @staticmethod
+    def key_figures(statements: Dict) -> Dict[str, float]:
+        """
+        Flat {line: amount} view of one period's statements (the inputs of a variance analysis)
+        """
+        profit_loss = statements["profit_loss"]
+        balance_sheet = statements["balance_sheet"]
+        figures = {}
+        for section in ("revenue", "expenses"):
+            for item, amount in profit_loss[section]["items"].items():
+                figures[f"{section.title()}: {item}"] = amount
+            figures[f"Total {section.title()}"] = profit_loss[section]["total"]
+        figures["Net Income"] = profit_loss["net_income"]
+        for section in ("assets", "liabilities", "equity"):
+            figures[f"Total {section.title()}"] = balance_sheet[section]["total"]
+        figures["Net Change in Cash"] = statements["cash_flow"]["net_change_in_cash"]
+        return figures
+    
+    def _balance_sheet(self, totals: pd.DataFrame) -> Dict:
+        """Balance Sheet from classified account totals"""
+        # Assets increase with debits, decrease with credits
+        assets = self._line_items(self._section(totals, 'assets', 'debit') - self._section(totals, 'assets', 'credit'))
+        total_assets = sum(assets.values())
+        
+        # Liabilities increase with credits, decrease with debits
+        liabilities = self._line_items(self._section(totals, 'liabilities', 'credit') - self._section(totals, 'liabilities', 'debit'))
+        total_liabilities = sum(liabilities.values())
+        
+        equity = self._line_items(self._section(totals, 'equity', 'credit') - self._section(totals, 'equity', 'debit'))
+        total_equity = sum(equity.values())
+        
+        # Get net income from the same account totals as the P&L
+        net_income = self._net_income(totals)
         if 'Retained Earnings' not in equity:
             equity['Retained Earnings'] = 0
         equity['Retained Earnings'] += net_income
@@ -95,44 +219,18 @@ class FinancialStatementGenerator:
             "total_liabilities_and_equity": float(total_liabilities + total_equity)
         }
     
-    def generate_profit_loss(self, transactions: List[Dict]) -> Dict:
-        """
-        Generate Profit & Loss statement from transactions
-        """
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        
-        # Calculate revenue
-        revenue = {}
-        total_revenue = 0
-        for account in self.revenue_accounts:
-            revenue_transactions = df[df['account'].str.contains(account, case=False, na=False)]
-            if len(revenue_transactions) > 0:
-                revenue_amount = float(revenue_transactions[
-                    revenue_transactions['type'].str.lower() == 'credit'
-                ]['amount'].sum())
-                if revenue_amount > 0:
-                    revenue[account] = revenue_amount
-                    total_revenue += revenue_amount
-        
-        # Calculate expenses
-        expenses = {}
-        total_expenses = 0
-        for account in self.expense_accounts:
-            expense_transactions = df[df['account'].str.contains(account, case=False, na=False)]
-            if len(expense_transactions) > 0:
-                expense_amount = float(expense_transactions[
-                    expense_transactions['type'].str.lower() == 'debit'
-                ]['amount'].sum())
-                if expense_amount > 0:
-                    expenses[account] = expense_amount
-                    total_expenses += expense_amount
+    def _profit_loss(self, totals: pd.DataFrame, period: str) -> Dict:
+        """Profit & Loss statement from classified account totals"""
+        revenue = self._line_items(self._section(totals, 'revenue', 'credit'))
+        total_revenue = sum(revenue.values())
+        
+        expenses = self._line_items(self._section(totals, 'expenses', 'debit'))
+        total_expenses = sum(expenses.values())
         
         net_income = total_revenue - total_expenses
         
         return {
-            "period": self._get_period(df),
+            "period": period,
             "revenue": {
                 "items": revenue,
                 "total": float(total_revenue)
@@ -144,94 +242,74 @@ class FinancialStatementGenerator:
             "net_income": float(net_income)
         }
     
-    def generate_cash_flow(self, transactions: List[Dict]) -> Dict:
-        """
-        Generate Cash Flow statement from transactions
-        """
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        
-        # Operating activities (revenue and operating expenses)
-        operating_cash = df[
-            (df['account'].str.contains('Cash', case=False, na=False)) &
-            (df['account'].str.contains('Revenue|Sales|Operating|Expenses', case=False, na=False))
-        ]
-        operating_inflow = float(operating_cash[
-            operating_cash['type'].str.lower() == 'debit'
-        ]['amount'].sum())
-        operating_outflow = float(operating_cash[
-            operating_cash['type'].str.lower() == 'credit'
-        ]['amount'].sum())
-        net_operating = operating_inflow - operating_outflow
-        
-        # Investing activities
-        investing_cash = df[
-            (df['account'].str.contains('Cash', case=False, na=False)) &
-            (df['account'].str.contains('Investment|Property|Equipment', case=False, na=False))
-        ]
-        investing_inflow = float(investing_cash[
-            investing_cash['type'].str.lower() == 'debit'
-        ]['amount'].sum())
-        investing_outflow = float(investing_cash[
-            investing_cash['type'].str.lower() == 'credit'
-        ]['amount'].sum())
-        net_investing = investing_inflow - investing_outflow
-        
-        # Financing activities
-        financing_cash = df[
-            (df['account'].str.contains('Cash', case=False, na=False)) &
-            (df['account'].str.contains('Loan|Debt|Capital|Equity', case=False, na=False))
-        ]
-        financing_inflow = float(financing_cash[
-            financing_cash['type'].str.lower() == 'debit'
-        ]['amount'].sum())
-        financing_outflow = float(financing_cash[
-            financing_cash['type'].str.lower() == 'credit'
-        ]['amount'].sum())
-        net_financing = financing_inflow - financing_outflow
-        
-        net_change_in_cash = net_operating + net_investing + net_financing
+    def _cash_flow(self, totals: pd.DataFrame, period: str) -> Dict:
+        """Cash Flow statement from classified account totals"""
+        debits = self._section(totals, 'cash_flow', 'debit')
+        credits = self._section(totals, 'cash_flow', 'credit')
+        
+        # Cash inflows are debits to cash accounts, outflows are credits
+        activities = {}
+        for activity in ['operating_activities', 'investing_activities', 'financing_activities']:
+            inflow = float(debits[activity])
+            outflow = float(credits[activity])
+            activities[activity] = {
+                "inflow": inflow,
+                "outflow": outflow,
+                "net": float(inflow - outflow)
+            }
+        
+        net_change_in_cash = sum(activity["net"] for activity in activities.values())
         
         return {
-            "period": self._get_period(df),
-            "operating_activities": {
-                "inflow": float(operating_inflow),
-                "outflow": float(operating_outflow),
-                "net": float(net_operating)
-            },
-            "investing_activities": {
-                "inflow": float(investing_inflow),
-                "outflow": float(investing_outflow),
-                "net": float(net_investing)
-            },
-            "financing_activities": {
-                "inflow": float(financing_inflow),
-                "outflow": float(financing_outflow),
-                "net": float(net_financing)
-            },
+            "period": period,
+            **activities,
             "net_change_in_cash": float(net_change_in_cash)
         }
     
-    def _calculate_net_income(self, df: pd.DataFrame) -> float:
-        """Calculate net income from transactions"""
-        revenue = 0
-        expenses = 0
-        
-        for account in self.revenue_accounts:
-            revenue_transactions = df[df['account'].str.contains(account, case=False, na=False)]
-            if len(revenue_transactions) > 0:
-                revenue += float(revenue_transactions[
-                    revenue_transactions['type'].str.lower() == 'credit'
-                ]['amount'].sum())
-        
-        for account in self.expense_accounts:
-            expense_transactions = df[df['account'].str.contains(account, case=False, na=False)]
-            if len(expense_transactions) > 0:
-                expenses += float(expense_transactions[
-                    expense_transactions['type'].str.lower() == 'debit'
-                ]['amount'].sum())
-        
+    def _account_totals(self, ledger: Ledger) -> pd.DataFrame:
+        """Classified debit/credit totals, computed once per ledger"""
+        return ledger.cached(('account_totals', self.classifier), lambda: self.classifier.summarize(ledger))
+    
+    def _build_classifier(self) -> AccountClassifier:
+        """Line-item rules for every statement section"""
+        return AccountClassifier({
+            'assets': {account: [account] for account in self.asset_accounts},
+            'liabilities': {account: [account] for account in self.liability_accounts},
+            'equity': {account: [account] for account in self.equity_accounts},
+            'revenue': {account: [account] for account in self.revenue_accounts},
+            'expenses': {account: [account] for account in self.expense_accounts},
+            'cash_flow': {
+                # Operating activities (revenue and operating expenses)
+                'operating_activities': ['Cash', 'Revenue|Sales|Operating|Expenses'],
+                'investing_activities': ['Cash', 'Investment|Property|Equipment'],
+                'financing_activities': ['Cash', 'Loan|Debt|Capital|Equity'],
+            },
+        })
+    
+    def _section(self, totals: pd.DataFrame, category: str, side: str) -> pd.Series:
+        """
+        One side of a category's line items (same as ``totals.loc[category, side]``)
+        Positions are looked up once per classifier rather than through the
+        MultiIndex on every call, which dominates when rendering many statements
+        """
+        if self._sections is None:
+            sections = {}
+            for position, (name, item) in enumerate(self.classifier.items):
+                sections.setdefault(name, ([], []))
+                sections[name][0].append(position)
+                sections[name][1].append(item)
+            self._sections = {name: (np.array(rows), pd.Index(items, name='item')) for name, (rows, items) in sections.items()}
+        rows, items = self._sections[category]
+        return pd.Series(totals[side].to_numpy()[rows], index=items, name=side)
+    
+    def _line_items(self, amounts: pd.Series) -> Dict:
+        """Keep the line items with a positive balance"""
+        return {item: float(amount) for item, amount in amounts.items() if amount > 0}
+    
+    def _net_income(self, totals: pd.DataFrame) -> float:
+        """Calculate net income from classified account totals"""
+        revenue = self._section(totals, 'revenue', 'credit').sum()
+        expenses = self._section(totals, 'expenses', 'debit').sum()
         return float(revenue - expenses)
     
     def _get_period(self, df: pd.DataFrame) -> str:
@@ -1,10 +1,17 @@
+import asyncio
 import os
-import requests
-from typing import Dict, Optional
+import httpx
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from dotenv import load_dotenv
 from bs4 import BeautifulSoup
 import re
+from services.async_cache import AsyncTTLCache
+from services.fx_rate_store import FXRateStore
+from services.ledger import Ledger
+from services.metrics import stage, timed
 
 load_dotenv()
 
@@ -13,74 +20,131 @@ class FXRateService:
     """
     Foreign Exchange Rate Service
     Uses exchangerate-api.io (free tier) or similar service
+
+    All upstream calls go through one pooled ``httpx.AsyncClient`` and an
+    AsyncTTLCache, so a slow upstream never blocks the event loop and
+    identical concurrent requests share one in-flight call. Historical
+    tables are cached permanently per (base, date), the latest table per
+    base for ``latest_ttl`` seconds (kept warm by ``start()``'s background
+    refresh) and ATO pages per URL for ``ato_page_ttl`` seconds.
+
+    Every rate table that comes back (latest, past historical dates and
+    ATO months) is also written to an FXRateStore, which is consulted
+    before the network, so periods that have been seen once are served
+    locally across restarts.
     """
     
-    def __init__(self):
+    ATO_URL = "https://www.ato.gov.au/tax-rates-and-codes/foreign-exchange-rates-monthly-{year}-financial-year"
+    ATO_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5'
+    }
+    
+    def __init__(self, base_url: Optional[str] = None, ato_url: Optional[str] = None,
+                 store: Optional[FXRateStore] = None):
         # Using exchangerate-api.io free tier
         self.api_key = os.getenv("EXCHANGE_RATE_API_KEY", "")
-        self.base_url = "https://api.exchangerate-api.com/v4"
+        self.base_url = base_url or os.getenv("EXCHANGE_RATE_API_URL", "https://api.exchangerate-api.com/v4")
+        self.ato_url = ato_url or os.getenv("ATO_FX_URL", self.ATO_URL)
+        self.latest_ttl = float(os.getenv("FX_LATEST_TTL", "3600"))
+        self.ato_page_ttl = float(os.getenv("FX_ATO_PAGE_TTL", "86400"))
+        self.cache = AsyncTTLCache(max_entries=int(os.getenv("FX_CACHE_MAX_ENTRIES", "4096")))
+        self.store = store or FXRateStore()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+        self._refresher: Optional[asyncio.Task] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Shared pooled HTTP client for the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            # Pooled connections belong to the loop that opened them
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(10.0, connect=5.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                follow_redirects=True
+            )
+            self._client_loop = loop
+        return self._client
     
-    def get_current_rates(self, base_currency: str = "USD") -> Dict:
+    def start(self):
+        """
+        Start refreshing cached latest tables in the background (call from a running loop)
+        """
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.get_running_loop().create_task(self._refresh_latest())
+    
+    async def aclose(self):
+        """
+        Stop the background refresh and close pooled connections
+        """
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+        if self._client is not None:
+            # A client left over from a finished loop has nothing left to close
+            if self._client_loop is asyncio.get_running_loop():
+                await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+    
+    async def get_current_rates(self, base_currency: str = "USD") -> Dict:
         """
         Get current exchange rates
         """
         try:
-            if self.api_key:
-                # If API key is provided, use it
-                url = f"{self.base_url}/latest/{base_currency}"
-                response = requests.get(url, timeout=10)
-            else:
-                # Free tier without API key
-                url = f"{self.base_url}/latest/{base_currency}"
-                response = requests.get(url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "success": True,
-                    "base": data.get("base", base_currency),
-                    "date": data.get("date", datetime.now().strftime("%Y-%m-%d")),
-                    "rates": data.get("rates", {}),
-                    "source": "exchangerate-api.io"
-                }
-            else:
-                return self._fallback_rates(base_currency)
+            data = await self.cache.get_or_load(
+                ('latest', base_currency),
+                lambda: self._load_latest(base_currency),
+                ttl=self.latest_ttl
+            )
+            return {
+                "success": True,
+                "base": data.get("base", base_currency),
+                "date": data.get("date", datetime.now().strftime("%Y-%m-%d")),
+                "rates": data.get("rates", {}),
+                "source": "exchangerate-api.io"
+            }
         except Exception as e:
             print(f"Error fetching FX rates: {e}")
             return self._fallback_rates(base_currency)
     
-    def get_historical_rates(self, date: str, base_currency: str = "USD") -> Dict:
+    async def get_historical_rates(self, date: str, base_currency: str = "USD") -> Dict:
         """
         Get historical exchange rates for a specific date
         Format: YYYY-MM-DD
         """
         try:
-            url = f"{self.base_url}/history/{base_currency}/{date}"
-            response = requests.get(url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "success": True,
-                    "base": data.get("base", base_currency),
-                    "date": date,
-                    "rates": data.get("rates", {}).get(date, {}),
-                    "source": "exchangerate-api.io"
-                }
-            else:
-                return self._fallback_rates(base_currency, date)
+            # Past days never change; today and later are refreshed like "latest"
+            final = date < datetime.now().strftime("%Y-%m-%d")
+            data = await self.cache.get_or_load(
+                ('history', base_currency, date),
+                lambda: self._load_history(base_currency, date, final),
+                ttl=None if final else self.latest_ttl
+            )
+            return {
+                "success": True,
+                "base": data.get("base", base_currency),
+                "date": date,
+                "rates": data.get("rates", {}).get(date, {}),
+                "source": "exchangerate-api.io"
+            }
         except Exception as e:
             print(f"Error fetching historical FX rates: {e}")
             return self._fallback_rates(base_currency, date)
     
-    def convert_currency(self, amount: float, from_currency: str, to_currency: str, date: Optional[str] = None) -> Dict:
+    async def convert_currency(self, amount: float, from_currency: str, to_currency: str, date: Optional[str] = None) -> Dict:
         """
         Convert currency amount
         """
         if date:
-            rates_data = self.get_historical_rates(date, from_currency)
+            rates_data = await self.get_historical_rates(date, from_currency)
         else:
-            rates_data = self.get_current_rates(from_currency)
+            rates_data = await self.get_current_rates(from_currency)
         
         if rates_data.get("success") and rates_data.get("rates"):
             rates = rates_data["rates"]
@@ -101,103 +165,151 @@ class FXRateService:
             "error": "Currency conversion failed"
         }
     
-    def get_ato_rates(self, year: str, month: str) -> Dict:
+    @timed('fx.convert_ledger')
+    async def convert_ledger(self, ledger: Ledger, to_currency: str) -> Tuple[Ledger, Dict]:
+        """
+        Convert every row of a ledger with a ``currency`` column into one reporting currency
+
+        Each row is converted at its transaction-date rate. One rate table
+        (based in the reporting currency) is fetched per distinct date that
+        has foreign-currency rows, and the per-row factors are gathered from
+        a (currency x date) rate matrix through the factorized codes, so the
+        conversion itself is a single vectorized multiply. Rows without a
+        currency are taken to be in the reporting currency; rows without a
+        date use the latest rates. The converted ledger keeps
+        ``original_amount``, ``original_currency`` and ``fx_rate`` columns.
+        """
+        to_currency = to_currency.strip().upper()
+        stats = {"reporting_currency": to_currency, "rows_converted": 0, "rate_tables": 0, "sources": []}
+        if 'currency' not in ledger.frame.columns or len(ledger) == 0:
+            return ledger, stats
+        
+        # Normalize currency codes per distinct value, then re-factorize (e.g. "aud" and "AUD")
+        raw = ledger.frame['currency'].astype('category').cat
+        names = raw.categories.astype(str).str.strip().str.upper()
+        name_codes, currencies = pd.factorize(names)
+        currency_codes = np.append(name_codes, -1)[raw.codes.to_numpy()]
+        
+        day_codes, days = pd.factorize(pd.DatetimeIndex(ledger.date).normalize())
+        
+        is_foreign = np.append(np.asarray(currencies != to_currency) & (np.asarray(currencies) != ''), False)
+        foreign = is_foreign[currency_codes]
+        if not foreign.any():
+            return ledger, stats
+        
+        # Column len(days) holds the latest rates for rows with a missing date (code -1)
+        needed = np.unique(day_codes[foreign])
+        tables = await asyncio.gather(*[
+            self.get_historical_rates(days[code].strftime('%Y-%m-%d'), to_currency) if code >= 0
+            else self.get_current_rates(to_currency)
+            for code in needed
+        ])
+
+        # Fallback tables are USD-based samples whatever the base: never convert a ledger with them
+        unavailable = [
+            days[code].strftime('%Y-%m-%d') if code >= 0 else 'latest'
+            for code, table in zip(needed, tables) if table.get("source") == "fallback"
+        ]
+        if unavailable:
+            raise ValueError(
+                f"FX rates unavailable for {to_currency} ({', '.join(unavailable[:5])}"
+                f"{', ...' if len(unavailable) > 5 else ''}); the rate service could not be reached"
+            )
+
+        matrix = np.full((len(currencies), len(days) + 1), np.nan)
+        for code, table in zip(needed, tables):
+            rates = table.get("rates") or {}
+            matrix[:, code] = [rates.get(currency, np.nan) for currency in currencies]
+        
+        # Tables are based in the reporting currency: 1 reporting = rate units of the row currency
+        factors = np.ones(len(ledger))
+        factors[foreign] = 1.0 / matrix[currency_codes[foreign], day_codes[foreign]]
+        
+        missing = foreign & ~np.isfinite(factors)
+        if missing.any():
+            pairs = pd.DataFrame({
+                'currency': np.asarray(currencies)[currency_codes[missing]],
+                'date': pd.DatetimeIndex(ledger.date[missing]).strftime('%Y-%m-%d')
+            }).drop_duplicates().head(5)
+            listed = ', '.join(f"{row.currency} on {row.date}" for row in pairs.itertuples())
+            raise ValueError(f"No {to_currency} FX rate for {listed}")
+        
+        converted = ledger.assign(
+            original_amount=ledger.frame['amount'],
+            original_currency=ledger.frame['currency'],
+            fx_rate=factors,
+            amount=ledger.amount * factors,
+            currency=to_currency
+        )
+        stats.update({
+            "rows_converted": int(foreign.sum()),
+            "rate_tables": len(tables),
+            "sources": sorted({table.get("source", "") for table in tables})
+        })
+        return converted, stats
+    
+    async def get_ato_rates(self, year: str, month: str) -> Dict:
         """
         Fetch FX rates from Australian Tax Office (ATO) website
         URL: https://www.ato.gov.au/tax-rates-and-codes/foreign-exchange-rates-monthly-2026-financial-year
         """
         try:
+            cached = self.cache.get(('ato', year, month))
+            if cached is not None:
+                return cached
+            
+            month_date = f"{int(year):04d}-{int(month):02d}-01"
+            stored = self.store.table('ato', 'AUD', month_date)
+            if stored:
+                result = {
+                    "success": True,
+                    "base": "AUD",
+                    "date": f"{year}-{month}",
+                    "rates": stored,
+                    "source": "ATO (Australian Tax Office)"
+                }
+                self.cache.set(('ato', year, month), result, ttl=self.ato_page_ttl)
+                return result
+            
             # ATO URL format - need to construct based on financial year
             # For 2026 financial year (July 2025 - June 2026)
             financial_year = int(year) if int(month) >= 7 else int(year) - 1
             
             # Try different URL patterns
             urls = [
-                f"https://www.ato.gov.au/tax-rates-and-codes/foreign-exchange-rates-monthly-{financial_year}-financial-year",
-                f"https://www.ato.gov.au/tax-rates-and-codes/foreign-exchange-rates-monthly-{financial_year + 1}-financial-year",
-                "https://www.ato.gov.au/tax-rates-and-codes/foreign-exchange-rates-monthly-2026-financial-year",
-                "https://www.ato.gov.au/tax-rates-and-codes/foreign-exchange-rates-monthly-2025-financial-year"
+                self.ato_url.format(year=financial_year),
+                self.ato_url.format(year=financial_year + 1),
+                self.ato_url.format(year=2026),
+                self.ato_url.format(year=2025)
             ]
             
             rates = {}
             for url in urls:
                 try:
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                        'Accept-Language': 'en-US,en;q=0.5'
-                    }
-                    response = requests.get(url, headers=headers, timeout=15, allow_redirects=True)
-                    
-                    if response.status_code == 200:
-                        soup = BeautifulSoup(response.content, 'html.parser')
-                        
-                        # Look for tables with FX rates
-                        tables = soup.find_all('table')
-                        
-                        # Also look for divs with rate information
-                        month_names = ['January', 'February', 'March', 'April', 'May', 'June',
-                                     'July', 'August', 'September', 'October', 'November', 'December']
-                        month_name = month_names[int(month) - 1]
-                        month_short = month_name[:3]
-                        
-                        for table in tables:
-                            rows = table.find_all('tr')
-                            
-                            for row in rows:
-                                cells = row.find_all(['td', 'th'])
-                                if len(cells) >= 2:
-                                    # Check if this row contains the month we're looking for
-                                    row_text = ' '.join([cell.get_text().strip() for cell in cells]).lower()
-                                    
-                                    # Look for month indicators
-                                    if (month_name.lower() in row_text or 
-                                        month_short.lower() in row_text or 
-                                        month in row_text or
-                                        f"{year}-{month}" in row_text):
-                                        
-                                        # Extract currency and rate from this row or following rows
-                                        currency = cells[0].get_text().strip().upper()
-                                        rate_text = cells[1].get_text().strip() if len(cells) > 1 else ""
-                                        
-                                        # Extract numeric rate
-                                        rate_match = re.search(r'[\d.]+', rate_text.replace(',', ''))
-                                        if rate_match and len(currency) <= 5 and currency.isalpha():
-                                            try:
-                                                rate = float(rate_match.group())
-                                                if 0.001 < rate < 100000:  # Reasonable range
-                                                    rates[currency] = rate
-                                            except:
-                                                pass
-                                    
-                                    # Also try to extract any currency codes and rates
-                                    if len(cells) >= 2:
-                                        currency_candidate = cells[0].get_text().strip().upper()
-                                        rate_candidate = cells[1].get_text().strip()
-                                        
-                                        if (len(currency_candidate) == 3 and currency_candidate.isalpha() and
-                                            re.match(r'^[\d.]+$', rate_candidate.replace(',', ''))):
-                                            try:
-                                                rate = float(rate_candidate.replace(',', ''))
-                                                if 0.001 < rate < 100000:
-                                                    rates[currency_candidate] = rate
-                                            except:
-                                                pass
-                        
-                        if rates:
-                            break
+                    # One FY page serves every month in it, so pages are cached per URL
+                    page = await self.cache.get_or_load(
+                        ('ato-page', url),
+                        lambda url=url: self._fetch_page(url),
+                        ttl=self.ato_page_ttl
+                    )
+                    rates = await asyncio.to_thread(self._parse_ato_page, page, year, month)
+                    if rates:
+                        break
                 except Exception as e:
                     print(f"Error fetching from {url}: {e}")
                     continue
             
             if rates:
-                return {
+                result = {
                     "success": True,
                     "base": "AUD",
                     "date": f"{year}-{month}",
                     "rates": rates,
                     "source": "ATO (Australian Tax Office)"
                 }
+                self.cache.set(('ato', year, month), result, ttl=self.ato_page_ttl)
+                self.store.put('ato', 'AUD', month_date, rates)
+                return result
             else:
                 # Return fallback rates with note
                 return self._fallback_ato_rates(year, month)
@@ -206,6 +318,133 @@ class FXRateService:
             print(f"Error fetching ATO rates: {e}")
             return self._fallback_ato_rates(year, month)
     
+    async def rate_as_of(self, currency: str, date: str, base_currency: str = "USD", source: str = "api") -> Optional[Dict]:
+        """
+        Rate for one currency on a date, falling back to the previous business day
+
+        Served from the local store; the period is fetched (and stored) only
+        when the store has nothing for it yet. ATO rates are AUD-based and
+        monthly.
+        """
+        if source == "ato":
+            # ATO rates apply to a whole month and are stored against its 1st
+            base_currency, date = "AUD", f"{date[:7]}-01"
+        rate = self.store.as_of(source, base_currency, currency, date)
+        if rate is None:
+            if source == "ato":
+                await self.get_ato_rates(date[:4], date[5:7])
+            else:
+                await self.get_historical_rates(date, base_currency)
+            rate = self.store.as_of(source, base_currency, currency, date)
+        return rate
+    
+    def stored_rates(self, currency: str, start_date: str, end_date: str,
+                     base_currency: str = "USD", source: str = "api") -> List[Dict]:
+        """
+        Locally stored rates for one currency over a date range (no network access)
+        """
+        base_currency = "AUD" if source == "ato" else base_currency
+        return self.store.range(source, base_currency, currency, start_date, end_date)
+    
+    async def _load_latest(self, base_currency: str) -> Dict:
+        data = await self._fetch_json(f"{self.base_url}/latest/{base_currency}")
+        if data.get("date"):
+            self.store.put('api', data.get("base", base_currency), data["date"], data.get("rates", {}))
+        return data
+    
+    async def _load_history(self, base_currency: str, date: str, final: bool) -> Dict:
+        if final:
+            stored = self.store.table('api', base_currency, date)
+            if stored:
+                return {"base": base_currency, "rates": {date: stored}}
+        data = await self._fetch_json(f"{self.base_url}/history/{base_currency}/{date}")
+        self.store.put('api', base_currency, date, data.get("rates", {}).get(date, {}))
+        return data
+    
+    async def _fetch_json(self, url: str) -> Dict:
+        with stage('fx.fetch_api'):
+            response = await self.client.get(url)
+            response.raise_for_status()
+            return response.json()
+    
+    async def _fetch_page(self, url: str) -> bytes:
+        with stage('fx.fetch_ato'):
+            response = await self.client.get(url, headers=self.ATO_HEADERS, timeout=15)
+            response.raise_for_status()
+            return response.content
+    
+    async def _refresh_latest(self):
+        """Re-fetch every cached latest table at half its TTL so reads stay warm"""
+        while True:
+            await asyncio.sleep(self.latest_ttl / 2)
+            for key in self.cache.keys():
+                if key[0] != 'latest':
+                    continue
+                try:
+                    data = await self._load_latest(key[1])
+                    self.cache.set(key, data, ttl=self.latest_ttl)
+                except Exception as e:
+                    print(f"Error refreshing FX rates for {key[1]}: {e}")
+    
+    @staticmethod
+    def _parse_ato_page(content: bytes, year: str, month: str) -> Dict[str, float]:
+        """Extract {currency: rate} for one month from an ATO rates page"""
+        rates = {}
+        soup = BeautifulSoup(content, 'html.parser')
+        
+        # Look for tables with FX rates
+        tables = soup.find_all('table')
+        
+        # Also look for divs with rate information
+        month_names = ['January', 'February', 'March', 'April', 'May', 'June',
+                       'July', 'August', 'September', 'October', 'November', 'December']
+        month_name = month_names[int(month) - 1]
+        month_short = month_name[:3]
+        
+        for table in tables:
+            rows = table.find_all('tr')
+            
+            for row in rows:
+                cells = row.find_all(['td', 'th'])
+                if len(cells) >= 2:
+                    # Check if this row contains the month we're looking for
+                    row_text = ' '.join([cell.get_text().strip() for cell in cells]).lower()
+                    
+                    # Look for month indicators
+                    if (month_name.lower() in row_text or 
+                        month_short.lower() in row_text or 
+                        month in row_text or
+                        f"{year}-{month}" in row_text):
+                        
+                        # Extract currency and rate from this row or following rows
+                        currency = cells[0].get_text().strip().upper()
+                        rate_text = cells[1].get_text().strip() if len(cells) > 1 else ""
+                        
+                        # Extract numeric rate
+                        rate_match = re.search(r'[\d.]+', rate_text.replace(',', ''))
+                        if rate_match and len(currency) <= 5 and currency.isalpha():
+                            try:
+                                rate = float(rate_match.group())
+                                if 0.001 < rate < 100000:  # Reasonable range
+                                    rates[currency] = rate
+                            except:
+                                pass
+                    
+                    # Also try to extract any currency codes and rates
+                    if len(cells) >= 2:
+                        currency_candidate = cells[0].get_text().strip().upper()
+                        rate_candidate = cells[1].get_text().strip()
+                        
+                        if (len(currency_candidate) == 3 and currency_candidate.isalpha() and
+                            re.match(r'^[\d.]+$', rate_candidate.replace(',', ''))):
+                            try:
+                                rate = float(rate_candidate.replace(',', ''))
+                                if 0.001 < rate < 100000:
+                                    rates[currency_candidate] = rate
+                            except:
+                                pass
+        return rates
+    
     def _fallback_ato_rates(self, year: str, month: str) -> Dict:
         """
         Fallback ATO rates (sample data based on typical ATO rates)
@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+from datetime import date as date_type, timedelta
+from typing import Dict, List, Optional
+
+
+class FXRateStore:
+    """
+    Persistent local store of FX rates indexed by (source, base, currency, date)
+
+    Rate tables fetched from the exchange-rate API (source "api") and
+    scraped from the ATO (source "ato", one row per month dated the 1st)
+    are written to SQLite, so once a period has been seen it can be
+    revalued without network access. The primary key doubles as the
+    index for range queries and as-of lookups, which touch only the
+    matching B-tree leaf rows.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            source TEXT NOT NULL,
+            base TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            date TEXT NOT NULL,
+            rate REAL NOT NULL,
+            PRIMARY KEY (source, base, currency, date)
+        ) WITHOUT ROWID
+    """
+
+    def __init__(self, path: Optional[str] = None, max_lookback_days: int = 7):
+        self.path = path or os.getenv("FX_RATE_STORE_PATH", "fx_rates.db")
+        self.max_lookback_days = max_lookback_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self.SCHEMA)
+        self._conn.commit()
+
+    def put(self, source: str, base: str, date: str, rates: Dict[str, float]):
+        """
+        Store one rate table (1 ``base`` = rate units of each currency) for a date
+        """
+        rows = [
+            (source, base, currency, date, float(rate))
+            for currency, rate in rates.items()
+            if isinstance(rate, (int, float))
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO fx_rates VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def table(self, source: str, base: str, date: str) -> Optional[Dict[str, float]]:
+        """
+        The full rate table stored for exactly this date, or None
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT currency, rate FROM fx_rates WHERE source = ? AND base = ? AND date = ?",
+                (source, base, date)
+            ).fetchall()
+        return dict(rows) if rows else None
+
+    def as_of(self, source: str, base: str, currency: str, date: str) -> Optional[Dict]:
+        """
+        Most recent stored rate on or before a date
+
+        Falls back to the previous business day (or whatever earlier date was
+        stored) when the date itself has no rate, looking back at most
+        ``max_lookback_days``.
+        """
+        earliest = (date_type.fromisoformat(date) - timedelta(days=self.max_lookback_days)).isoformat()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT date, rate FROM fx_rates "
+                "WHERE source = ? AND base = ? AND currency = ? AND date <= ? AND date >= ? "
+                "ORDER BY date DESC LIMIT 1",
+                (source, base, currency, date, earliest)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"base": base, "currency": currency, "requested_date": date, "date": row[0], "rate": row[1]}
+
+    def range(self, source: str, base: str, currency: str, start: str, end: str) -> List[Dict]:
+        """
+        All stored rates for a currency between two dates (inclusive), oldest first
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, rate FROM fx_rates "
+                "WHERE source = ? AND base = ? AND currency = ? AND date BETWEEN ? AND ? "
+                "ORDER BY date",
+                (source, base, currency, start, end)
+            ).fetchall()
+        return [{"date": date, "rate": rate} for date, rate in rows]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rows, tables = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT source || base || date) FROM fx_rates"
+            ).fetchone()
+        return {"path": self.path, "rates": rows, "tables": tables}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def financial_year_range(financial_year: int):
+        """
+        (start, end) ISO dates of an Australian financial year (FY2026 = Jul 2025 - Jun 2026)
+        """
+        return f"{financial_year - 1}-07-01", f"{financial_year}-06-30"
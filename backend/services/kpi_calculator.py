@@ -1,7 +1,13 @@
-from typing import Dict, List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
+from services.ledger import Ledger, frame_records
+from services.ar_open_items import AROpenItems, aging_edges
+from services.ledger_aggregates import LedgerAggregates
+from services.metrics import timed
+from services.revenue_cube import RevenueCube
+from services.transaction_screen import DETECTORS, AnomalyDetector, TopN, TransactionScreen, anomaly_records
 
 
 class KPICalculator:
@@ -9,94 +15,186 @@ class KPICalculator:
     Calculate various financial KPIs including AR Aging and DSO
     """
     
-    def calculate_ar_aging(self, transactions: List[Dict], as_of_date: str = None) -> Dict:
+    REVENUE_CATEGORIES = ('Revenue', 'Sales', 'Income')
+    REVENUE_PATTERN = '|'.join(REVENUE_CATEGORIES)
+    # Whole-word AR / A/R only, so Salaries or Retained Earnings do not match
+    AR_PATTERN = r'Accounts Receivable|Receivable|\bA/?R\b'
+    BATCH_KPIS = (
+        'ar-aging', 'dso', 'revenue-ytd', 'revenue-variance',
+        'trailing-3m', 'top-n', 'unusual-transactions'
+    )
+    
+    def __init__(self, anomaly_detector: Optional[AnomalyDetector] = None):
+        self.anomaly_detector = anomaly_detector or AnomalyDetector()
+    
+    @timed('kpi.batch')
+    def compute_many(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        kpis: Optional[List[str]] = None,
+        entity: str = None,
+        as_of_date: str = None,
+        period_days: int = 30,
+        n: int = 10,
+        bucket_edges: Optional[List[int]] = None
+    ) -> Dict:
         """
-        Calculate Accounts Receivable Aging Report
+        Compute several KPIs over one parsed ledger
+        The entity slice, the revenue/AR masks and the revenue cube are memoized
+        on the ledger, so every requested KPI reuses them instead of rescanning the data
         """
-        if not as_of_date:
-            as_of_date = datetime.now().strftime("%Y-%m-%d")
-        
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        as_of = pd.to_datetime(as_of_date)
-        
-        # Filter AR transactions
-        ar_transactions = df[
-            df['account'].str.contains('Accounts Receivable|Receivable|AR', case=False, na=False)
-        ].copy()
+        ledger = Ledger.coerce(transactions)
+        kpis = list(kpis or self.BATCH_KPIS)
+        unknown = [kpi for kpi in kpis if kpi not in self.BATCH_KPIS]
+        if unknown:
+            raise ValueError(f"Unknown KPIs: {', '.join(unknown)}")
+        
+        calculators = {
+            'ar-aging': lambda: self.calculate_ar_aging(
+                ledger.for_entity(entity), as_of_date=as_of_date, bucket_edges=bucket_edges
+            ),
+            'dso': lambda: self.calculate_dso(ledger.for_entity(entity), period_days=period_days),
+            'revenue-ytd': lambda: self.calculate_revenue_ytd(ledger, entity=entity, as_of_date=as_of_date),
+            'revenue-variance': lambda: self.calculate_revenue_variance(ledger, entity=entity, as_of_date=as_of_date),
+            'trailing-3m': lambda: self.calculate_trailing_3m_revenue(ledger, entity=entity, as_of_date=as_of_date),
+            'top-n': lambda: self.find_top_n_revenue(ledger, n=n, entity=entity),
+            'unusual-transactions': lambda: self.find_unusual_transactions(ledger, entity=entity),
+        }
+        return {kpi: calculators[kpi]() for kpi in kpis}
+    
+    @timed('kpi.aggregate')
+    def aggregate(self, transactions: Union[Ledger, List[Dict]]) -> LedgerAggregates:
+        """
+        Running aggregates for incremental KPI refreshes (see LedgerAggregates.append)
+        """
+        return LedgerAggregates.from_ledger(Ledger.coerce(transactions), self.REVENUE_PATTERN, self.AR_PATTERN)
+    
+    @timed('kpi.from_aggregates', count_rows=False)
+    def compute_from_aggregates(
+        self,
+        aggregates: LedgerAggregates,
+        entity: str = None,
+        as_of_date: str = None,
+        period_days: int = 30
+    ) -> Dict:
+        """
+        Date-window KPIs from running aggregates, without touching individual rows
+        Same figures as the row-level methods for date-only postings; AR aging
+        comes without the per-line details
+        """
+        revenue = aggregates.revenue_by_day(entity)
+        ar = aggregates.ar_by_day(entity)
+        now = datetime.now()
+        cube = aggregates.revenue_cube()
+        as_of = self._as_of(as_of_date)
+        
+        revenue_ytd = self._revenue_ytd(cube, entity, as_of)
+        revenue_variance = self._revenue_variance(cube, entity, as_of)
+        trailing_3m = self._trailing_revenue(cube, entity, as_of)
+        
+        results = {
+            "revenue-ytd": revenue_ytd,
+            "revenue-variance": revenue_variance,
+            "trailing-3m": trailing_3m
+        }
         
-        if len(ar_transactions) == 0:
-            return {
-                "as_of_date": as_of_date,
-                "aging_buckets": {
-                    "current": 0,
-                    "1-30_days": 0,
-                    "31-60_days": 0,
-                    "61-90_days": 0,
-                    "over_90_days": 0
-                },
-                "total_ar": 0
+        # DSO over the window ending at the last posting date
+        _, end_date = aggregates.date_span(entity)
+        if pd.notna(end_date):
+            dso_start = end_date - timedelta(days=period_days)
+            ending_ar = float(ar['debit'].sum() - ar['credit'].sum())
+            total_revenue = float(revenue[(revenue.index >= dso_start) & (revenue.index <= end_date)].sum())
+            avg_daily_sales = total_revenue / period_days if total_revenue > 0 else 0
+            dso = float(ending_ar / avg_daily_sales) if avg_daily_sales > 0 else 0
+            results["dso"] = {
+                "period_days": period_days,
+                "start_date": dso_start.strftime("%Y-%m-%d"),
+                "end_date": end_date.strftime("%Y-%m-%d"),
+                "ending_ar": ending_ar,
+                "total_revenue": total_revenue,
+                "avg_daily_sales": avg_daily_sales,
+                "dso": round(dso, 2)
             }
         
-        # Calculate age in days
-        ar_transactions['age_days'] = (as_of - ar_transactions['date']).dt.days
-        ar_transactions['amount'] = pd.to_numeric(ar_transactions['amount'], errors='coerce')
-        
-        # Only include debit entries (AR increases with debits)
-        ar_debits = ar_transactions[ar_transactions['type'].str.lower() == 'debit'].copy()
+        # AR aging of debit cohorts, settled FIFO by each entity's credits
+        if not as_of_date:
+            as_of_date = now.strftime("%Y-%m-%d")
+        items = AROpenItems.from_cohorts(aggregates.ar_daily, as_of_date, entity)
+        results["ar-aging"] = {"as_of_date": as_of_date, **items.aging()}
         
-        # Calculate aging buckets
-        current = float(ar_debits[ar_debits['age_days'] <= 0]['amount'].sum())
-        days_1_30 = float(ar_debits[(ar_debits['age_days'] > 0) & (ar_debits['age_days'] <= 30)]['amount'].sum())
-        days_31_60 = float(ar_debits[(ar_debits['age_days'] > 30) & (ar_debits['age_days'] <= 60)]['amount'].sum())
-        days_61_90 = float(ar_debits[(ar_debits['age_days'] > 60) & (ar_debits['age_days'] <= 90)]['amount'].sum())
-        over_90 = float(ar_debits[ar_debits['age_days'] > 90]['amount'].sum())
+        return results
+    
+    def _revenue_mask(self, ledger: Ledger) -> np.ndarray:
+        """Revenue credits (revenue/sales/income accounts posted as credits)"""
+        return ledger.cached(
+            ('revenue_credit', self.REVENUE_PATTERN),
+            lambda: ledger.account_mask(self.REVENUE_PATTERN) & ledger.is_credit
+        )
+    
+    def calculate_ar_aging(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        as_of_date: str = None,
+        bucket_edges: Optional[List[int]] = None
+    ) -> Dict:
+        """
+        Calculate Accounts Receivable Aging Report
+        """
+        report, details = self.calculate_ar_aging_frame(transactions, as_of_date, bucket_edges)
+        if details is not None:
+            report["details"] = frame_records(details)
+        return report
+    
+    @timed('kpi.ar_aging')
+    def calculate_ar_aging_frame(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        as_of_date: str = None,
+        bucket_edges: Optional[List[int]] = None
+    ) -> Tuple[Dict, Optional[pd.DataFrame]]:
+        """
+        AR Aging summary plus the open debit lines as a DataFrame (None when nothing is open)
+        Buckets are split at ``bucket_edges`` days (default 0/30/60/90)
+        """
+        if not as_of_date:
+            as_of_date = datetime.now().strftime("%Y-%m-%d")
         
-        total_ar = current + days_1_30 + days_31_60 + days_61_90 + over_90
+        ledger = Ledger.coerce(transactions)
+        edges = aging_edges(bucket_edges)
         
-        return {
-            "as_of_date": as_of_date,
-            "aging_buckets": {
-                "current": current,
-                "1-30_days": days_1_30,
-                "31-60_days": days_31_60,
-                "61-90_days": days_61_90,
-                "over_90_days": over_90
-            },
-            "total_ar": total_ar,
-            "details": ar_debits.to_dict('records') if len(ar_debits) > 0 else []
-        }
+        # AR debits less the credits matched against them, as of the date
+        items = AROpenItems.from_ledger(ledger, ledger.account_mask(self.AR_PATTERN), as_of_date)
+        report = {"as_of_date": as_of_date, **items.aging(edges)}
+        if len(items) == 0:
+            return report, None
+        return report, items.details(ledger, edges)
     
-    def calculate_dso(self, transactions: List[Dict], period_days: int = 30) -> Dict:
+    @timed('kpi.dso')
+    def calculate_dso(self, transactions: Union[Ledger, List[Dict]], period_days: int = 30) -> Dict:
         """
         Calculate Days Sales Outstanding (DSO)
         DSO = (Accounts Receivable / Total Credit Sales) * Number of Days
         """
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+        ledger = Ledger.coerce(transactions)
+        amounts = ledger.amount
         
         # Get end date and start date
-        end_date = df['date'].max()
+        _, end_date = ledger.date_span()
         start_date = end_date - timedelta(days=period_days)
         
-        # Calculate Accounts Receivable (ending balance)
-        ar_transactions = df[
-            (df['account'].str.contains('Accounts Receivable|Receivable|AR', case=False, na=False)) &
-            (df['date'] <= end_date)
-        ]
-        ar_debits = ar_transactions[ar_transactions['type'].str.lower() == 'debit']['amount'].sum()
-        ar_credits = ar_transactions[ar_transactions['type'].str.lower() == 'credit']['amount'].sum()
-        ending_ar = float(ar_debits - ar_credits)
+        # Calculate Accounts Receivable (ending balance) over every dated row
+        def ar_balance():
+            dated = ledger.date_slice(end_date=end_date)
+            ar_mask = ledger.account_mask(self.AR_PATTERN)[dated]
+            ar_debits = np.nansum(amounts[dated][ar_mask & ledger.is_debit[dated]])
+            ar_credits = np.nansum(amounts[dated][ar_mask & ledger.is_credit[dated]])
+            return float(ar_debits - ar_credits)
+        ending_ar = ledger.cached(('ar_balance', self.AR_PATTERN), ar_balance)
         
-        # Calculate credit sales (revenue) for the period
-        revenue_transactions = df[
-            (df['account'].str.contains('Revenue|Sales|Income', case=False, na=False)) &
-            (df['date'] >= start_date) &
-            (df['date'] <= end_date) &
-            (df['type'].str.lower() == 'credit')
-        ]
-        total_revenue = float(revenue_transactions['amount'].sum())
+        # Calculate credit sales (revenue) for the period; rows are date-sorted,
+        # so the window is a slice rather than a mask over the whole ledger
+        window = ledger.date_slice(start_date, end_date)
+        total_revenue = float(np.nansum(amounts[window][self._revenue_mask(ledger)[window]]))
         
         # Calculate DSO
         if total_revenue > 0:
@@ -116,169 +214,293 @@ class KPICalculator:
             "dso": round(dso, 2)
         }
     
-    def calculate_revenue_ytd(self, transactions: List[Dict], entity: str = None) -> Dict:
-        """Calculate Year-to-Date Revenue"""
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        
-        if entity:
-            df = df[df.get('entity', '') == entity]
-        
-        current_year = datetime.now().year
-        ytd_transactions = df[
-            (df['date'].dt.year == current_year) &
-            (df['account'].str.contains('Revenue|Sales|Income', case=False, na=False)) &
-            (df['type'].str.lower() == 'credit')
-        ]
+    @timed('kpi.dso_series')
+    def calculate_dso_series(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        period_days: int = 30,
+        start_date: str = None,
+        end_date: str = None,
+        lookback_days: int = 730,
+        by_entity: bool = True
+    ) -> Dict:
+        """
+        Daily DSO time series, overall and per entity
+        Each day's figure is what calculate_dso gives for a ledger ending that
+        day (same figures for date-only postings). End date defaults to the last
+        posting date, start date to ``lookback_days`` before it.
+        
+        AR and revenue are binned into (entity × day) grids with one bincount
+        each: the AR balance is a running sum along the days (postings before
+        the start date land on the first day) and the trailing revenue is a
+        difference of prefix sums, so the whole series is one pass over the rows.
+        """
+        ledger = Ledger.coerce(transactions)
+        if period_days <= 0:
+            raise ValueError("period_days must be positive")
         
-        total_ytd = float(ytd_transactions['amount'].sum())
+        _, last_date = ledger.date_span()
+        if pd.isna(last_date) and not end_date:
+            return {
+                "period_days": period_days,
+                "start_date": None,
+                "end_date": None,
+                "dates": [],
+                "total": {"ending_ar": [], "total_revenue": [], "dso": []}
+            }
+        end = pd.Timestamp(end_date or last_date).normalize()
+        start = pd.Timestamp(start_date).normalize() if start_date else end - timedelta(days=lookback_days)
+        if start > end:
+            raise ValueError("start_date must not be after end_date")
+        days = (end - start).days + 1
+        
+        # Day of each dated row relative to the first revenue day needed
+        window = ledger.date_slice(end_date=end + timedelta(days=1) - timedelta(microseconds=1))
+        origin = (start - timedelta(days=period_days)).to_datetime64().astype('datetime64[D]')
+        day = (ledger.date[window].astype('datetime64[D]') - origin).astype(np.int64)
+        amounts = np.nan_to_num(ledger.amount[window])
+        slots = len(ledger.entity.categories) + 1
+        # Code -1 (no entity) maps to a trailing unnamed slot
+        entity = ledger.entity.codes[window].astype(np.int64) % slots
+        width = days + period_days
+        
+        ar = ledger.account_mask(self.AR_PATTERN)[window]
+        signed = np.where(ledger.is_debit[window], amounts, np.where(ledger.is_credit[window], -amounts, 0.0))
+        ar_days = np.maximum(day[ar], period_days)
+        ar_daily = np.bincount(entity[ar] * width + ar_days, weights=signed[ar], minlength=slots * width)
+        ending_ar = np.cumsum(ar_daily.reshape(slots, width)[:, period_days:], axis=1)
+        
+        revenue = self._revenue_mask(ledger)[window] & (day >= 0)
+        revenue_daily = np.bincount(entity[revenue] * width + day[revenue], weights=amounts[revenue],
+                                    minlength=slots * width).reshape(slots, width)
+        prefix = np.zeros((slots, width + 1))
+        np.cumsum(revenue_daily, axis=1, out=prefix[:, 1:])
+        # Revenue from period_days before each day through that day, inclusive
+        total_revenue = prefix[:, period_days + 1:] - prefix[:, :days]
+        
+        def series(ar_balance: np.ndarray, sales: np.ndarray) -> Dict:
+            avg_daily_sales = sales / period_days
+            dso = np.divide(ar_balance, avg_daily_sales, out=np.zeros(days), where=sales > 0)
+            return {
+                "ending_ar": np.round(ar_balance, 2).tolist(),
+                "total_revenue": np.round(sales, 2).tolist(),
+                "dso": np.round(dso, 2).tolist()
+            }
         
-        # Monthly breakdown
+        result = {
+            "period_days": period_days,
+            "start_date": start.strftime("%Y-%m-%d"),
+            "end_date": end.strftime("%Y-%m-%d"),
+            "dates": pd.date_range(start, end, freq='D').strftime("%Y-%m-%d").tolist(),
+            "total": series(ending_ar.sum(axis=0), total_revenue.sum(axis=0))
+        }
+        if by_entity:
+            active = np.flatnonzero(np.abs(ending_ar[:-1]).sum(axis=1) + total_revenue[:-1].sum(axis=1) > 0)
+            result["by_entity"] = {
+                str(ledger.entity.categories[code]): series(ending_ar[code], total_revenue[code])
+                for code in active
+            }
+        return result
+    
+    def revenue_cube(self, transactions: Union[Ledger, List[Dict]]) -> RevenueCube:
+        """
+        Revenue cube of a ledger (entity × revenue category × day), built once and memoized on it
+        """
+        ledger = Ledger.coerce(transactions)
+        return ledger.cached(
+            ('revenue_cube', self.REVENUE_CATEGORIES),
+            lambda: RevenueCube.from_ledger(ledger, self.REVENUE_CATEGORIES)
+        )
+    
+    @staticmethod
+    def _as_of(as_of_date: str = None) -> pd.Timestamp:
+        if not as_of_date:
+            return pd.Timestamp(datetime.now())
+        return pd.Timestamp(as_of_date)
+    
+    @timed('kpi.revenue_ytd')
+    def calculate_revenue_ytd(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        entity: str = None,
+        as_of_date: str = None
+    ) -> Dict:
+        """Calculate Year-to-Date Revenue (through as_of_date, default today)"""
+        return self._revenue_ytd(self.revenue_cube(transactions), entity, self._as_of(as_of_date))
+    
+    @timed('kpi.revenue_variance')
+    def calculate_revenue_variance(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        entity: str = None,
+        as_of_date: str = None
+    ) -> Dict:
+        """Calculate revenue variance of the as-of month (default this month) compared to previous month"""
+        return self._revenue_variance(self.revenue_cube(transactions), entity, self._as_of(as_of_date))
+    
+    @timed('kpi.trailing_3m')
+    def calculate_trailing_3m_revenue(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        entity: str = None,
+        as_of_date: str = None,
+        days: int = 90
+    ) -> Dict:
+        """Calculate trailing 3 months (or N days) rolling revenue up to as_of_date"""
+        return self._trailing_revenue(self.revenue_cube(transactions), entity, self._as_of(as_of_date), days)
+    
+    @timed('kpi.revenue_range')
+    def calculate_revenue_range(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        start_date: str = None,
+        end_date: str = None,
+        entity: str = None,
+        category: str = None
+    ) -> Dict:
+        """
+        Revenue between two dates (inclusive, open-ended when empty), optionally
+        for one revenue category (Revenue, Sales or Income accounts)
+        """
+        cube = self.revenue_cube(transactions)
+        return {
+            "start_date": start_date,
+            "end_date": end_date,
+            "total_revenue": cube.total(start_date or None, end_date or None, entity, category),
+            "by_category": {
+                name: cube.total(start_date or None, end_date or None, entity, name)
+                for name in cube.categories
+            },
+            "entity": entity,
+            "category": category
+        }
+    
+    @staticmethod
+    def _revenue_ytd(cube: RevenueCube, entity: Optional[str], as_of: pd.Timestamp) -> Dict:
+        year = as_of.year
         monthly_revenue = {}
         for month in range(1, 13):
-            month_data = ytd_transactions[ytd_transactions['date'].dt.month == month]
-            monthly_revenue[datetime(current_year, month, 1).strftime("%B")] = float(month_data['amount'].sum())
+            month_start = pd.Timestamp(year, month, 1)
+            month_end = min(month_start + pd.offsets.MonthEnd(0), as_of)
+            monthly_revenue[month_start.strftime("%B")] = cube.total(month_start, month_end, entity)
         
         return {
-            "year": current_year,
-            "ytd_total": total_ytd,
+            "year": year,
+            "as_of_date": as_of.strftime("%Y-%m-%d"),
+            "ytd_total": cube.total(pd.Timestamp(year, 1, 1), as_of, entity),
             "monthly_breakdown": monthly_revenue,
             "entity": entity
         }
     
-    def calculate_revenue_variance(self, transactions: List[Dict], entity: str = None) -> Dict:
-        """Calculate revenue variance compared to previous month"""
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        
-        if entity:
-            df = df[df.get('entity', '') == entity]
-        
-        current_date = datetime.now()
-        current_month = current_date.month
-        current_year = current_date.year
-        
-        # Current month revenue
-        current_month_rev = df[
-            (df['date'].dt.month == current_month) &
-            (df['date'].dt.year == current_year) &
-            (df['account'].str.contains('Revenue|Sales|Income', case=False, na=False)) &
-            (df['type'].str.lower() == 'credit')
-        ]['amount'].sum()
+    @staticmethod
+    def _revenue_variance(cube: RevenueCube, entity: Optional[str], as_of: pd.Timestamp) -> Dict:
+        current_start = pd.Timestamp(as_of.year, as_of.month, 1)
+        prev_start = current_start - pd.offsets.MonthBegin(1)
         
-        # Previous month revenue
-        prev_month = current_month - 1
-        prev_year = current_year
-        if prev_month == 0:
-            prev_month = 12
-            prev_year -= 1
+        current_month_rev = cube.total(current_start, current_start + pd.offsets.MonthEnd(0), entity)
+        prev_month_rev = cube.total(prev_start, current_start - pd.Timedelta(days=1), entity)
         
-        prev_month_rev = df[
-            (df['date'].dt.month == prev_month) &
-            (df['date'].dt.year == prev_year) &
-            (df['account'].str.contains('Revenue|Sales|Income', case=False, na=False)) &
-            (df['type'].str.lower() == 'credit')
-        ]['amount'].sum()
-        
-        variance = float(current_month_rev - prev_month_rev)
-        variance_pct = float((variance / prev_month_rev * 100) if prev_month_rev > 0 else 0)
+        variance = current_month_rev - prev_month_rev
+        variance_pct = (variance / prev_month_rev * 100) if prev_month_rev > 0 else 0
         
         return {
-            "current_month": f"{current_year}-{current_month:02d}",
-            "previous_month": f"{prev_year}-{prev_month:02d}",
-            "current_revenue": float(current_month_rev),
-            "previous_revenue": float(prev_month_rev),
+            "current_month": current_start.strftime("%Y-%m"),
+            "previous_month": prev_start.strftime("%Y-%m"),
+            "current_revenue": current_month_rev,
+            "previous_revenue": prev_month_rev,
             "variance": variance,
-            "variance_percentage": round(variance_pct, 2),
+            "variance_percentage": round(float(variance_pct), 2),
             "entity": entity
         }
     
-    def calculate_trailing_3m_revenue(self, transactions: List[Dict], entity: str = None) -> Dict:
-        """Calculate trailing 3 months rolling revenue"""
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        
-        if entity:
-            df = df[df.get('entity', '') == entity]
-        
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=90)
-        
-        trailing_rev = df[
-            (df['date'] >= start_date) &
-            (df['date'] <= end_date) &
-            (df['account'].str.contains('Revenue|Sales|Income', case=False, na=False)) &
-            (df['type'].str.lower() == 'credit')
-        ]['amount'].sum()
-        
+    @staticmethod
+    def _trailing_revenue(cube: RevenueCube, entity: Optional[str], as_of: pd.Timestamp, days: int = 90) -> Dict:
+        start_date = as_of - timedelta(days=days)
         return {
-            "period": "Trailing 3 Months",
+            "period": "Trailing 3 Months" if days == 90 else f"Trailing {days} Days",
             "start_date": start_date.strftime("%Y-%m-%d"),
-            "end_date": end_date.strftime("%Y-%m-%d"),
-            "total_revenue": float(trailing_rev),
+            "end_date": as_of.strftime("%Y-%m-%d"),
+            "total_revenue": cube.total(start_date, as_of, entity),
             "entity": entity
         }
     
-    def find_top_n_revenue(self, transactions: List[Dict], n: int = 10, entity: str = None) -> Dict:
-        """Find TOP N revenue transactions"""
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        
-        if entity:
-            df = df[df.get('entity', '') == entity]
-        
-        revenue_transactions = df[
-            (df['account'].str.contains('Revenue|Sales|Income', case=False, na=False)) &
-            (df['type'].str.lower() == 'credit')
-        ].copy()
-        
-        top_n = revenue_transactions.nlargest(n, 'amount')[['date', 'account', 'amount']].to_dict('records')
-        
-        return {
+    @timed('kpi.top_n')
+    def find_top_n_revenue(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        n: int = 10,
+        entity: str = None,
+        per_entity: bool = False
+    ) -> Dict:
+        """Find TOP N revenue transactions (and the TOP N of each entity when per_entity is set)"""
+        ledger = Ledger.coerce(transactions).for_entity(entity)
+        top_n = TopN(n, per_entity)
+        top_n.update(ledger, self._revenue_mask(ledger))
+        
+        result = {
             "top_n": n,
-            "transactions": [
-                {
-                    "date": row['date'].strftime("%Y-%m-%d") if isinstance(row['date'], pd.Timestamp) else str(row['date']),
-                    "account": row['account'],
-                    "amount": float(row['amount'])
-                }
-                for row in top_n
-            ],
+            "transactions": top_n.top(),
             "entity": entity
         }
+        if per_entity:
+            result["by_entity"] = top_n.by_entity()
+        return result
     
-    def find_unusual_transactions(self, transactions: List[Dict], entity: str = None) -> Dict:
-        """Find transactions posted on weekends"""
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        
-        if entity:
-            df = df[df.get('entity', '') == entity]
-        
-        # Find weekend transactions (Saturday = 5, Sunday = 6)
-        df['day_of_week'] = df['date'].dt.dayofweek
-        weekend_transactions = df[df['day_of_week'].isin([5, 6])].copy()
-        
-        unusual = weekend_transactions[['date', 'account', 'amount', 'type']].to_dict('records')
+    @timed('kpi.unusual_transactions')
+    def find_unusual_transactions(
+        self,
+        transactions: Union[Ledger, List[Dict]],
+        entity: str = None,
+        detectors: Optional[List[str]] = None,
+        offset: int = 0,
+        limit: Optional[int] = None
+    ) -> Dict:
+        """
+        Find unusual transactions: weekend postings by default, or any of
+        DETECTORS (round amounts, duplicates, period-end spikes, z-score outliers)
+        The flags are computed once per ledger, so paging through them is cheap
+        """
+        detectors = list(detectors or ['weekend'])
+        unknown = [name for name in detectors if name not in DETECTORS]
+        if unknown:
+            raise ValueError(f"Unknown detectors: {', '.join(unknown)}")
+        
+        ledger = Ledger.coerce(transactions).for_entity(entity)
+        flags = ledger.cached(
+            ('anomaly_flags', self.anomaly_detector.params),
+            lambda: self.anomaly_detector.flags(ledger)[0]
+        )
+        selected = flags[detectors].to_numpy()
+        hits = np.flatnonzero(selected.any(axis=1))
+        page = hits[offset:] if limit is None else hits[offset:offset + limit]
         
         return {
-            "unusual_type": "Weekend Postings",
-            "count": len(unusual),
-            "transactions": [
-                {
-                    "date": row['date'].strftime("%Y-%m-%d") if isinstance(row['date'], pd.Timestamp) else str(row['date']),
-                    "day": row['date'].strftime("%A") if isinstance(row['date'], pd.Timestamp) else "",
-                    "account": row['account'],
-                    "amount": float(row['amount']),
-                    "type": row['type']
-                }
-                for row in unusual
-            ],
+            "unusual_type": "Weekend Postings" if detectors == ['weekend'] else "Anomalies",
+            "detectors": detectors,
+            "count": len(hits),
+            "counts": {name: int(count) for name, count in zip(detectors, selected.sum(axis=0))},
+            "offset": offset,
+            "limit": limit,
+            "transactions": anomaly_records(ledger, flags, page, detectors),
             "entity": entity
         }
-
+    
+    @timed('kpi.screen_chunks', count_rows=False)
+    def screen_chunks(
+        self,
+        chunks: Callable[[], Iterable[Ledger]],
+        detectors: Optional[List[str]] = None,
+        n: int = 10,
+        per_entity: bool = False,
+        limit: int = 100
+    ) -> Dict:
+        """
+        Streaming TOP N revenue and anomaly screen over ledger chunks in constant memory
+        ``chunks`` must start the stream afresh on every call (baselines take a first pass)
+        """
+        detectors = list(detectors or DETECTORS)
+        unknown = [name for name in detectors if name not in DETECTORS]
+        if unknown:
+            raise ValueError(f"Unknown detectors: {', '.join(unknown)}")
+        screen = TransactionScreen(self.anomaly_detector, self.REVENUE_PATTERN, detectors, n, per_entity, limit)
+        return screen.run(chunks)
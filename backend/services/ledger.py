@@ -0,0 +1,364 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple, Union
+import pandas as pd
+import numpy as np
+from pandas.api.types import union_categoricals
+from services.metrics import stage, timed
+
+
+def frame_records(df: pd.DataFrame) -> List[Dict]:
+    """
+    JSON-friendly row dicts for a DataFrame (ISO dates, missing values as None)
+    """
+    records = df.astype(object)
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            records[column] = df[column].dt.strftime('%Y-%m-%d')
+    return records.where(records.notna(), None).to_dict('records')
+
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate frames row-wise, merging categorical dictionaries instead of
+    falling back to object columns
+    """
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+
+    columns = {}
+    names = list(dict.fromkeys(name for frame in frames for name in frame.columns))
+    for name in names:
+        parts = [
+            frame[name] if name in frame.columns else pd.Series(np.nan, index=frame.index)
+            for frame in frames
+        ]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[name] = pd.Series(union_categoricals([part.array for part in parts]))
+        else:
+            columns[name] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def _categorical_from_codes(name: str, codes: Sequence, dictionary: Sequence[str]) -> pd.Categorical:
+    """Categorical from dictionary codes, validating them"""
+    try:
+        codes = np.asarray(codes, dtype=np.int64)
+    except (TypeError, ValueError):
+        raise ValueError(f"Column '{name}' must hold integer codes into its dictionary (-1 for missing)")
+    if len(codes) and (codes.min() < -1 or codes.max() >= len(dictionary)):
+        raise ValueError(f"Column '{name}' has codes outside its dictionary of {len(dictionary)} values")
+    if len(set(dictionary)) != len(dictionary):
+        raise ValueError(f"Dictionary for '{name}' has duplicate values")
+    return pd.Categorical.from_codes(codes, categories=pd.Index(dictionary, dtype=object))
+
+
+def _float_array(values: Sequence) -> np.ndarray:
+    """Amounts as float64 (nulls and unparsable values become NaN)"""
+    try:
+        return np.asarray(values, dtype='float64')
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype='float64')
+
+
+@dataclass(frozen=True)
+class Ledger:
+    """
+    Parsed, read-only transaction ledger shared by the statement and KPI services
+
+    Dates are held as datetime64, amounts as float64 and account/type as
+    categoricals in ``frame``; the transaction type is also pre-decoded into
+    boolean debit/credit masks, and the reporting entity (``entity``, falling
+    back to ``subsidiary`` or ``company``) into a categorical. Build it once
+    per request with ``from_transactions`` / ``from_frame`` and pass it to
+    every generator method instead of the raw list.
+
+    Rows are kept in date order (stable, undated rows last), so a date
+    window is a ``searchsorted`` away and comes back as a zero-copy slice
+    (``date_slice`` / ``between``); per-entity row positions are indexed
+    once, so ``for_entity`` gathers a partition instead of scanning.
+    """
+
+    REQUIRED_COLUMNS = ('date', 'account', 'amount', 'type')
+    ENTITY_COLUMNS = ('entity', 'subsidiary', 'company')
+
+    frame: pd.DataFrame
+    entity: pd.Categorical
+    is_debit: np.ndarray
+    is_credit: np.ndarray
+    _cache: Dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_transactions(cls, transactions: List[Dict]) -> 'Ledger':
+        """
+        Parse a list of transaction dicts
+        """
+        with stage('ledger.dataframe', len(transactions)):
+            frame = pd.DataFrame(transactions)
+        return cls.from_frame(frame)
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Sequence], dictionaries: Optional[Dict[str, Sequence[str]]] = None) -> 'Ledger':
+        """
+        Parse parallel column arrays (date, account, amount, type, entity, ...)
+
+        A column named in ``dictionaries`` holds integer codes into that
+        list (-1 for missing), e.g. ``account: [0, 1, 0]`` with
+        ``dictionaries: {"account": ["Cash", "Sales"]}``, and becomes a
+        categorical without touching a string per row. Plain string columns
+        are categorized too, and dates are parsed once per distinct value.
+        """
+        dictionaries = dictionaries or {}
+        lengths = {name: len(values) for name, values in columns.items()}
+        if len(set(lengths.values())) > 1:
+            raise ValueError("Columns differ in length: " + ", ".join(f"{name}={n}" for name, n in lengths.items()))
+        unknown = [name for name in dictionaries if name not in columns]
+        if unknown:
+            raise ValueError(f"Dictionaries for missing columns: {', '.join(unknown)}")
+
+        with stage('ledger.decode_columns', max(lengths.values(), default=0)):
+            frame = {}
+            for name, values in columns.items():
+                if name in dictionaries:
+                    frame[name] = _categorical_from_codes(name, values, dictionaries[name])
+                elif name == 'amount':
+                    frame[name] = _float_array(values)
+                else:
+                    frame[name] = pd.Categorical(values)
+            if 'date' in frame and isinstance(frame['date'], pd.Categorical):
+                # Parse each distinct date once; code -1 picks the trailing NaT
+                dates = frame['date']
+                parsed = pd.to_datetime(pd.Series(dates.categories)).to_numpy(dtype='datetime64[ns]')
+                frame['date'] = np.append(parsed, np.datetime64('NaT', 'ns'))[dates.codes]
+            frame = pd.DataFrame(frame)
+        return cls.from_frame(frame)
+
+    @classmethod
+    @timed('ledger.from_frame')
+    def from_frame(cls, df: pd.DataFrame) -> 'Ledger':
+        """
+        Parse a raw DataFrame (e.g. straight from ``pd.read_csv``)
+        """
+        missing_columns = [col for col in cls.REQUIRED_COLUMNS if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+
+        df = df.copy(deep=False)
+        with stage('ledger.parse_dates', len(df)):
+            df['date'] = pd.to_datetime(df['date'])
+        with stage('ledger.parse_amounts', len(df)):
+            df['amount'] = pd.to_numeric(df['amount'], errors='coerce').astype('float64')
+        df['account'] = df['account'].astype('category')
+        df['type'] = df['type'].astype('category')
+
+        # Decode debit/credit once per distinct type value, not per row
+        types = df['type'].cat
+        lowered = np.array([str(value).lower() for value in types.categories])
+        codes = types.codes.to_numpy()
+        is_debit = np.isin(codes, np.flatnonzero(lowered == 'debit'))
+        is_credit = np.isin(codes, np.flatnonzero(lowered == 'credit'))
+
+        return cls._sorted(df, pd.Categorical(cls.resolve_entity(df)), is_debit, is_credit)
+
+    @classmethod
+    def resolve_entity(cls, df: pd.DataFrame) -> pd.Series:
+        """
+        Reporting entity per row: the first non-empty of ENTITY_COLUMNS, else NaN
+        """
+        entity = pd.Series(np.nan, index=df.index, dtype=object)
+        for column in reversed(cls.ENTITY_COLUMNS):
+            if column in df.columns:
+                values = df[column]
+                entity = values.where(values.notna() & (values != ''), entity)
+        return entity
+
+    @classmethod
+    def coerce(cls, data: Union['Ledger', List[Dict]]) -> 'Ledger':
+        """
+        Accept either a parsed Ledger or a raw transaction list
+        """
+        if isinstance(data, Ledger):
+            return data
+        return cls.from_transactions(data)
+
+    @classmethod
+    def _sorted(cls, frame: pd.DataFrame, entity: pd.Categorical,
+                is_debit: np.ndarray, is_credit: np.ndarray) -> 'Ledger':
+        """Ledger over the rows in date order (already sorted input is used as is)"""
+        dates = frame['date'].to_numpy()
+        # NaT compares false, so any undated row also forces a sort (which puts it last)
+        if not (dates[1:] >= dates[:-1]).all():
+            order = np.argsort(dates, kind='stable')
+            frame = frame.take(order).reset_index(drop=True)
+            entity = entity.take(order)
+            is_debit = np.asarray(is_debit)[order]
+            is_credit = np.asarray(is_credit)[order]
+        elif not isinstance(frame.index, pd.RangeIndex) or frame.index.start != 0:
+            frame = frame.reset_index(drop=True)
+        return cls._build(frame, entity, is_debit, is_credit)
+
+    @classmethod
+    def _build(cls, frame: pd.DataFrame, entity: pd.Categorical,
+               is_debit: np.ndarray, is_credit: np.ndarray) -> 'Ledger':
+        is_debit = np.asarray(is_debit, dtype=bool)
+        is_credit = np.asarray(is_credit, dtype=bool)
+        is_debit.setflags(write=False)
+        is_credit.setflags(write=False)
+        return cls(frame=frame, entity=entity, is_debit=is_debit, is_credit=is_credit)
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    @property
+    def date(self) -> np.ndarray:
+        return self.frame['date'].to_numpy()
+
+    @property
+    def amount(self) -> np.ndarray:
+        return self.frame['amount'].to_numpy()
+
+    @property
+    def account(self) -> pd.Categorical:
+        return self.frame['account'].array
+
+    def account_mask(self, pattern: str) -> np.ndarray:
+        """
+        Rows whose account matches a case-insensitive regex
+
+        The pattern is evaluated once per distinct account and broadcast
+        through the categorical codes; the mask is memoized on the ledger.
+        """
+        def compute():
+            accounts = self.account
+            matches = pd.Series(accounts.categories, dtype=object).str.contains(pattern, case=False, na=False)
+            # Code -1 (missing account) picks the trailing False
+            lookup = np.append(matches.to_numpy(dtype=bool), False)
+            mask = lookup[accounts.codes]
+            mask.setflags(write=False)
+            return mask
+        return self.cached(('account_mask', pattern), compute)
+
+    def append(self, batch: 'Ledger') -> 'Ledger':
+        """
+        New ledger with the batch's rows after this ledger's rows
+        """
+        entity = union_categoricals([self.entity, batch.entity])
+        return self._sorted(
+            concat_frames([self.frame, batch.frame]),
+            entity,
+            np.concatenate([self.is_debit, batch.is_debit]),
+            np.concatenate([self.is_credit, batch.is_credit])
+        )
+
+    def assign(self, **columns) -> 'Ledger':
+        """
+        Ledger with frame columns added or replaced (rows and masks unchanged)
+        """
+        return self._build(self.frame.assign(**columns), self.entity, self.is_debit, self.is_credit)
+
+    def take(self, rows: Union[np.ndarray, slice]) -> 'Ledger':
+        """
+        Ledger restricted to the rows selected by a boolean mask, ascending
+        positions or a slice (slices share memory with this ledger)
+        """
+        if not isinstance(rows, slice):
+            rows = np.asarray(rows)
+            if rows.dtype != bool:
+                frame = self.frame.take(rows)
+                return self._build(frame, self.entity.take(rows), self.is_debit[rows], self.is_credit[rows])
+        frame = self.frame[rows] if not isinstance(rows, slice) else self.frame.iloc[rows]
+        return self._build(frame, self.entity[rows], self.is_debit[rows], self.is_credit[rows])
+
+    def entity_rows(self, entity: str) -> np.ndarray:
+        """
+        Ascending row positions of one entity
+
+        Rows are grouped by entity code once (a stable argsort, so each
+        group stays in date order) and each lookup is a slice of that index.
+        """
+        order, offsets = self.entity_index()
+        categories = self.entity.categories
+        if entity not in categories:
+            return order[:0]
+        code = categories.get_loc(entity)
+        return order[offsets[code]:offsets[code + 1]]
+
+    def entity_index(self):
+        """
+        (order, offsets): row positions grouped by entity code, each group in
+        date order; code c occupies order[offsets[c]:offsets[c + 1]] and rows
+        without an entity order[:offsets[0]]
+        """
+        return self.cached('entity_index', self._entity_index)
+
+    def _entity_index(self):
+        codes = self.entity.codes
+        order = np.argsort(codes, kind='stable')
+        # Code -1 (no entity) sorts first; offsets[c] is where code c starts
+        offsets = np.searchsorted(codes[order], np.arange(len(self.entity.categories) + 1))
+        order.setflags(write=False)
+        return order, offsets
+
+    def for_entity(self, entity: str = None) -> 'Ledger':
+        """
+        Ledger restricted to one entity (the whole ledger when entity is empty)
+        """
+        if not entity:
+            return self
+        return self.cached(('entity', entity), lambda: self.take(self.entity_rows(entity)))
+
+    def date_slice(self, start_date=None, end_date=None) -> slice:
+        """
+        Row slice of an inclusive date range (open-ended when a bound is empty;
+        undated rows fall outside any range with an end date)
+        """
+        dates = self.date
+        first = 0
+        last = len(dates)
+        if start_date is not None and start_date != '':
+            first = int(np.searchsorted(dates, pd.Timestamp(start_date).to_datetime64(), side='left'))
+            # Undated rows sort last; a lower bound alone must still exclude them
+            last = self._dated_rows()
+        if end_date is not None and end_date != '':
+            last = int(np.searchsorted(dates, pd.Timestamp(end_date).to_datetime64(), side='right'))
+        return slice(first, max(first, last))
+
+    def date_span(self):
+        """
+        (first, last) posting date, NaT when no row is dated
+        """
+        dated = self._dated_rows()
+        if dated == 0:
+            return pd.NaT, pd.NaT
+        dates = self.date
+        return pd.Timestamp(dates[0]), pd.Timestamp(dates[dated - 1])
+
+    def _dated_rows(self) -> int:
+        return self.cached('dated_rows', lambda: int(len(self) - np.isnat(self.date).sum()))
+
+    def between(self, start_date: str = None, end_date: str = None) -> 'Ledger':
+        """
+        Ledger restricted to an inclusive date range (open-ended when a bound is empty)
+        """
+        if not start_date and not end_date:
+            return self
+        return self.take(self.date_slice(start_date, end_date))
+
+    def to_records(self) -> List[Dict]:
+        """
+        JSON-friendly row dicts (ISO dates, missing values as None)
+        """
+        return frame_records(self.frame)
+
+    def cached(self, key: Hashable, compute: Callable):
+        """
+        Memoize a value derived from this ledger (safe because it is read-only)
+        """
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def cached_values(self) -> Tuple:
+        """
+        Snapshot of the memoized values (per-entity ledgers, masks, summaries)
+        """
+        return tuple(self._cache.values())
@@ -0,0 +1,148 @@
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+import pandas as pd
+import numpy as np
+from services.ledger import Ledger
+from services.revenue_cube import RevenueCube
+
+
+NO_ENTITY = ''
+
+
+@dataclass(frozen=True)
+class LedgerAggregates:
+    """
+    Running totals over an append-only ledger
+
+    Holds everything the statements and the date-window KPIs need, keyed by
+    groups rather than rows:
+
+    - ``account_totals``: debit/credit sums per distinct account
+    - ``revenue_daily``: revenue credits per (entity, day)
+    - ``ar_daily``: AR debits/credits per (entity, day), i.e. AR by age cohort
+    - ``entity_totals``: row count, debit/credit sums and date span per entity
+
+    ``append`` aggregates only the new batch and merges it in, so refreshing
+    after a batch costs O(batch + groups) instead of O(history). Rows without
+    an entity are keyed by ``NO_ENTITY``. Structures derived from the totals
+    (the revenue cube) are built once per snapshot and memoized on it.
+    """
+
+    revenue_pattern: str
+    ar_pattern: str
+    account_totals: pd.DataFrame
+    revenue_daily: pd.Series
+    ar_daily: pd.DataFrame
+    entity_totals: pd.DataFrame
+    _cache: Dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_ledger(cls, ledger: Ledger, revenue_pattern: str, ar_pattern: str) -> 'LedgerAggregates':
+        """
+        Aggregate a whole ledger
+        """
+        amounts = np.nan_to_num(ledger.amount)
+        entities = np.asarray(pd.Series(ledger.entity, dtype=object).fillna(NO_ENTITY))
+        days = pd.DatetimeIndex(ledger.date).normalize()
+
+        accounts = pd.Series(ledger.account, dtype=object)
+        account_totals = pd.DataFrame({
+            'debit': np.where(ledger.is_debit, amounts, 0.0),
+            'credit': np.where(ledger.is_credit, amounts, 0.0),
+        }).groupby(accounts.to_numpy()).sum()
+        account_totals.index.name = 'account'
+
+        revenue = ledger.account_mask(revenue_pattern) & ledger.is_credit
+        revenue_daily = pd.Series(amounts[revenue]).groupby(
+            [entities[revenue], days[revenue]]
+        ).sum().rename_axis(['entity', 'date'])
+
+        ar = ledger.account_mask(ar_pattern)
+        ar_daily = pd.DataFrame({
+            'debit': np.where(ledger.is_debit[ar], amounts[ar], 0.0),
+            'credit': np.where(ledger.is_credit[ar], amounts[ar], 0.0),
+        }).groupby([entities[ar], days[ar]]).sum().rename_axis(['entity', 'date'])
+
+        entity_totals = pd.DataFrame({
+            'transactions': np.ones(len(ledger), dtype=np.int64),
+            'debit': np.where(ledger.is_debit, amounts, 0.0),
+            'credit': np.where(ledger.is_credit, amounts, 0.0),
+            'min_date': ledger.date,
+            'max_date': ledger.date,
+        }).groupby(entities).agg({
+            'transactions': 'sum', 'debit': 'sum', 'credit': 'sum', 'min_date': 'min', 'max_date': 'max'
+        }).rename_axis('entity')
+
+        return cls(revenue_pattern, ar_pattern, account_totals, revenue_daily, ar_daily, entity_totals)
+
+    def append(self, batch: Ledger) -> 'LedgerAggregates':
+        """
+        Aggregates after appending a batch of transactions
+        """
+        delta = self.from_ledger(batch, self.revenue_pattern, self.ar_pattern)
+
+        sums = ['transactions', 'debit', 'credit']
+        entity_totals = self.entity_totals[sums].add(delta.entity_totals[sums], fill_value=0).join(
+            pd.concat([self.entity_totals, delta.entity_totals])
+            .groupby(level='entity')
+            .agg({'min_date': 'min', 'max_date': 'max'})
+        )
+        entity_totals['transactions'] = entity_totals['transactions'].astype(np.int64)
+
+        return LedgerAggregates(
+            self.revenue_pattern,
+            self.ar_pattern,
+            self.account_totals.add(delta.account_totals, fill_value=0),
+            self.revenue_daily.add(delta.revenue_daily, fill_value=0),
+            self.ar_daily.add(delta.ar_daily, fill_value=0),
+            entity_totals
+        )
+
+    @property
+    def rows(self) -> int:
+        return int(self.entity_totals['transactions'].sum())
+
+    def date_span(self, entity: Optional[str] = None):
+        """
+        (min, max) posting date overall or for one entity
+        """
+        totals = self.entity_totals
+        if entity:
+            totals = totals.loc[totals.index == entity]
+        return totals['min_date'].min(), totals['max_date'].max()
+
+    def period(self) -> str:
+        """Reporting period in the same format as the statement generator"""
+        if self.rows == 0:
+            return "N/A"
+        min_date, max_date = self.date_span()
+        return f"{min_date.strftime('%Y-%m-%d')} to {max_date.strftime('%Y-%m-%d')}"
+
+    def revenue_cube(self) -> RevenueCube:
+        """
+        Single-category revenue cube over ``revenue_daily`` (memoized; an append
+        returns a new snapshot, so it never goes stale)
+        """
+        if 'revenue_cube' not in self._cache:
+            self._cache['revenue_cube'] = RevenueCube.from_daily(self.revenue_daily, self.revenue_pattern)
+        return self._cache['revenue_cube']
+
+    def revenue_by_day(self, entity: Optional[str] = None) -> pd.Series:
+        """
+        Daily revenue for one entity, or summed over all entities
+        """
+        return self._by_day(self.revenue_daily, entity)
+
+    def ar_by_day(self, entity: Optional[str] = None) -> pd.DataFrame:
+        """
+        Daily AR debits/credits for one entity, or summed over all entities
+        """
+        return self._by_day(self.ar_daily, entity)
+
+    @staticmethod
+    def _by_day(values, entity: Optional[str]):
+        if entity:
+            values = values[values.index.get_level_values('entity') == entity]
+        by_day = values.groupby(level='date').sum()
+        by_day.index = pd.DatetimeIndex(by_day.index)
+        return by_day
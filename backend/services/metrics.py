@@ -0,0 +1,302 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+# Stage timings of the request being served, for its Server-Timing header
+_request_stages: ContextVar[Optional[List[Tuple[str, float, Optional[int]]]]] = ContextVar(
+    'request_stages', default=None
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout (latency buckets by default)"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> List[str]:
+        lines, running = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {running}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum!r}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide request and stage metrics, rendered in the Prometheus text format
+
+    Stages are the hot paths inside a request (ledger parsing, each
+    statement section, each KPI, FX fetches, OpenAI calls): each gets a
+    latency histogram, a rows-processed counter and an error counter.
+    Requests get a latency histogram per method, route template and
+    status. Stage timings are also collected per request so they can be
+    sent back in a ``Server-Timing`` header.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None):
+        if enabled is None:
+            enabled = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Histogram] = {}
+        self._stage_rows: Dict[str, int] = {}
+        self._stage_errors: Dict[str, int] = {}
+        self._requests: Dict[Tuple[str, str, str], Histogram] = {}
+        self._tokens: Dict[Tuple[str, str], int] = {}
+        self._prompt_tokens: Dict[str, Histogram] = {}
+        self._in_progress = 0
+
+    def observe_stage(self, stage: str, seconds: float, rows: Optional[int] = None, error: bool = False):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._stages.setdefault(stage, Histogram()).observe(seconds)
+            self._stage_rows[stage] = self._stage_rows.get(stage, 0) + (rows or 0)
+            if error:
+                self._stage_errors[stage] = self._stage_errors.get(stage, 0) + 1
+        collected = _request_stages.get()
+        if collected is not None:
+            collected.append((stage, seconds, rows))
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._requests.setdefault((method, route, str(status)), Histogram()).observe(seconds)
+
+    def observe_tokens(self, model: str, prompt: Optional[int], completion: Optional[int]):
+        """Token usage of one model call, as reported by the API"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for kind, tokens in (('prompt', prompt), ('completion', completion)):
+                self._tokens[(model, kind)] = self._tokens.get((model, kind), 0) + (tokens or 0)
+
+    def observe_prompt(self, model: str, tokens: int):
+        """Size of one prompt sent to a model, counted before sending"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._prompt_tokens.setdefault(model, Histogram(TOKEN_BUCKETS)).observe(tokens)
+
+    def track_in_progress(self, delta: int):
+        with self._lock:
+            self._in_progress += delta
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4)
+        """
+        with self._lock:
+            lines = [
+                '# HELP fintool_http_request_duration_seconds Request latency by method, route and status',
+                '# TYPE fintool_http_request_duration_seconds histogram',
+            ]
+            for (method, route, status), histogram in sorted(self._requests.items()):
+                labels = f'method="{method}",route="{_escape(route)}",status="{status}"'
+                lines.extend(histogram.lines('fintool_http_request_duration_seconds', labels))
+            lines += [
+                '# HELP fintool_http_requests_in_progress Requests being served',
+                '# TYPE fintool_http_requests_in_progress gauge',
+                f'fintool_http_requests_in_progress {self._in_progress}',
+                '# HELP fintool_stage_duration_seconds Latency of instrumented processing stages',
+                '# TYPE fintool_stage_duration_seconds histogram',
+            ]
+            for stage, histogram in sorted(self._stages.items()):
+                lines.extend(histogram.lines('fintool_stage_duration_seconds', f'stage="{_escape(stage)}"'))
+            lines += [
+                '# HELP fintool_stage_rows_total Rows processed by instrumented stages',
+                '# TYPE fintool_stage_rows_total counter',
+            ]
+            lines.extend(f'fintool_stage_rows_total{{stage="{_escape(stage)}"}} {rows}'
+                         for stage, rows in sorted(self._stage_rows.items()))
+            lines += [
+                '# HELP fintool_stage_errors_total Instrumented stages that raised',
+                '# TYPE fintool_stage_errors_total counter',
+            ]
+            lines.extend(f'fintool_stage_errors_total{{stage="{_escape(stage)}"}} {errors}'
+                         for stage, errors in sorted(self._stage_errors.items()))
+            lines += [
+                '# HELP fintool_openai_tokens_total Tokens used by model calls, as reported by the API',
+                '# TYPE fintool_openai_tokens_total counter',
+            ]
+            lines.extend(f'fintool_openai_tokens_total{{model="{_escape(model)}",kind="{kind}"}} {tokens}'
+                         for (model, kind), tokens in sorted(self._tokens.items()))
+            lines += [
+                '# HELP fintool_openai_prompt_tokens Prompt size of each model request, counted before sending',
+                '# TYPE fintool_openai_prompt_tokens histogram',
+            ]
+            for model, histogram in sorted(self._prompt_tokens.items()):
+                lines.extend(histogram.lines('fintool_openai_prompt_tokens', f'model="{_escape(model)}"'))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._stage_rows.clear()
+            self._stage_errors.clear()
+            self._requests.clear()
+            self._tokens.clear()
+            self._prompt_tokens.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+
+@contextmanager
+def stage(name: str, rows: Optional[int] = None):
+    """
+    Time a block as a named stage (rows processed optional)
+    """
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        REGISTRY.observe_stage(name, time.perf_counter() - started, rows, error)
+
+
+def timed(name: str, count_rows: bool = True):
+    """
+    Decorator timing a method (sync or async) as a stage
+
+    With ``count_rows`` the rows are the length of the method's first
+    argument (the Ledger or transaction list), whether it is passed by
+    position or by name, when it has one.
+    """
+    def decorate(function):
+        parameters = list(inspect.signature(function).parameters)
+        # The parameter after ``self``
+        data = parameters[1] if len(parameters) > 1 else None
+
+        def rows_of(args, kwargs) -> Optional[int]:
+            if not count_rows:
+                return None
+            if len(args) > 1:
+                value = args[1]
+            elif data in kwargs:
+                value = kwargs[data]
+            else:
+                return None
+            try:
+                return len(value)
+            except TypeError:
+                return None
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name, rows_of(args, kwargs)):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name, rows_of(args, kwargs)):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency by route template, and adding a
+    ``Server-Timing`` header with the request's stages when asked for
+
+    The header is sent when ``SERVER_TIMING`` is set, or per request when
+    the client sends ``X-Server-Timing: 1``. It lists each stage's total
+    duration and call count plus the whole request; stages of a streamed
+    response that finish after the headers are only in the histograms.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = REGISTRY, server_timing: Optional[bool] = None):
+        self.app = app
+        self.registry = registry
+        if server_timing is None:
+            server_timing = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        wants_timing = self.server_timing or dict(scope.get('headers') or []).get(b'x-server-timing') == b'1'
+        collected = []
+        token = _request_stages.set(collected)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if wants_timing:
+                    header = server_timing_header(collected, time.perf_counter() - started)
+                    message = {**message, 'headers': list(message.get('headers', [])) +
+                               [(b'server-timing', header.encode('latin-1'))]}
+            await send(message)
+
+        self.registry.track_in_progress(1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.registry.track_in_progress(-1)
+            _request_stages.reset(token)
+            self.registry.observe_request(scope['method'], _route(scope), status, time.perf_counter() - started)
+
+
+def server_timing_header(stages: List[Tuple[str, float, Optional[int]]], total: float) -> str:
+    """
+    ``Server-Timing`` value: one entry per stage (summed over its calls) plus the total
+    """
+    summed: Dict[str, List] = {}
+    for name, seconds, rows in list(stages):
+        entry = summed.setdefault(name, [0.0, 0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+        entry[2] += rows or 0
+    parts = []
+    for name, (seconds, calls, rows) in summed.items():
+        desc = f'{calls} call{"s" if calls != 1 else ""}' + (f', {rows} rows' if rows else '')
+        parts.append(f'{name};dur={seconds * 1000:.1f};desc="{desc}"')
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def _route(scope) -> str:
+    """Route template (e.g. /api/datasets/{dataset_id}) so labels stay bounded"""
+    route = scope.get('route')
+    path = getattr(route, 'path', None)
+    return path or 'unmatched'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
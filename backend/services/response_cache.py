@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from services.async_cache import AsyncTTLCache
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of AI analysis results
+
+    Entries are keyed by a SHA-256 of everything that determines the answer
+    (see ``key``) and expire after ``ttl`` seconds. The in-memory layer is
+    an LRU-bounded AsyncTTLCache, so identical concurrent requests also
+    share one model call; when ``path`` (or ``AI_CACHE_PATH``) is set,
+    results are additionally written to a SQLite file that survives
+    restarts and is bounded to ``disk_max_entries`` rows.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+        disk_max_entries: int = 10000
+    ):
+        self.ttl = ttl or float(os.getenv("AI_CACHE_TTL", "86400"))
+        self.memory = AsyncTTLCache(max_entries or int(os.getenv("AI_CACHE_MAX_ENTRIES", "512")))
+        self.path = path if path is not None else os.getenv("AI_CACHE_PATH", "")
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if self.path:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """
+        Stable hash of JSON-serializable key parts
+        """
+        payload = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Any:
+        """
+        Cached value for a key (memory first, then disk), or None
+        """
+        value = self.memory.get(key)
+        if value is None:
+            value = self._disk_get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value, self.ttl)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value, self.ttl)
+        self._disk_set(key, value)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Cached value for a key, computing it at most once across concurrent callers
+
+        Nothing is cached when ``compute`` raises.
+        """
+        loaded = False
+
+        async def load():
+            nonlocal loaded
+            loaded = True
+            value = self._disk_get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.hits += 1
+                return value
+            self.misses += 1
+            value = await compute()
+            self._disk_set(key, value)
+            return value
+
+        value = await self.memory.get_or_load(key, load, ttl=self.ttl)
+        if not loaded:
+            # Served from memory or by joining an in-flight computation
+            self.hits += 1
+        return value
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.memory.keys()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "disk_path": self.path or None
+        }
+
+    def _disk_get(self, key: str) -> Any:
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _disk_set(self, key: str, value: Any):
+        if self._conn is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, default=str), now, now + self.ttl)
+            )
+            self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY created_at DESC LIMIT ?)",
+                (self.disk_max_entries,)
+            )
+            self._conn.commit()
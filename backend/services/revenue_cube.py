@@ -0,0 +1,121 @@
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+import pandas as pd
+import numpy as np
+from services.ledger import Ledger
+
+
+@dataclass(frozen=True)
+class RevenueCube:
+    """
+    Revenue credits as an (entity × account category × posting day) cube of prefix sums
+
+    ``prefix[e, c, i]`` is the revenue of entity ``e`` in category ``c``
+    posted before ``days[i]``, so the revenue over any inclusive date range
+    is two binary searches on ``days`` and one subtraction, whatever the
+    size of the ledger. Per-entity, per-category and overall roll-ups are
+    kept alongside so those queries need no summing either. Only days with
+    postings get a column, so a stray far-off date does not inflate the
+    array. Rows without an entity count towards the totals but cannot be
+    selected by name.
+    """
+
+    entities: Dict[str, int]
+    categories: Dict[str, int]
+    days: np.ndarray
+    prefix: np.ndarray
+    entity_prefix: np.ndarray
+    category_prefix: np.ndarray
+    total_prefix: np.ndarray
+
+    @classmethod
+    def from_ledger(cls, ledger: Ledger, categories: Sequence[str]) -> 'RevenueCube':
+        """
+        Cube of a ledger's revenue credits
+
+        Each account falls in the first category whose (case-insensitive)
+        pattern it matches; accounts matching none are not revenue.
+        """
+        category_codes = np.full(len(ledger), -1, dtype=np.int64)
+        for code, pattern in reversed(list(enumerate(categories))):
+            category_codes[ledger.account_mask(pattern)] = code
+        dates = ledger.date
+        rows = ledger.is_credit & (category_codes >= 0) & ~np.isnat(dates)
+
+        entity = ledger.entity
+        entity_codes = entity.codes[rows].astype(np.int64)
+        # Code -1 (no entity) maps to a trailing unnamed slot
+        entity_codes[entity_codes < 0] = len(entity.categories)
+        return cls._build(
+            list(entity.categories), entity_codes,
+            list(categories), category_codes[rows],
+            dates[rows], np.nan_to_num(ledger.amount[rows])
+        )
+
+    @classmethod
+    def from_daily(cls, revenue_daily: pd.Series, category: str) -> 'RevenueCube':
+        """
+        Single-category cube from revenue totals indexed by (entity, date)
+        """
+        entity_codes, entity_names = pd.factorize(revenue_daily.index.get_level_values('entity'))
+        return cls._build(
+            list(entity_names), entity_codes.astype(np.int64),
+            [category], np.zeros(len(revenue_daily), dtype=np.int64),
+            revenue_daily.index.get_level_values('date').to_numpy(), revenue_daily.to_numpy(dtype='float64')
+        )
+
+    @classmethod
+    def _build(cls, entity_names, entity_codes, category_names, category_codes, dates, amounts) -> 'RevenueCube':
+        days, day_codes = np.unique(dates.astype('datetime64[D]'), return_inverse=True)
+        shape = (len(entity_names) + 1, len(category_names), len(days))
+        cells = np.ravel_multi_index((entity_codes, category_codes, day_codes), shape)
+        cube = np.bincount(cells, weights=amounts, minlength=int(np.prod(shape))).reshape(shape)
+
+        prefix = np.zeros(shape[:2] + (len(days) + 1,))
+        np.cumsum(cube, axis=2, out=prefix[:, :, 1:])
+        entity_prefix = prefix.sum(axis=1)
+        return cls(
+            entities={name: code for code, name in enumerate(entity_names)},
+            categories={name: code for code, name in enumerate(category_names)},
+            days=days,
+            prefix=prefix,
+            entity_prefix=entity_prefix,
+            category_prefix=prefix.sum(axis=0),
+            total_prefix=entity_prefix.sum(axis=0)
+        )
+
+    def total(
+        self,
+        start=None,
+        end=None,
+        entity: Optional[str] = None,
+        category: Optional[str] = None
+    ) -> float:
+        """
+        Revenue posted between two dates (inclusive, open-ended when a bound is None)
+        for one entity and/or account category, or for all of them
+        """
+        if entity and entity not in self.entities:
+            return 0.0
+        if category and category not in self.categories:
+            raise ValueError(f"Unknown revenue category: {category}")
+
+        if entity and category:
+            series = self.prefix[self.entities[entity], self.categories[category]]
+        elif category:
+            series = self.category_prefix[self.categories[category]]
+        elif entity:
+            series = self.entity_prefix[self.entities[entity]]
+        else:
+            series = self.total_prefix
+
+        first = 0 if start is None else int(np.searchsorted(self.days, _day(start), side='left'))
+        last = len(self.days) if end is None else int(np.searchsorted(self.days, _day(end), side='right'))
+        if last <= first:
+            return 0.0
+        # Differences of running sums carry float noise in the last bits
+        return round(float(series[last] - series[first]), 6)
+
+
+def _day(value) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(value).date(), 'D')
@@ -0,0 +1,331 @@
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import pandas as pd
+import numpy as np
+from services.ledger import Ledger
+
+
+DETECTORS = ('weekend', 'round_amount', 'duplicate', 'period_end_spike', 'zscore')
+DUPLICATE_COLUMNS = ('date', 'account', 'amount', 'type')
+
+
+def _format_dates(dates: pd.Series) -> List[str]:
+    return dates.dt.strftime("%Y-%m-%d").where(dates.notna(), '').tolist()
+
+
+class TopN:
+    """
+    Bounded top-N of revenue rows, overall and optionally per entity
+
+    Each ``update`` keeps only the rows that can still make the cut (an
+    ``argpartition`` per chunk, then a merge with the current candidates),
+    so memory is O(n × entities) whatever the number of rows streamed
+    through. Ties keep the earlier row, like ``DataFrame.nlargest``.
+    """
+
+    COLUMNS = ('date', 'account', 'amount', 'entity', 'seq')
+
+    def __init__(self, n: int = 10, per_entity: bool = False):
+        self.n = max(int(n), 0)
+        self.per_entity = per_entity
+        self.rows = 0
+        self.candidates = pd.DataFrame({column: [] for column in self.COLUMNS})
+
+    def update(self, ledger: Ledger, mask: np.ndarray):
+        """
+        Offer the masked rows of a ledger chunk
+        """
+        amounts = ledger.amount
+        positions = np.flatnonzero(mask & ~np.isnan(amounts))
+        seq = self.rows + positions
+        self.rows += len(ledger)
+        if len(positions) == 0 or self.n == 0:
+            return
+
+        if not self.per_entity and len(positions) > self.n:
+            # Anything tied with the n-th largest may still win on order
+            cutoff = np.partition(amounts[positions], len(positions) - self.n)[len(positions) - self.n]
+            keep = amounts[positions] >= cutoff
+            positions, seq = positions[keep], seq[keep]
+
+        chunk = pd.DataFrame({
+            'date': ledger.frame['date'].to_numpy()[positions],
+            'account': np.asarray(ledger.account)[positions],
+            'amount': amounts[positions],
+            'entity': np.asarray(ledger.entity)[positions],
+            'seq': seq,
+        })
+        pool = pd.concat([self.candidates, chunk], ignore_index=True) if len(self.candidates) else chunk
+        pool = pool.sort_values(['amount', 'seq'], ascending=[False, True], kind='stable')
+
+        keep = np.zeros(len(pool), dtype=bool)
+        keep[:self.n] = True
+        if self.per_entity:
+            keep |= (pool.groupby('entity', sort=False, dropna=False).cumcount() < self.n).to_numpy()
+        self.candidates = pool[keep].reset_index(drop=True)
+
+    def top(self, entity: Optional[str] = None) -> List[Dict]:
+        """
+        The N largest rows seen, overall or for one entity
+        """
+        rows = self.candidates
+        if entity is not None:
+            rows = rows[rows['entity'] == entity]
+        rows = rows.head(self.n)
+        return [
+            {"date": date, "account": account, "amount": float(amount)}
+            for date, account, amount in zip(
+                _format_dates(pd.to_datetime(rows['date'])), rows['account'], rows['amount']
+            )
+        ]
+
+    def by_entity(self) -> Dict[str, List[Dict]]:
+        entities = self.candidates['entity'].dropna().unique()
+        return {str(entity): self.top(entity) for entity in entities}
+
+
+class RowHashes:
+    """
+    Distinct 64-bit row hashes for streaming duplicate detection
+
+    Held as sorted ``uint64`` runs (8 bytes per distinct row, no boxed
+    ints), largest first; a new run is merged into the last one while it is
+    at least as large, so there are O(log n) runs and each hash is merged
+    O(log n) times. Membership is one ``searchsorted`` per run.
+    """
+
+    def __init__(self):
+        self.runs: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        # Sorted queries walk each run in order instead of jumping around it
+        order = np.argsort(hashes)
+        queries = hashes[order]
+        hit = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, queries), len(run) - 1)
+            hit |= run[positions] == queries
+        found = np.empty(len(hashes), dtype=bool)
+        found[order] = hit
+        return found
+
+    def add(self, hashes: np.ndarray):
+        """Add hashes that are distinct and not yet held"""
+        run = np.sort(hashes)
+        while self.runs and len(self.runs[-1]) <= len(run):
+            run = np.union1d(self.runs.pop(), run)
+        if len(run):
+            self.runs.append(run)
+
+
+class AnomalyDetector:
+    """
+    Flags unusual postings with several detectors in one vectorized pass
+
+    - ``weekend``: posted on a Saturday or Sunday
+    - ``round_amount``: a non-zero multiple of ``round_unit``
+    - ``duplicate``: same date, account, amount, type and entity as an
+      earlier row
+    - ``period_end_spike``: posted in the last ``period_end_days`` days of
+      a month for at least ``spike_factor`` times the account's average
+      amount outside period ends
+    - ``zscore``: more than ``z_threshold`` standard deviations from the
+      account's mean amount (accounts with at least ``min_account_rows`` rows)
+
+    The account baselines come from ``account_stats``, whose columns are
+    plain sums, so chunk statistics can be added together for streaming.
+    """
+
+    def __init__(
+        self,
+        round_unit: float = 1000.0,
+        z_threshold: float = 3.0,
+        period_end_days: int = 3,
+        spike_factor: float = 3.0,
+        min_account_rows: int = 5
+    ):
+        self.round_unit = round_unit
+        self.z_threshold = z_threshold
+        self.period_end_days = period_end_days
+        self.spike_factor = spike_factor
+        self.min_account_rows = min_account_rows
+
+    @property
+    def params(self) -> Tuple:
+        return (self.round_unit, self.z_threshold, self.period_end_days, self.spike_factor, self.min_account_rows)
+
+    def account_stats(self, ledger: Ledger) -> pd.DataFrame:
+        """
+        Per-account sums for the baselines (row count, sum, sum of squares,
+        and count and absolute sum outside period ends)
+        """
+        amounts = ledger.amount
+        valid = ~np.isnan(amounts)
+        values = np.where(valid, amounts, 0.0)
+        outside = valid & ~self._period_end(ledger.frame['date'])
+        accounts = pd.Series(ledger.account).astype(object).to_numpy()
+        return pd.DataFrame({
+            'count': valid.astype(np.int64),
+            'sum': values,
+            'sumsq': values * values,
+            'normal_count': outside.astype(np.int64),
+            'normal_abs_sum': np.where(outside, np.abs(values), 0.0),
+        }).groupby(accounts).sum()
+
+    def flags(
+        self,
+        ledger: Ledger,
+        stats: Optional[pd.DataFrame] = None,
+        seen: Optional[RowHashes] = None
+    ) -> Tuple[pd.DataFrame, RowHashes]:
+        """
+        One boolean column per detector plus the row z-score, and the updated
+        row hashes (pass the previous ones when screening chunk by chunk; they
+        are updated in place)
+        """
+        frame = ledger.frame
+        dates = frame['date']
+        amounts = ledger.amount
+        if stats is None:
+            stats = self.account_stats(ledger)
+
+        baseline = stats.reindex(pd.Series(ledger.account).astype(object).to_numpy())
+        count = baseline['count'].to_numpy(dtype='float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = baseline['sum'].to_numpy() / count
+            variance = (baseline['sumsq'].to_numpy() - count * mean * mean) / (count - 1)
+            std = np.sqrt(np.clip(variance, 0, None))
+            zscore = np.where((count >= self.min_account_rows) & (std > 0), (amounts - mean) / std, np.nan)
+            normal_mean = baseline['normal_abs_sum'].to_numpy() / baseline['normal_count'].to_numpy()
+
+        hashes = pd.util.hash_pandas_object(
+            pd.DataFrame({
+                **{column: frame[column] for column in DUPLICATE_COLUMNS},
+                'entity': pd.Series(np.asarray(ledger.entity, dtype=object), index=frame.index)
+            }),
+            index=False
+        ).to_numpy()
+        duplicate = pd.Series(hashes).duplicated().to_numpy()
+        if seen is None:
+            seen = RowHashes()
+        elif seen.runs:
+            duplicate |= seen.contains(hashes)
+        seen.add(hashes[~duplicate])
+
+        with np.errstate(invalid='ignore'):
+            flags = pd.DataFrame({
+                'weekend': dates.dt.dayofweek.isin([5, 6]).to_numpy(),
+                'round_amount': (amounts != 0) & (np.mod(amounts, self.round_unit) == 0),
+                'duplicate': duplicate,
+                'period_end_spike': (
+                    self._period_end(dates) & (normal_mean > 0) & (np.abs(amounts) >= self.spike_factor * normal_mean)
+                ),
+                'zscore': np.abs(zscore) > self.z_threshold,
+            }, index=frame.index)
+        flags['z'] = zscore
+        return flags, seen
+
+    def _period_end(self, dates: pd.Series) -> np.ndarray:
+        return (dates.dt.days_in_month - dates.dt.day < self.period_end_days).to_numpy()
+
+
+class TransactionScreen:
+    """
+    Top-N revenue and anomaly screen over a stream of ledger chunks
+
+    Holds the TopN candidates, per-detector counts, the hashes needed for
+    duplicate detection and at most ``limit`` flagged rows, so the rows
+    themselves are never all in memory. The hashes are the one part that
+    grows with the stream: 8 bytes per distinct row (about 80 MB for 10M
+    rows), against the full columnar ledger they replace. The
+    account baselines need a first pass over the chunks; ``run`` takes a
+    callable that restarts the stream so it can be read twice.
+    """
+
+    def __init__(
+        self,
+        detector: AnomalyDetector,
+        revenue_pattern: str,
+        detectors: Sequence[str] = DETECTORS,
+        n: int = 10,
+        per_entity: bool = False,
+        limit: int = 100
+    ):
+        self.detector = detector
+        self.revenue_pattern = revenue_pattern
+        self.detectors = list(detectors)
+        self.top_n = TopN(n, per_entity)
+        self.limit = limit
+        self.counts = {name: 0 for name in self.detectors}
+        self.flagged = 0
+        self.samples = []
+        self.chunks = 0
+
+    def run(self, chunks: Callable[[], Iterable[Ledger]]) -> Dict:
+        stats = None
+        if {'period_end_spike', 'zscore'} & set(self.detectors):
+            for chunk in chunks():
+                chunk_stats = self.detector.account_stats(chunk)
+                stats = chunk_stats if stats is None else stats.add(chunk_stats, fill_value=0)
+
+        seen = None
+        for chunk in chunks():
+            self.chunks += 1
+            self.top_n.update(chunk, chunk.account_mask(self.revenue_pattern) & chunk.is_credit)
+            flags, seen = self.detector.flags(chunk, stats, seen)
+            selected = flags[self.detectors]
+            for name in self.detectors:
+                self.counts[name] += int(selected[name].sum())
+            hits = np.flatnonzero(selected.to_numpy().any(axis=1))
+            self.flagged += len(hits)
+            room = self.limit - len(self.samples)
+            if room > 0 and len(hits):
+                self.samples.extend(anomaly_records(chunk, flags, hits[:room], self.detectors))
+
+        result = {
+            "chunks": self.chunks,
+            "rows": self.top_n.rows,
+            "top_n": self.top_n.n,
+            "transactions": self.top_n.top(),
+            "anomalies": {
+                "detectors": self.detectors,
+                "count": self.flagged,
+                "counts": self.counts,
+                "limit": self.limit,
+                "transactions": self.samples
+            }
+        }
+        if self.top_n.per_entity:
+            result["by_entity"] = self.top_n.by_entity()
+        return result
+
+
+def anomaly_records(ledger: Ledger, flags: pd.DataFrame, positions: np.ndarray,
+                    detectors: Sequence[str]) -> List[Dict]:
+    """
+    JSON rows for flagged positions, with the detectors that fired on each
+    """
+    frame = ledger.frame.iloc[positions]
+    dates = frame['date']
+    fired = flags[list(detectors)].to_numpy()[positions]
+    names = np.array(detectors, dtype=object)
+    z = flags['z'].to_numpy()[positions]
+    records = []
+    for i, (date, day, account, amount, kind) in enumerate(zip(
+        _format_dates(dates), dates.dt.day_name().fillna('').tolist(),
+        frame['account'], frame['amount'], frame['type']
+    )):
+        record = {
+            "date": date,
+            "day": day,
+            "account": account,
+            "amount": float(amount),
+            "type": kind,
+            "flags": names[fired[i]].tolist()
+        }
+        if 'zscore' in detectors and not np.isnan(z[i]):
+            record["zscore"] = round(float(z[i]), 2)
+        records.append(record)
+    return records
@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from services.ai_agent import AIAgent
+from services.metrics import MetricsRegistry
+
+
+class AIAgentTest(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.dict('os.environ', {'OPENAI_API_KEY': ''}):
+            self.agent = AIAgent()
+
+    def test_fallback_analyses_are_cached(self):
+        variance = self.agent._fallback_variance_analysis({'revenue': 120.0}, {'revenue': 100.0}, 'Q1')
+        kpi = self.agent._fallback_kpi_analysis({'dso': 40.0}, {'dso': 45.0})
+        self.assertEqual(self.agent.cache.stats()["entries"], 2)
+        self.assertEqual(self.agent._fallback_variance_analysis({'revenue': 120.0}, {'revenue': 100.0}, 'Q1'), variance)
+        self.assertEqual(self.agent._fallback_kpi_analysis({'dso': 40.0}, {'dso': 45.0}), kpi)
+        self.assertEqual(self.agent.cache.hits, 2)
+
+    def test_completion_usage_is_recorded(self):
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='ok'))],
+            usage=SimpleNamespace(prompt_tokens=120, completion_tokens=8)
+        )
+        create = mock.AsyncMock(return_value=response)
+        self.agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        registry = MetricsRegistry(enabled=True)
+        with mock.patch('services.ai_agent.REGISTRY', registry):
+            reply = asyncio.run(self.agent._complete([{'role': 'user', 'content': 'hi'}], prompt_tokens=42))
+            asyncio.run(self.agent._complete([{'role': 'user', 'content': 'hi'}], prompt_tokens=42))
+        self.assertEqual(reply, 'ok')
+        self.assertEqual(create.call_count, 1)
+        rendered = registry.render()
+        self.assertIn(f'fintool_openai_tokens_total{{model="{self.agent.model}",kind="prompt"}} 120', rendered)
+        self.assertIn(f'fintool_openai_tokens_total{{model="{self.agent.model}",kind="completion"}} 8', rendered)
+        # Only the request actually sent is counted; the repeat was a cache hit
+        self.assertIn(f'fintool_openai_prompt_tokens_count{{model="{self.agent.model}"}} 1', rendered)
+        self.assertIn(f'fintool_openai_prompt_tokens_sum{{model="{self.agent.model}"}} 42', rendered)
+
+    def test_prompt_size_is_recorded_for_streamed_chat(self):
+        async def stream():
+            for piece in ('Hel', 'lo'):
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+        create = mock.AsyncMock(return_value=stream())
+        self.agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        registry = MetricsRegistry(enabled=True)
+
+        async def collect():
+            return [piece async for piece in self.agent.chat_stream('What is DSO?')]
+
+        with mock.patch('services.ai_agent.REGISTRY', registry):
+            self.assertEqual(''.join(asyncio.run(collect())), 'Hello')
+        rendered = registry.render()
+        self.assertIn(f'fintool_openai_prompt_tokens_count{{model="{self.agent.model}"}} 1', rendered)
+        self.assertNotIn(f'fintool_openai_prompt_tokens_sum{{model="{self.agent.model}"}} 0', rendered)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import io
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from services.csv_ingestion import CSVIngestor
+from services.ledger import Ledger, concat_frames
+
+
+class NonSeekable(io.RawIOBase):
+    def __init__(self, data: bytes):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.data.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+class CSVIngestorTest(unittest.TestCase):
+    def setUp(self):
+        rows = 1003
+        rng = np.random.default_rng(7)
+        frame = pd.DataFrame({
+            'date': (pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 90, rows), 'D')).strftime('%Y-%m-%d'),
+            'account': rng.choice(['Cash', 'Sales Revenue', 'Accounts Receivable'], rows),
+            'amount': rng.normal(100, 40, rows).round(2),
+            'type': rng.choice(['debit', 'credit'], rows),
+            'entity': rng.choice(['AU', 'NZ', None], rows),
+            'reference': np.arange(rows).astype(object),
+            'memo': np.where(np.arange(rows) > 600, 'split\n"line"', ''),
+        })
+        # Integers in the early chunks, a float in a later one
+        frame.loc[900, 'reference'] = 0.5
+        frame.loc[3, 'amount'] = np.nan
+        self.raw = frame.to_csv(index=False).encode()
+        self.ingestor = CSVIngestor(chunk_rows=100)
+
+    def expected(self) -> pd.DataFrame:
+        chunks = list(self.ingestor.chunks(io.BytesIO(self.raw)))
+        return Ledger.from_frame(concat_frames(chunks)).frame
+
+    def test_matches_concatenated_chunks(self):
+        ledger, stats = self.ingestor.ingest(io.BytesIO(self.raw))
+        pd.testing.assert_frame_equal(ledger.frame, self.expected())
+        self.assertEqual(stats['rows'], 1003)
+        self.assertEqual(stats['chunks'], 11)
+
+    def test_non_seekable_source(self):
+        ledger, _ = self.ingestor.ingest(io.BufferedReader(NonSeekable(self.raw)))
+        pd.testing.assert_frame_equal(ledger.frame, self.expected())
+
+    def test_row_capacity_is_an_upper_bound(self):
+        capacity = CSVIngestor._row_capacity(io.BytesIO(self.raw))
+        self.assertGreaterEqual(capacity, 1003)
+        self.assertEqual(CSVIngestor._row_capacity(io.BytesIO(b'date,account\n2024-01-01,Cash')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import threading
+import time
+import unittest
+
+from services.dataset_store import DatasetStore
+from services.kpi_calculator import KPICalculator
+from services.ledger import Ledger
+
+
+def ledger(amount: float = 100.0) -> Ledger:
+    return Ledger.from_transactions([
+        {'date': '2024-01-01', 'account': 'Accounts Receivable', 'amount': amount, 'type': 'debit'},
+        {'date': '2024-01-01', 'account': 'Sales Revenue', 'amount': amount, 'type': 'credit'},
+    ])
+
+
+class BlockingBuild:
+    """Aggregates builder that waits until released, counting its calls"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self, data: Ledger):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(10)
+        return KPICalculator().aggregate(data)
+
+
+class DatasetStoreLockingTest(unittest.TestCase):
+    def setUp(self):
+        self.store = DatasetStore()
+        self.dataset_id = self.store.put(ledger())
+        self.build = BlockingBuild()
+
+    def tearDown(self):
+        self.build.release.set()
+
+    def start_build(self) -> threading.Thread:
+        worker = threading.Thread(target=self.store.aggregates, args=(self.dataset_id, self.build))
+        worker.start()
+        self.assertTrue(self.build.started.wait(5))
+        return worker
+
+    def test_lookups_do_not_wait_for_an_aggregates_build(self):
+        worker = self.start_build()
+
+        started = time.perf_counter()
+        other_id = self.store.put(ledger(5.0))
+        self.assertIsNotNone(self.store.get(self.dataset_id))
+        other = self.store.aggregates(other_id, KPICalculator().aggregate)
+        self.store.stats()
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(other.rows, 2)
+
+        self.build.release.set()
+        worker.join(5)
+        self.assertEqual(self.build.calls, 1)
+
+    def test_concurrent_requests_share_one_build(self):
+        worker = self.start_build()
+        waiting = threading.Thread(target=self.store.aggregates, args=(self.dataset_id, self.build))
+        waiting.start()
+        self.build.release.set()
+        worker.join(5)
+        waiting.join(5)
+        self.assertEqual(self.build.calls, 1)
+
+    def test_appends_are_not_lost(self):
+        workers = [
+            threading.Thread(target=self.store.append, args=(self.dataset_id, ledger(1.0), KPICalculator().aggregate))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(10)
+        self.assertEqual(len(self.store.get(self.dataset_id)), 10)
+        self.assertEqual(self.store.aggregates(self.dataset_id, KPICalculator().aggregate).rows, 10)
+
+    def test_deleted_dataset_is_not_republished(self):
+        worker = self.start_build()
+        self.assertTrue(self.store.delete(self.dataset_id))
+        self.build.release.set()
+        worker.join(5)
+        self.assertIsNone(self.store.get(self.dataset_id))
+        self.assertIsNone(self.store.aggregates(self.dataset_id, KPICalculator().aggregate))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class DatasetStoreSizeTest(unittest.TestCase):
+    def entity_ledger(self, rows: int) -> Ledger:
+        return Ledger.from_transactions([
+            {'date': f'2024-01-{day % 28 + 1:02d}', 'account': 'Sales Revenue', 'amount': float(day),
+             'type': 'credit', 'entity': f'E{day % 8}', 'memo': f'invoice {day}'}
+            for day in range(rows)
+        ])
+
+    def test_memoized_values_count_towards_the_limit(self):
+        big, small = self.entity_ledger(4000), self.entity_ledger(40)
+        limit = DatasetStore.sizeof(big) + DatasetStore.sizeof(small) + 4096
+        store = DatasetStore(max_bytes=limit)
+        big_id = store.put(big)
+        small_id = store.put(small)
+
+        for entity in big.entity.categories:
+            store.get(big_id).for_entity(entity)
+        self.assertIsNotNone(store.get(big_id))
+        # The per-entity copies pushed the store over its limit: the older dataset goes
+        self.assertIsNone(store.get(small_id))
+        self.assertGreater(store.stats()["bytes"], DatasetStore.sizeof(big))
@@ -0,0 +1,80 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+import main
+from services.ledger import Ledger
+from tests.test_dataset_store import BlockingBuild
+
+
+TRANSACTIONS = [
+    {'date': '2024-01-01', 'account': 'Accounts Receivable', 'amount': 100.0, 'type': 'debit', 'entity': 'A'},
+    {'date': '2024-01-01', 'account': 'Sales Revenue', 'amount': 100.0, 'type': 'credit', 'entity': 'A'},
+]
+
+
+class EventLoopResponsivenessTest(unittest.TestCase):
+    """Requests share one event loop here, as they do under uvicorn"""
+
+    def setUp(self):
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.dataset_id = main.dataset_store.put(Ledger.from_transactions(TRANSACTIONS))
+        self.build = BlockingBuild()
+
+    def tearDown(self):
+        self.build.release.set()
+        main.dataset_store.delete(self.dataset_id)
+        self.client.__exit__(None, None, None)
+
+    def test_health_answers_while_a_dataset_build_is_held(self):
+        responses = {}
+
+        def statements():
+            responses['statements'] = self.client.post(
+                '/api/generate-statements', json={'data': {}, 'dataset_id': self.dataset_id}
+            )
+
+        with mock.patch.object(main.kpi_calculator, 'aggregate', self.build):
+            worker = threading.Thread(target=statements)
+            worker.start()
+            self.assertTrue(self.build.started.wait(5))
+
+            started = time.perf_counter()
+            health = self.client.get('/api/health')
+            dso = self.client.post('/api/kpi/dso', json={'dataset_id': self.dataset_id})
+            elapsed = time.perf_counter() - started
+
+            self.build.release.set()
+            worker.join(10)
+
+        self.assertEqual(health.status_code, 200)
+        self.assertEqual(health.json()['compute_pool']['running'], 1)
+        self.assertEqual(dso.status_code, 200)
+        self.assertLess(elapsed, 2.0)
+        self.assertEqual(responses['statements'].status_code, 200)
+        self.assertEqual(self.build.calls, 1)
+
+    def test_chat_parses_transactions_on_the_compute_pool(self):
+        offloaded = []
+        offload = main.ai_agent.offload
+
+        async def recording(fn, *args):
+            offloaded.append(getattr(fn, '__name__', repr(fn)))
+            return await offload(fn, *args)
+
+        with mock.patch.object(main.ai_agent, 'offload', recording), \
+                mock.patch.object(main, 'compute', wraps=main.compute) as compute:
+            response = self.client.post('/api/ai/chat', json={
+                'message': 'Which entity has the highest revenue?', 'transactions': TRANSACTIONS
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(Ledger.from_transactions, [call.args[0] for call in compute.call_args_list])
+        self.assertIn('_fallback_chat' if main.ai_agent.client is None else '_build_chat_messages', offloaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import httpx
+
+from services.fx_rate_service import FXRateService
+from services.fx_rate_store import FXRateStore
+from services.ledger import Ledger
+
+
+class ConvertLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.service = FXRateService(store=FXRateStore(':memory:'))
+        self.ledger = Ledger.from_transactions([
+            {'date': '2024-03-01', 'account': 'Sales Revenue', 'amount': 100.0, 'type': 'credit', 'currency': 'GBP'},
+            {'date': '2024-03-02', 'account': 'Cash', 'amount': 50.0, 'type': 'debit', 'currency': 'EUR'},
+            {'date': '2024-03-02', 'account': 'Cash', 'amount': 10.0, 'type': 'debit', 'currency': 'AUD'},
+        ])
+
+    def test_unreachable_upstream_raises_instead_of_using_fallback_rates(self):
+        failing = mock.AsyncMock(side_effect=httpx.ConnectError("upstream unreachable"))
+        with mock.patch.object(self.service, '_fetch_json', failing):
+            with self.assertRaises(ValueError) as raised:
+                asyncio.run(self.service.convert_ledger(self.ledger, 'AUD'))
+        self.assertIn('FX rates unavailable', str(raised.exception))
+        self.assertTrue(failing.called)
+
+    def test_converts_with_upstream_rates(self):
+        async def fetch(url):
+            date = url.rsplit('/', 1)[-1]
+            return {'base': 'AUD', 'rates': {date: {'GBP': 0.5, 'EUR': 0.6}}}
+
+        with mock.patch.object(self.service, '_fetch_json', side_effect=fetch):
+            converted, stats = asyncio.run(self.service.convert_ledger(self.ledger, 'AUD'))
+        self.assertEqual(stats['sources'], ['exchangerate-api.io'])
+        self.assertEqual(stats['rows_converted'], 2)
+        amounts = dict(zip(converted.frame['original_currency'].astype(str), converted.frame['amount']))
+        self.assertAlmostEqual(amounts['GBP'], 200.0)
+        self.assertAlmostEqual(amounts['EUR'], 50.0 / 0.6)
+        self.assertAlmostEqual(amounts['AUD'], 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
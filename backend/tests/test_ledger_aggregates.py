@@ -0,0 +1,29 @@
+import unittest
+
+from services.kpi_calculator import KPICalculator
+from services.ledger import Ledger
+
+
+def transactions(days):
+    return [
+        {'date': f'2024-03-{day:02d}', 'account': 'Sales Revenue', 'amount': 100.0 * day, 'type': 'credit',
+         'entity': 'AU' if day % 2 else 'NZ'}
+        for day in days
+    ]
+
+
+class RevenueCubeCacheTest(unittest.TestCase):
+    def test_cube_is_built_once_per_snapshot(self):
+        calculator = KPICalculator()
+        aggregates = calculator.aggregate(transactions(range(1, 11)))
+        self.assertIs(aggregates.revenue_cube(), aggregates.revenue_cube())
+
+        appended = aggregates.append(Ledger.from_transactions(transactions(range(11, 16))))
+        self.assertIsNot(appended.revenue_cube(), aggregates.revenue_cube())
+        expected = calculator.compute_from_aggregates(calculator.aggregate(transactions(range(1, 16))),
+                                                      as_of_date='2024-03-31')
+        self.assertEqual(calculator.compute_from_aggregates(appended, as_of_date='2024-03-31'), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
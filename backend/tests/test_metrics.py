@@ -0,0 +1,37 @@
+import unittest
+from unittest import mock
+
+from services.kpi_calculator import KPICalculator
+from services.ledger import Ledger
+from services.metrics import MetricsRegistry
+
+
+class TimedRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.ledger = Ledger.from_transactions([
+            {'date': '2024-03-01', 'account': 'Sales Revenue', 'amount': 100.0, 'type': 'credit'},
+            {'date': '2024-03-02', 'account': 'Accounts Receivable', 'amount': 100.0, 'type': 'debit'},
+            {'date': '2024-03-03', 'account': 'Cash', 'amount': 40.0, 'type': 'debit'},
+        ])
+        self.registry = MetricsRegistry(enabled=True)
+
+    def rows(self, stage):
+        line = f'fintool_stage_rows_total{{stage="{stage}"}} '
+        for row in self.registry.render().splitlines():
+            if row.startswith(line):
+                return int(row[len(line):])
+        return None
+
+    def test_rows_counted_for_keyword_ledger(self):
+        with mock.patch('services.metrics.REGISTRY', self.registry):
+            KPICalculator().calculate_dso(transactions=self.ledger, period_days=30)
+        self.assertEqual(self.rows('kpi.dso'), 3)
+
+    def test_rows_counted_for_positional_ledger(self):
+        with mock.patch('services.metrics.REGISTRY', self.registry):
+            KPICalculator().calculate_dso(self.ledger)
+        self.assertEqual(self.rows('kpi.dso'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
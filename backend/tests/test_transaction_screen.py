@@ -0,0 +1,60 @@
+import unittest
+import warnings
+
+import numpy as np
+
+from services.ledger import Ledger
+from services.transaction_screen import AnomalyDetector, RowHashes, TransactionScreen
+
+
+def transactions(start, stop):
+    return [
+        {'date': '2024-01-%02d' % (i % 28 + 1), 'account': 'Sales Revenue', 'amount': 100.0 + i, 'type': 'credit'}
+        for i in range(start, stop)
+    ]
+
+
+class AnomalyDetectorTest(unittest.TestCase):
+    def test_single_row_accounts_do_not_warn(self):
+        ledger = Ledger.from_transactions(transactions(0, 10) + [
+            {'date': '2024-01-05', 'account': 'Suspense', 'amount': 5.0, 'type': 'debit'}
+        ])
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            flags, _ = AnomalyDetector().flags(ledger)
+        self.assertFalse(flags['zscore'].any())
+
+
+class TransactionScreenTest(unittest.TestCase):
+    def test_duplicates_are_found_across_chunks(self):
+        chunks = [transactions(0, 50), transactions(50, 100), transactions(0, 5)]
+        screen = TransactionScreen(AnomalyDetector(), 'revenue', detectors=['duplicate'])
+        result = screen.run(lambda: (Ledger.from_transactions(chunk) for chunk in chunks))
+        self.assertEqual(result['rows'], 105)
+        self.assertEqual(result['anomalies']['counts'], {'duplicate': 5})
+        self.assertEqual(len(screen_hashes(chunks)), 100)
+
+    def test_row_hashes_membership(self):
+        hashes = RowHashes()
+        rng = np.random.default_rng(3)
+        added = []
+        for size in (5, 40, 3, 3, 100):
+            batch = rng.integers(0, 2 ** 63, size, dtype=np.uint64)
+            hashes.add(batch)
+            added.append(batch)
+        added = np.concatenate(added)
+        self.assertEqual(len(hashes), 151)
+        self.assertTrue(hashes.contains(added).all())
+        self.assertFalse(hashes.contains(added + np.uint64(1)).any())
+        self.assertLessEqual(len(hashes.runs), 3)
+
+
+def screen_hashes(chunks):
+    seen = None
+    for chunk in chunks:
+        _, seen = AnomalyDetector().flags(Ledger.from_transactions(chunk), seen=seen)
+    return seen
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ import FilterPanel from './components/FilterPanel'
 import FXRatePanel from './components/FXRatePanel'
 import SummaryPanel from './components/SummaryPanel'
 import { buildApiUrl } from './utils/api'
+import { toColumnar } from './utils/columnar'
 import './App.css'
 
 interface FinancialData {
@@ -19,6 +20,7 @@ interface FinancialData {
 function App() {
   const [allTransactions, setAllTransactions] = useState<any[]>([]) // Store unfiltered transactions
   const [transactions, setTransactions] = useState<any[]>([]) // Displayed transactions (may be filtered)
+  const [datasetId, setDatasetId] = useState<string | null>(null) // Server-side copy of the uploaded ledger
   const [financialData, setFinancialData] = useState<FinancialData | null>(null)
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
@@ -53,17 +55,16 @@ function App() {
       // Store all transactions (unfiltered)
       setAllTransactions(uploadData.transactions)
       setTransactions(uploadData.transactions)
+      setDatasetId(uploadData.dataset_id)
 
-      // Generate financial statements with all transactions initially
+      // Generate financial statements with all transactions initially (the server already holds them)
       const statementsResponse = await fetch(buildApiUrl('/api/generate-statements'), {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          data: {
-            transactions: uploadData.transactions,
-          },
+          dataset_id: uploadData.dataset_id,
         }),
       })
 
@@ -114,16 +115,19 @@ function App() {
 
       setError(null) // Clear previous errors
 
-      // Regenerate statements with filtered data
+      // Regenerate statements with filtered data (filters are applied server-side to the stored dataset)
       fetch(buildApiUrl('/api/generate-statements'), {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({
-          data: {
-            transactions: filteredTransactions,
-          },
+        body: JSON.stringify(datasetId ? {
+          dataset_id: datasetId,
+          entity: newFilters.entity,
+          start_date: newFilters.startDate,
+          end_date: newFilters.endDate,
+        } : {
+          columns: toColumnar(filteredTransactions),
         }),
       })
         .then(async res => {
@@ -193,6 +197,7 @@ function App() {
         <FinancialChatbot 
           financialData={financialData || undefined} 
           transactions={transactions}
+          datasetId={datasetId || undefined}
           selectedEntity={filters.entity || undefined}
         />
       </main>
@@ -1,5 +1,6 @@
 import { useState, useRef, useEffect } from 'react'
 import { buildApiUrl } from '../utils/api'
+import { toColumnar } from '../utils/columnar'
 import './FinancialChatbot.css'
 
 interface Message {
@@ -15,10 +16,11 @@ interface FinancialChatbotProps {
     cash_flow?: any
   }
   transactions?: any[]
+  datasetId?: string
   selectedEntity?: string
 }
 
-function FinancialChatbot({ financialData, transactions = [], selectedEntity }: FinancialChatbotProps) {
+function FinancialChatbot({ financialData, transactions = [], datasetId, selectedEntity }: FinancialChatbotProps) {
   const [messages, setMessages] = useState<Message[]>([]) // 移除初始问候消息
   const [input, setInput] = useState('')
   const [loading, setLoading] = useState(false)
@@ -47,6 +49,9 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
     setLoading(true)
 
     try {
+      // Reference the server-side dataset when available instead of re-posting every transaction
+      const ledgerPayload = datasetId ? { dataset_id: datasetId } : { transactions }
+
       // Check if it's a KPI/revenue analytics question and call appropriate endpoint
       let kpiResult = null
       
@@ -54,7 +59,7 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
         const response = await fetch(buildApiUrl('/api/kpi/revenue-ytd'), {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ transactions, entity: selectedEntity })
+          body: JSON.stringify({ ...ledgerPayload, entity: selectedEntity })
         })
         if (response.ok) {
           kpiResult = await response.json()
@@ -63,7 +68,7 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
         const response = await fetch(buildApiUrl('/api/kpi/revenue-variance'), {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ transactions, entity: selectedEntity })
+          body: JSON.stringify({ ...ledgerPayload, entity: selectedEntity })
         })
         if (response.ok) {
           kpiResult = await response.json()
@@ -72,7 +77,7 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
         const response = await fetch(buildApiUrl('/api/kpi/trailing-3m'), {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ transactions, entity: selectedEntity })
+          body: JSON.stringify({ ...ledgerPayload, entity: selectedEntity })
         })
         if (response.ok) {
           kpiResult = await response.json()
@@ -81,7 +86,7 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
         const response = await fetch(buildApiUrl('/api/kpi/top-n'), {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ transactions, entity: selectedEntity })
+          body: JSON.stringify({ ...ledgerPayload, entity: selectedEntity })
         })
         if (response.ok) {
           kpiResult = await response.json()
@@ -90,7 +95,7 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
         const response = await fetch(buildApiUrl('/api/kpi/unusual-transactions'), {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ transactions, entity: selectedEntity })
+          body: JSON.stringify({ ...ledgerPayload, entity: selectedEntity })
         })
         if (response.ok) {
           kpiResult = await response.json()
@@ -99,7 +104,7 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
         const response = await fetch(buildApiUrl('/api/kpi/ar-aging'), {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ transactions, entity: selectedEntity })
+          body: JSON.stringify({ ...ledgerPayload, entity: selectedEntity })
         })
         if (response.ok) {
           kpiResult = await response.json()
@@ -108,7 +113,7 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
         const response = await fetch(buildApiUrl('/api/kpi/dso'), {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ transactions, entity: selectedEntity, period_days: 30 })
+          body: JSON.stringify({ ...ledgerPayload, entity: selectedEntity, period_days: 30 })
         })
         if (response.ok) {
           kpiResult = await response.json()
@@ -163,9 +168,11 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
       const requestPayload = {
         message: enhancedMessage,
         financial_data: financialContext,
-        transactions: transactions && transactions.length > 0 ? transactions : null,
+        columns: !datasetId && transactions && transactions.length > 0 ? toColumnar(transactions) : null,
+        dataset_id: datasetId || null,
         conversation_history: conversationHistory,
-        entity: selectedEntity
+        entity: selectedEntity,
+        stream: true
       }
       
       console.log('Sending chat request:', {
@@ -196,6 +203,35 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
         throw new Error(`${errorDetail} (Status: ${response.status})`)
       }
 
+      // Streamed reply: render tokens as server-sent events arrive
+      const contentType = response.headers.get('content-type') || ''
+      if (response.body && contentType.includes('text/event-stream')) {
+        setMessages(prev => [...prev, { role: 'assistant', content: '', timestamp: new Date() }])
+        const reader = response.body.getReader()
+        const decoder = new TextDecoder()
+        let buffer = ''
+        while (true) {
+          const { done, value } = await reader.read()
+          if (done) break
+          buffer += decoder.decode(value, { stream: true })
+          const events = buffer.split('\n\n')
+          buffer = events.pop() || ''
+          for (const event of events) {
+            const dataLine = event.split('\n').find(line => line.startsWith('data: '))
+            if (!dataLine) continue
+            const payload = JSON.parse(dataLine.slice(6))
+            if (payload.error) throw new Error(payload.error)
+            if (payload.delta) {
+              setMessages(prev => {
+                const last = prev[prev.length - 1]
+                return [...prev.slice(0, -1), { ...last, content: last.content + payload.delta }]
+              })
+            }
+          }
+        }
+        return
+      }
+
       const data = await response.json()
       
       const assistantMessage: Message = {
@@ -283,7 +319,7 @@ function FinancialChatbot({ financialData, transactions = [], selectedEntity }:
             </div>
           </div>
         ))}
-        {loading && (
+        {loading && messages[messages.length - 1]?.role !== 'assistant' && (
           <div className="message assistant-message">
             <div className="message-content">
               <div className="message-avatar">🤖</div>
@@ -0,0 +1,70 @@
+/**
+ * Columnar transaction encoding
+ *
+ * Sends transactions as parallel arrays instead of one object per row.
+ * Repeated text columns (date, account, type, entity, currency) are
+ * dictionary-encoded: the column holds integer codes into a list of
+ * distinct values, -1 for missing. The backend decodes this straight into
+ * typed arrays, and the body is several times smaller than a list of objects.
+ */
+
+export interface ColumnarTransactions {
+  date: number[]
+  account: number[]
+  amount: (number | null)[]
+  type: number[]
+  entity?: number[]
+  currency?: number[]
+  dictionaries: Record<string, string[]>
+}
+
+const DICTIONARY_COLUMNS = ['date', 'account', 'type', 'entity', 'currency'] as const
+
+const entityOf = (t: any) => t.entity || t.subsidiary || t.company
+
+/**
+ * Encodes transaction objects (as returned by /api/upload-csv) for the `columns` request field
+ */
+export const toColumnar = (transactions: any[]): ColumnarTransactions => {
+  const dictionaries: Record<string, string[]> = {}
+  const columns: Record<string, number[]> = {}
+
+  for (const name of DICTIONARY_COLUMNS) {
+    const values = transactions.map(t => (name === 'entity' ? entityOf(t) : t[name]))
+    // Entity and currency are optional columns
+    if ((name === 'entity' || name === 'currency') && values.every(v => v === undefined || v === null || v === '')) {
+      continue
+    }
+    const lookup = new Map<string, number>()
+    const dictionary: string[] = []
+    columns[name] = values.map(value => {
+      if (value === undefined || value === null || value === '') return -1
+      const key = String(value)
+      let code = lookup.get(key)
+      if (code === undefined) {
+        code = dictionary.length
+        lookup.set(key, code)
+        dictionary.push(key)
+      }
+      return code
+    })
+    dictionaries[name] = dictionary
+  }
+
+  return {
+    date: columns.date,
+    account: columns.account,
+    amount: transactions.map(t => {
+      const amount = typeof t.amount === 'number' ? t.amount : parseFloat(t.amount)
+      return Number.isFinite(amount) ? amount : null
+    }),
+    type: columns.type,
+    ...(columns.entity ? { entity: columns.entity } : {}),
+    ...(columns.currency ? { currency: columns.currency } : {}),
+    dictionaries,
+  }
+}
+
+export default {
+  toColumnar,
+}